@@ -1,4 +1,4 @@
 """An entity/component system library for games."""
 # Provide a common namespace for these classes.
-from .models import Entity, Component, System, UpdateLogic  # NOQA
+from .models import Entity, Component, Tracked, System, UpdateLogic  # NOQA
 from .managers import EntityManager, SystemManager  # NOQA
\ No newline at end of file
@@ -2,12 +2,15 @@
 Entity and System Managers.
 ---------------------------
 """
+import threading
+from array import array
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from .exceptions import (
     NonexistentComponentTypeForEntity, DuplicateSystemTypeError,
     SystemAlreadyAddedToManagerError)
-from .models import Entity
+from .models import Entity, Tracked
 
 
 class EntityManager(object):
@@ -15,7 +18,17 @@ class EntityManager(object):
 
     def __init__(self):
         self._database=OrderedDict()
-        self._next_guid=0
+        self._entities={} # entity -> {component types}, the reverse index of _database
+        self._next_guid=0 # next never used entity index
+        self._generations=array('L') # index -> current generation
+        self._free=[] # recycled indices
+        self._dense={} # component type -> list indexed by entity index
+        self._versions={} # component type -> number of components added or removed
+        self._deferring=0 # > 0 while structural changes are queued
+        self._commands=[] # queued (method, args) structural changes
+        self._local=threading.local() # per-system command queue of a parallel update
+        self._changes={} # component type -> OrderedDict component -> tick of its last change
+        self._tick=0 # tick stamped on tracked changes, set by the system manager
 
     @property
     def database(self):
@@ -27,49 +40,172 @@ class EntityManager(object):
         return self._database
 
     def create_entity(self, name=""):
-        """Return a new entity instance with the current lowest GUID value.
-        Does not store a reference to it, and does not make any entries in the
-        database referencing it.
+        """Return a new entity instance. Its index is a recycled one (from a
+        removed entity, with the next generation) if any, otherwise the next
+        unused one, so indices stay dense. Does not store a reference to it,
+        and does not make any entries in the database referencing it, so it is
+        safe (and immediate) while deferring.
+
+        Inside a system that a parallel :meth:`SystemManager.update` runs
+        concurrently with others, or ahead of a system added before it, the
+        entity is returned without a GUID: its index is assigned once the
+        systems added before it are done, in their sequential order, so the
+        indices are the same as with a sequential update. Until then the
+        handle may be given to :meth:`add_component` (the change is queued
+        anyway) but not hashed or compared. A system running alone, after all
+        the systems added before it, gets ordinary entities.
 
         :return: the new entity
         :rtype: :class:`ecs.models.Entity`
         """
-        entity=Entity(self._next_guid, name)
-        self._next_guid+=1
-        return entity
+        created=getattr(self._local, 'created', None)
+        if created is not None:
+            entity=Entity(None, name)
+            created.append(entity)
+            return entity
+        return Entity(self._new_guid(), name)
+
+    def _new_guid(self):
+        if self._free:
+            index=self._free.pop()
+        else:
+            index=self._next_guid
+            self._next_guid+=1
+            self._generations.append(0)
+        return (self._generations[index] << Entity.INDEX_BITS) | index
+
+    def is_alive(self, entity):
+        """False if the entity was removed (its handle is stale)."""
+        index=entity.index
+        return index < len(self._generations) and self._generations[index] == entity.generation
+
+    def dense(self, component_type):
+        """Return a list indexed by entity index holding the component of
+        ``component_type`` of each entity (None if it has none). The list is
+        built on the first call, then kept up to date by the manager, so it can
+        back array-based processing of a component type. Do not modify it.
+
+        :param component_type: a type of created component
+        :type component_type: :class:`type` which is :class:`Component` subclass
+        :rtype: :class:`list`
+        """
+        store=self._dense.get(component_type)
+        if store is None:
+            store=[None]*self._next_guid
+            for entity, component in self.pairs_for_type(component_type):
+                store[entity.index]=component
+            self._dense[component_type]=store
+        return store
+
+    def version(self, component_type):
+        """Return a counter of the components of ``component_type`` added to
+        or removed from the database. A system keeping its own view of a
+        component type compares it to the value it last saw to know when to
+        refresh that view, even when a removal and an addition leave the
+        number of components unchanged.
+
+        :param component_type: a type of created component
+        :type component_type: :class:`type` which is :class:`Component` subclass
+        :rtype: :class:`int`
+        """
+        return self._versions.get(component_type, 0)
+
+    @property
+    def deferring(self):
+        """True while structural changes (:meth:`add_component`,
+        :meth:`remove_component`, :meth:`remove_entity`) are queued instead of
+        applied, i.e. during :meth:`SystemManager.update`."""
+        return self._deferring > 0
+
+    def begin_deferred(self):
+        """Start queuing structural changes. Calls may be nested; the queue is
+        applied when the outermost :meth:`end_deferred` is reached. This keeps
+        the views returned by :meth:`pairs_for_type` valid while systems
+        iterate over them."""
+        self._deferring+=1
+
+    def end_deferred(self):
+        """Stop queuing structural changes and apply the queue if this closes
+        the outermost :meth:`begin_deferred`."""
+        self._deferring-=1
+        if not self._deferring:
+            self.flush()
+
+    def _queue(self):
+        commands=getattr(self._local, 'commands', None)
+        return self._commands if commands is None else commands
+
+    def flush(self):
+        """Apply the queued structural changes in the order they were made."""
+        while self._commands:
+            commands, self._commands=self._commands, []
+            for command, args in commands:
+                command(*args)
 
     def add_component(self, entity, component_instance):
         """Add a component to the database and associate it with the given entity.
+        While deferring, the change is queued and applied at the end of the tick.
 
         :param entity: entity to associate
         :type entity: :class:`ecs.models.Entity`
         :param component_instance: component to add to the entity
         :type component_instance: :class:`ecs.models.Component`
         """
+        if self._deferring:
+            self._queue().append((self._add_component, (entity, component_instance)))
+        else:
+            self._add_component(entity, component_instance)
+
+    def _add_component(self, entity, component_instance):
         component_type=type(component_instance)
         if component_type not in self._database:
             self._database[component_type]=OrderedDict()
 
         self._database[component_type][entity]=component_instance
+        self._versions[component_type]=self._versions.get(component_type, 0)+1
+        self._entities.setdefault(entity, set()).add(component_type)
+        store=self._dense.get(component_type)
+        if store is not None:
+            if len(store) < self._next_guid:
+                store.extend([None]*(self._next_guid-len(store)))
+            store[entity.index]=component_instance
         component_instance.entity = entity
+        component_instance._manager = self
 
     def remove_component(self, entity, component_type):
         """Remove the component of ``component_type`` associated with
         entity from the database. Doesn't do any kind of data-teardown. It is
         up to the system calling this code to do that. In the future, a
         callback system may be used to implement type-specific destructors.
+        While deferring, the change is queued and applied at the end of the tick.
 
         :param entity: entity to associate
         :type entity: :class:`ecs.models.Entity`
         :param component_type: component type to remove from the entity
         :type component_type: :class:`type` which is :class:`Component` subclass
         """
+        if self._deferring:
+            self._queue().append((self._remove_component, (entity, component_type)))
+        else:
+            self._remove_component(entity, component_type)
+
+    def _remove_component(self, entity, component_type):
         try:
-            del self._database[component_type][entity]
-            if self._database[component_type]:
-                del self._database[component_type]
+            component=self._database[component_type].pop(entity)
         except KeyError:
-            pass
+            return
+        if not self._database[component_type]:
+            del self._database[component_type]
+        self._versions[component_type]+=1
+        Tracked.forget(component)
+        component._manager=None
+        store=self._dense.get(component_type)
+        if store is not None:
+            store[entity.index]=None
+        types=self._entities[entity]
+        types.discard(component_type)
+        if not types:
+            del self._entities[entity]
 
     def pairs_for_type(self, component_type):
         """Return an iterator over ``(entity, component_instance)`` tuples for
@@ -114,37 +250,118 @@ class EntityManager(object):
             raise NonexistentComponentTypeForEntity(
                 entity, component_type)
 
+    def changed_since(self, component_type, tick):
+        """Return the ``(entity, component_instance)`` pairs of
+        ``component_type`` whose :class:`ecs.models.Tracked` state changed at or
+        after ``tick``, from the oldest to the latest change. Only the changed
+        components are visited. Tracking must have been enabled for the type
+        (see :meth:`ecs.models.Tracked.enable`), otherwise nothing is reported.
+
+        :param component_type: a type of created component
+        :type component_type: :class:`type` which is :class:`Component` subclass
+        :param tick: time (see :attr:`SystemManager.time`) of the oldest change to report
+        :rtype: :class:`list` of (:class:`ecs.models.Entity`, :class:`ecs.models.Component`)
+        """
+        log=self._changes.get(component_type)
+        components=self._database.get(component_type)
+        if not log or not components:
+            return []
+        changed=[]
+        with Tracked.lock:
+            for component in reversed(log):
+                if log[component] < tick:
+                    break
+                entity=getattr(component, 'entity', None)
+                if components.get(entity) is component:
+                    changed.append((entity, component))
+        changed.reverse()
+        return changed
+
+    def clear_changes(self):
+        """Empty the change log of :meth:`changed_since` (for instance between
+        two replications, see :meth:`SystemManager.reset`)."""
+        with Tracked.lock:
+            self._changes.clear()
+
+    def component_types_for_entity(self, entity):
+        """Return the component types associated with the entity, using the
+        reverse index (no scan of the database).
+
+        :param entity: associated entity
+        :type entity: :class:`ecs.models.Entity`
+        :return: component types of the entity (empty if it has none)
+        :rtype: :class:`frozenset` of :class:`type`
+        """
+        return frozenset(self._entities.get(entity, ()))
+
+    def components_for_entity(self, entity):
+        """Return the components associated with the entity.
+
+        :param entity: associated entity
+        :type entity: :class:`ecs.models.Entity`
+        :return: component instances of the entity (empty if it has none)
+        :rtype: :class:`list` of :class:`ecs.models.Component`
+        """
+        return [self._database[comp_type][entity]
+                for comp_type in self._entities.get(entity, ())]
+
     def remove_entity(self, entity):
         """Remove all components from the database that are associated with
         the entity, with the side-effect that the entity is also no longer
-        in the database.
+        in the database. Only the component types of the entity are visited.
+        While deferring, the change is queued and applied at the end of the tick.
 
         :param entity: entity to remove
         :type entity: :class:`ecs.models.Entity`
         """
-        # For Python 2, don't use iterkeys(), otherwise we will get a
-        # RuntimeError about mutating the length of the dictionary at runtime.
-        # For Python 3, we can't even use keys(), because that is a view object
-        # that acts like iterkeys(). We therefore make a copy using list() to
-        # avoid modifying the iterator.
-        for comp_type in list(self._database.keys()):
-            try:
-                del self._database[comp_type][entity]
-                if self._database[comp_type]:
-                    del self._database[comp_type]
-            except KeyError:
-                pass
+        if self._deferring:
+            self._queue().append((self._remove_entity, (entity,)))
+        else:
+            self._remove_entity(entity)
+
+    def _remove_entity(self, entity):
+        for comp_type in self._entities.pop(entity, ()):
+            components=self._database[comp_type]
+            component=components.pop(entity)
+            Tracked.forget(component)
+            component._manager=None
+            if not components:
+                del self._database[comp_type]
+            self._versions[comp_type]+=1
+            store=self._dense.get(comp_type)
+            if store is not None:
+                store[entity.index]=None
+        if self.is_alive(entity): # the index is recycled with the next generation
+            self._generations[entity.index]+=1
+            self._free.append(entity.index)
+
+    def remove_entities(self, entities):
+        """Remove several entities at once, for instance a whole sector or
+        all the mobiles between two scenarios.
+
+        :param entities: entities to remove
+        :type entities: iterable of :class:`ecs.models.Entity`
+        """
+        for entity in entities:
+            self.remove_entity(entity)
 
 
 class SystemManager(object):
     """A container and manager for :class:`ecs.models.System` objects."""
 
-    def __init__(self, entity_manager):
+    def __init__(self, entity_manager, workers=None):
         """:param entity_manager: this manager's entity manager
         :type entity_manager: :class:`SystemManager`
+        :param workers: number of threads used to run systems with non
+            conflicting ``reads``/``writes`` concurrently; None or 1 runs the
+            systems one after another
         """
+        self._executor=ThreadPoolExecutor(workers) if workers and workers > 1 else None
+        self._waves={} # tuple of due systems -> list of waves of indices
         self._systems=[]
         self._system_types={}
+        self._schedules={} # system -> [period, phase, last run, next run]
+        self._time=0 # sum of the dt given to update
         self._entity_manager=entity_manager
 
     # Allow getting the list of systems but not directly setting it.
@@ -157,11 +374,30 @@ class SystemManager(object):
         """
         return self._systems
 
-    def add_system(self, system_instance):
+    @property
+    def time(self):
+        """Sum of the ``dt`` given to :meth:`update` since creation or :meth:`reset`."""
+        return self._time
+
+    def add_system(self, system_instance, period=None, phase=0):
         """Add a :class:`ecs.models.System` instance to the manager.
 
+        By default a system runs every frame. With a ``period``, it only runs
+        when due, at times ``phase``, ``phase + period``, ... (time being the sum
+        of the ``dt`` given to :meth:`update`), and its ``update`` receives the
+        time elapsed since its previous run. Slow processes (pot chemistry
+        every 60 s, shift statistics every 43200 s) then skip the per-second
+        dispatch:
+
+        .. code-block:: python
+
+            class UpdateCuve(ecs.UpdateLogic): pass
+            system_manager.add_system(UpdateCuve([Cuve]), period=60)
+
         :param system_instance: instance of a system
         :type system_instance: :class:`ecs.models.System`
+        :param period: time between two runs, None to run every frame
+        :param phase: time of the first run
         :raises: :class:`ecs.exceptions.DuplicateSystemTypeError` when the
             system type is already present in this manager
         :raises: :class:`ecs.exceptions.SystemAlreadyAddedToManagerError` when
@@ -177,6 +413,8 @@ class SystemManager(object):
         system_instance.system_manager=self
         self._system_types[system_type]=system_instance
         self._systems.append(system_instance)
+        if period is not None:
+            self._schedules[system_instance]=[period, phase, phase-period, phase]
 
     def remove_system(self, system_type):
         """Tell the manager to no longer run the system of this type.
@@ -188,6 +426,8 @@ class SystemManager(object):
         system.entity_manager=None
         system.system_manager=None
         self._systems.remove(system)
+        self._schedules.pop(system, None)
+        self._waves.clear()
         del self._system_types[system_type]
 
     def init(self):
@@ -195,12 +435,21 @@ class SystemManager(object):
             system.init()
 
     def reset(self):
+        """Reset the time, the schedules and the change log of the entity
+        manager, then every system."""
+        self._time=0
+        self._entity_manager._tick=0
+        self._entity_manager.clear_changes()
+        for schedule in self._schedules.values():
+            period, phase=schedule[0], schedule[1]
+            schedule[2:]=[phase-period, phase]
         for system in self._systems:
             system.reset()
 
     def update(self, dt):
         """Run each system's ``update()`` method for this frame. The systems
-        are run in the order in which they were added.
+        are run in the order in which they were added. Structural changes to
+        the entity manager are deferred to the end of the frame.
 
         :param dt: delta time, or elapsed time for this frame
         :type dt: :class:`float`
@@ -212,5 +461,123 @@ class SystemManager(object):
         # Though initially we had the entity manager being passed through to
         # each update() method, this turns out to cause quite a large
         # performance penalty. So now it is just set on each system.
-        for system in self._systems:
+        #
+        # Structural changes made by the systems are queued by the entity
+        # manager and applied in one batch once every system has run.
+        #
+        # Systems added with a period only run when due (see add_system).
+        #
+        # With workers, systems whose reads/writes do not conflict run
+        # concurrently (see _update_parallel).
+        t=self._time
+        schedules=self._schedules
+        em=self._entity_manager
+        em._tick=t
+        em.begin_deferred()
+        try:
+            if self._executor is not None:
+                self._update_parallel(dt)
+                return
+            for system in self._systems:
+                schedule=schedules.get(system) if schedules else None
+                if schedule is None:
+                    system.update(dt)
+                elif t >= schedule[3]:
+                    system.update(t-schedule[2])
+                    schedule[2]=t
+                    while schedule[3] <= t:
+                        schedule[3]+=schedule[0]
+        finally:
+            em.end_deferred()
+            # changes made before the next update (e.g. by Moment callbacks)
+            # belong to the next frame
+            self._time=em._tick=t+dt
+
+    @staticmethod
+    def conflict(a, b):
+        """True if systems a and b may not run concurrently: one writes what
+        the other reads or writes, or a declaration is missing."""
+        if a.reads is None or a.writes is None or b.reads is None or b.writes is None:
+            return True
+        wa, wb=set(a.writes), set(b.writes)
+        return bool(wa & (set(b.reads) | wb) or wb & set(a.reads))
+
+    def _waves_for(self, systems):
+        """Split the due systems in waves. A system goes one wave after the
+        last earlier system it conflicts with, so the dependency order of the
+        sequential update is kept."""
+        key=tuple(systems)
+        waves=self._waves.get(key)
+        if waves is None:
+            level=[]
+            for i, system in enumerate(systems):
+                level.append(1+max((level[j] for j in range(i)
+                                    if SystemManager.conflict(systems[j], system)), default=-1))
+            waves=[[] for _ in range(max(level)+1)] if level else []
+            for i, l in enumerate(level):
+                waves[l].append(i)
+            self._waves[key]=waves
+        return waves
+
+    def close(self):
+        """Shut down the worker threads. Later updates run the systems one
+        after another."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor=None
+
+    def _run(self, system, dt):
+        """Run a system out of sequential order (concurrently, or ahead of a
+        system added before it), collecting in its thread the structural
+        changes, the created entities and the tracked components it touches."""
+        em=self._entity_manager
+        em._local.commands=commands=[]
+        em._local.created=created=[]
+        em._local.touched=touched=[]
+        try:
             system.update(dt)
+        finally:
+            em._local.commands=None
+            em._local.created=None
+            em._local.touched=None
+        return commands, created, touched
+
+    def _update_parallel(self, dt):
+        t=self._time
+        systems, dts=[], []
+        for system in self._systems:
+            schedule=self._schedules.get(system)
+            if schedule is None:
+                systems.append(system)
+                dts.append(dt)
+            elif t >= schedule[3]:
+                systems.append(system)
+                dts.append(t-schedule[2])
+                schedule[2]=t
+                while schedule[3] <= t:
+                    schedule[3]+=schedule[0]
+        em=self._entity_manager
+        results=[None]*len(systems)
+        merged=0 # systems before this index ran and are merged
+        for wave in self._waves_for(systems):
+            if len(wave) == 1 and wave[0] == merged:
+                # alone and next in sequential order: nothing to buffer
+                systems[merged].update(dts[merged])
+                merged+=1
+            elif len(wave) == 1:
+                results[wave[0]]=self._run(systems[wave[0]], dts[wave[0]])
+            else:
+                for i, result in zip(wave, list(self._executor.map(
+                        lambda i: self._run(systems[i], dts[i]), wave))):
+                    results[i]=result
+            # entities get their index, tracked changes are logged and
+            # structural changes are queued in the sequential order of the
+            # systems
+            while merged < len(systems) and results[merged] is not None:
+                commands, created, touched=results[merged]
+                for entity in created:
+                    entity._guid=em._new_guid()
+                for component in touched:
+                    Tracked.touch(component)
+                em._commands.extend(commands)
+                merged+=1
@@ -2,10 +2,19 @@
 Entity, Component, and System classes.
 --------------------------------------
 """
+import threading
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 
 class Entity(object):
-    """Encapsulation of a GUID to use in the entity database."""
+    """Encapsulation of a GUID to use in the entity database. The GUID packs a
+    generational handle: the low 32 bits are the entity index, which the
+    :class:`ecs.managers.EntityManager` recycles once an entity is removed,
+    and the high bits are the generation of that index. A stale handle to a
+    removed entity therefore never equals the entity that reuses its index."""
+
+    INDEX_BITS = 32
+    INDEX_MASK = (1 << INDEX_BITS) - 1
 
     def __init__(self, guid, name=""):
         """:param guid: globally unique identifier
@@ -14,6 +23,16 @@ class Entity(object):
         self._name = name
         self._guid = guid
 
+    @property
+    def index(self):
+        """Dense index of the entity, reused after removal."""
+        return self._guid & Entity.INDEX_MASK
+
+    @property
+    def generation(self):
+        """Number of times the index was recycled before this entity."""
+        return self._guid >> Entity.INDEX_BITS
+
     def __repr__(self):
         return '{0}({1})'.format(type(self).__name__, self._guid)
 
@@ -27,12 +46,113 @@ class Entity(object):
         return self._name
 
 class Component(object):
-        pass
+    tracked = () # names of the attributes Tracked.enable makes tracked
+    tracking = False # True once Tracked.enable was called for the class
+    _manager = None # entity manager holding the component, whose change log it writes
+
+
+class Tracked(object):
+    """Descriptor for a component attribute whose changes are tracked. When an
+    assignment changes the value, the component is stamped with the current
+    tick of its :class:`ecs.managers.EntityManager` and moved to the end of the
+    manager's change log for its type, so that
+    :meth:`ecs.managers.EntityManager.changed_since` only visits the changed
+    components. The tick is the time of the running
+    :class:`ecs.managers.SystemManager` update, or of the next one between two
+    updates (for instance in ``Moment`` callbacks). A component that is not in
+    a manager is not logged.
+
+    Tracking is opt-in per component class, so that it costs nothing when no
+    one queries the changes: the class lists its trackable attributes in
+    ``tracked``, which stay plain attributes until :meth:`enable` installs the
+    descriptors. State that is not a plain attribute calls :meth:`touch`
+    guarded by the class's ``tracking`` flag:
+
+    .. code-block:: python
+
+        class Cuve(ecs.Component):
+            tracked = ("metal",)
+
+        ecs.Tracked.enable(Cuve)
+
+    The systems a parallel :class:`ecs.managers.SystemManager` runs in worker
+    threads buffer their changes, which are logged in the sequential order of
+    the systems once their wave is done, so the log does not depend on thread
+    timing. The log itself is only accessed while holding ``Tracked.lock``.
+    """
+    lock = threading.Lock()
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            return instance.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, instance, value):
+        d = instance.__dict__
+        if self.name not in d or d[self.name] != value:
+            d[self.name] = value
+            Tracked.touch(instance)
+
+    @staticmethod
+    def enable(*component_types):
+        """Start tracking the ``tracked`` attributes of the component types
+        (and of their subclasses) and set their ``tracking`` flag. Existing
+        components keep their values."""
+        for component_type in component_types:
+            for name in component_type.tracked:
+                if not isinstance(component_type.__dict__.get(name), Tracked):
+                    descriptor = Tracked()
+                    descriptor.__set_name__(component_type, name)
+                    setattr(component_type, name, descriptor)
+            component_type.tracking = True
+
+    @staticmethod
+    def touch(component):
+        """Stamp the component as changed at the current tick. Use it for state
+        not held in a :class:`Tracked` attribute (for instance in a property setter)."""
+        manager = component._manager
+        if manager is None:
+            return
+        touched = getattr(manager._local, 'touched', None)
+        if touched is not None: # concurrent system, logged in system order after its wave
+            touched.append(component)
+            return
+        with Tracked.lock:
+            log = manager._changes.get(type(component))
+            if log is None:
+                log = manager._changes[type(component)] = OrderedDict()
+            log[component] = manager._tick
+            log.move_to_end(component)
+
+    @staticmethod
+    def forget(component):
+        """Drop the component from the change log of its manager (it was removed)."""
+        manager = component._manager
+        if manager is None:
+            return
+        with Tracked.lock:
+            log = manager._changes.get(type(component))
+            if log is not None:
+                log.pop(component, None)
 
 class System(metaclass=ABCMeta):
     """An object that represents an operation on a set of objects from the game
     database. The :meth:`update` method must be implemented.
+
+    A system may declare the component types (or any other shared resource,
+    such as the ``Moment``) it reads and writes in ``reads`` and ``writes``.
+    A :class:`ecs.managers.SystemManager` with workers runs systems whose
+    declarations do not conflict concurrently. ``None`` (the default) means
+    unknown: the system conflicts with every other one.
     """
+    reads = None
+    writes = None
 
     def __init__(self):
         self.entity_manager = None
@@ -128,7 +128,11 @@ class Cuve(ecs.Component):
          * cycle: cycle anodique en jours (float)
          * na (float): nombre d'anodes a changer selon le cycle (variable d'état)
          * metal (float): quantité de métal liquide siphonnable en kg (variable d'état)
+
+    Les variables d'état peuvent être suivies pour ``EntityManager.changed_since``
+    (voir ``ecs.Tracked.enable``).
     """
+    tracked = ("metal", "megot", "nch", "nsi")
 
     def __init__(self, n, nbanode, cycle=600, ka=400):
         """:param n: on garde un handle vers le composant noeud frère
@@ -181,20 +185,64 @@ class Cuve(ecs.Component):
 class RenderCuve(ecs.System):
     """Systeme pour le rendering des cuves."""
 
-    def __init__(self, canvas):
+    def __init__(self, canvas, retenu=False):
+        """
+        :param bool retenu: si vrai, les instructions sont créées une seule fois dans un groupe
+            propre au système, puis on ne met à jour que celles des cuves dont la box a changé
+            (voir :class:`simulation.graphe.InstructionsRetenues`).
+        """
         super().__init__()
         self.canvas = canvas
+        self.retenu = simulation.graphe.InstructionsRetenues(canvas, self.creer, self.maj) if retenu else None
+        self.secteurs = None # RenderSecteurs, créé au premier frame à détail réduit
 
     def init(self):
         pass
 
     def reset(self):
-        pass
+        if self.secteurs is not None:
+            self.secteurs.vider()
+
+    def candidates(self, vue):
+        if vue is None:
+            return (self.entity_manager.component_for_entity(entity, simulation.graphe.Box)
+                    for entity, cuve in self.entity_manager.pairs_for_type(Cuve))
+        return (box for entity, cuve, box in vue.pairs_visibles(self.entity_manager, Cuve))
+
+    def creer(self, box):
+        if getattr(box, "entity", None) not in self.entity_manager.database.get(Cuve, {}):
+            return None
+        return (Color(box.color[0], box.color[1], box.color[2], box.alpha),
+                Rectangle(pos=box.pos, size=box.size),
+                Color(box.contour_color[0], box.contour_color[1], box.contour_color[2], box.alpha),
+                Line(rectangle=box.pos + box.size))
+
+    def maj(self, box, instructions):
+        couleur, rectangle, contour, ligne = instructions
+        couleur.rgba = (box.color[0], box.color[1], box.color[2], box.alpha)
+        rectangle.pos = box.pos
+        contour.rgba = (box.contour_color[0], box.contour_color[1], box.contour_color[2], box.alpha)
+        ligne.rectangle = box.pos + box.size
 
     def update(self, dt):
+        if self.retenu is not None:
+            self.retenu.update(self.candidates, self.entity_manager, Cuve)
+            return
+        vue = simulation.graphe.Vue.get_instance()
+        if vue is None:
+            cuves = ((entity, cuve, self.entity_manager.component_for_entity(entity, simulation.graphe.Box))
+                     for entity, cuve in self.entity_manager.pairs_for_type(Cuve))
+        elif not vue.detail():
+            if self.secteurs is None:
+                self.secteurs = RenderSecteurs(Cuve)
+            self.secteurs.dessiner(self.canvas, self.entity_manager, vue)
+            return
+        else:
+            if self.secteurs is not None:
+                self.secteurs.vider() # plus de suivi des boxes en plein detail
+            cuves = vue.pairs_visibles(self.entity_manager, Cuve)
         with self.canvas:
-            for entity, cuve in self.entity_manager.pairs_for_type(Cuve):
-                box = self.entity_manager.component_for_entity(entity, simulation.graphe.Box)
+            for entity, cuve, box in cuves:
                 # draw rectangle with texture
                 Color(box.color[0], box.color[1], box.color[2], box.alpha)
                 Rectangle(pos=box.pos, size=box.size)
@@ -218,17 +266,31 @@ class RenderAllee(ecs.System):
     def __init__(self, canvas):
         super().__init__()
         self.canvas = canvas
+        self.secteurs = None # RenderSecteurs, créé au premier frame à détail réduit
 
     def init(self):
         pass
 
     def reset(self):
-        pass
+        if self.secteurs is not None:
+            self.secteurs.vider()
 
     def update(self, dt):
+        vue = simulation.graphe.Vue.get_instance()
+        if vue is None:
+            allees = ((entity, allee, self.entity_manager.component_for_entity(entity, simulation.graphe.Box))
+                      for entity, allee in self.entity_manager.pairs_for_type(Allee))
+        elif not vue.detail():
+            if self.secteurs is None:
+                self.secteurs = RenderSecteurs(Allee)
+            self.secteurs.dessiner(self.canvas, self.entity_manager, vue)
+            return
+        else:
+            if self.secteurs is not None:
+                self.secteurs.vider() # plus de suivi des boxes en plein detail
+            allees = vue.pairs_visibles(self.entity_manager, Allee)
         with self.canvas:
-            for entity, allee in self.entity_manager.pairs_for_type(Allee):
-                box = self.entity_manager.component_for_entity(entity, simulation.graphe.Box)
+            for entity, allee, box in allees:
                 # draw rectangle with texture
 
                 Color(box.color[0], box.color[1], box.color[2], box.alpha)
@@ -257,3 +319,63 @@ class RenderAllee(ecs.System):
                 #Rectangle(size=x_texture.size, pos=(0, 0), texture=x_texture)
                 #PopMatrix()
 
+
+class RenderSecteurs:
+    """ Rendering à niveau de détail réduit: un seul rectangle par secteur, de la couleur
+    moyenne de ses cuves (ou allées). Chaque système de rendering a sa propre instance.
+    L'enveloppe des boxes d'un secteur est gardée jusqu'à ce qu'une de ces boxes change
+    (voir ``Box.suivre``) ou que le système la vide (:meth:`vider`). On ne suit les boxes
+    modifiées que tant qu'il y a des enveloppes gardées: l'abonnement est pris au calcul de
+    la première et rendu par :meth:`vider`, par exemple au retour au plein détail. """
+
+    def __init__(self, component_type):
+        self.component_type = component_type
+        self.enveloppes = {} # secteur -> (pos, size) ou None
+        self.secteurs = {} # box -> secteur dont l'enveloppe en dépend
+        self.sales = None # boxes modifiees (Box.suivre), tant qu'il y a des enveloppes
+
+    def vider(self):
+        """ Oublie les enveloppes et se désabonne des boxes modifiées. """
+        self.enveloppes = {}
+        self.secteurs = {}
+        if self.sales is not None:
+            simulation.graphe.Box.oublier(self.sales)
+            self.sales = None
+
+    def noeuds(self, secteur):
+        return getattr(secteur, "noeuds_cuves" if self.component_type is Cuve else "noeuds_allees", [])
+
+    def enveloppe(self, secteur):
+        if secteur not in self.enveloppes:
+            if self.sales is None:
+                self.sales = simulation.graphe.Box.suivre()
+            boxes = [n.box for n in self.noeuds(secteur)]
+            if not boxes:
+                self.enveloppes[secteur] = None
+            else:
+                x0 = min(b.pos[0] for b in boxes)
+                y0 = min(b.pos[1] for b in boxes)
+                x1 = max(b.pos[0] + b.size[0] for b in boxes)
+                y1 = max(b.pos[1] + b.size[1] for b in boxes)
+                self.enveloppes[secteur] = ((x0, y0), (x1 - x0, y1 - y0))
+                for b in boxes:
+                    self.secteurs[b] = secteur
+        return self.enveloppes[secteur]
+
+    def dessiner(self, canvas, entity_manager, vue):
+        """ Dessine les secteurs visibles avec un rectangle chacun. """
+        for box in simulation.graphe.Box.prendre(self.sales) if self.sales is not None else ():
+            secteur = self.secteurs.get(box)
+            if secteur is not None:
+                self.enveloppes.pop(secteur, None)
+        with canvas:
+            for entity, secteur in entity_manager.pairs_for_type(Secteur):
+                env = self.enveloppe(secteur)
+                if env is None or not vue.intersecte(*env):
+                    continue
+                noeuds = self.noeuds(secteur)
+                n = len(noeuds)
+                Color(sum(x.box.color[0] for x in noeuds) / n,
+                      sum(x.box.color[1] for x in noeuds) / n,
+                      sum(x.box.color[2] for x in noeuds) / n, 1)
+                Rectangle(pos=env[0], size=env[1])
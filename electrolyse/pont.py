@@ -37,6 +37,7 @@ from .. import simulation
 
 class Pont(ecs.Component):
     MSE, PACD, MTC = range(3)
+    tracked = ("is_operation", "is_bris", "is_pause", "is_rdc") # voir ecs.Tracked.enable
 
     def __init__(self, nom, index, mobile=None, entity_manager=None, noeud_entrepot=None):
         self.nom = nom
@@ -212,15 +213,21 @@ class RenderPont(ecs.System):
     def update(self, dt):
         #self.set_cadran()
         #self.set_postion_label()
+        vue = simulation.graphe.Vue.get_instance()
+        detail = vue is None or vue.detail()
         with self.canvas.after:
             label_pont_x, label_pont_y = (40,25)
             for entity, pont in self.entity_manager.pairs_for_type(Pont):
                 box = pont.mobile.noeud.box
+                pos = pont.mobile.position()
+                if vue is not None and not vue.intersecte(pos, (box.size[0], 40)):
+                    continue
                 Color(box.color[0], box.color[1], box.color[2], box.alpha)
-                Rectangle(pos=box.pos, size=box.size)
-                Color(box.contour_color[0], box.contour_color[1], box.contour_color[2], box.alpha)
-                Line(rectangle=box.pos + (12, 36))
-                self.draw_text(pont.nom, 14, box.pos[0], box.pos[1] + 40)
+                Rectangle(pos=pos, size=box.size)
+                if detail:
+                    Color(box.contour_color[0], box.contour_color[1], box.contour_color[2], box.alpha)
+                    Line(rectangle=tuple(pos) + (12, 36))
+                    self.draw_text(pont.nom, 14, pos[0], pos[1] + 40)
 
             for entity, pont in self.entity_manager.pairs_for_type(Pont):
                 PopMatrix()
@@ -1,5 +1,5 @@
+import csv
 from collections import defaultdict, namedtuple
-import statistics
 from itertools import chain
 
 from kivy.graphics.context_instructions import Color
@@ -12,7 +12,18 @@ from .centre import Secteur
 from .. import simulation
 
 
+LigneStatistique = namedtuple('LigneStatistique',
+                              'secteur, poste, indicateur, n, moyenne, ecart_type, min, max, p50, p90')
+
+
 class StatistiquePoste(ecs.System):
+    """ Statistiques par (secteur, poste) du temps de tâche, de bris et de pause des ponts, 
+    et du temps nécessaire pour terminer les tâches non terminées. Chaque indicateur est un 
+    :class:`cyme.simulation.base.StatistiqueEnLigne`, donc la mémoire ne croît pas avec le 
+    nombre de quarts simulés. """
+
+    INDICATEURS = ("toc", "ret", "pause", "non_termine")
+
     def __init__(self):
         super().__init__()
         self.ponts = []
@@ -32,10 +43,9 @@ class StatistiquePoste(ecs.System):
         self.moy_ret = nested_dict()
         self.moy_gest = nested_dict()
 
-        self.max_toc = nested_dict()
-        self.max_ret = nested_dict()
         self.non_termine = nested_dict()
         self.non_termine_temp = nested_dict()
+        self.temps_necessaire = 0
 
     def init(self):
         for entity, secteur in self.entity_manager.pairs_for_type(Secteur):
@@ -45,27 +55,22 @@ class StatistiquePoste(ecs.System):
             self.ponts.append(pont)
 
         for secteur in self.secteurs:
+            self.toc[secteur] = 0
+            self.pause[secteur] = 0
+            self.ret[secteur] = 0
+            self.non_termine_temp[secteur] = 0
             for poste in range(secteur.num_quart_max()):
-                self.toc[secteur] = 0
-                self.pause[secteur] = 0
-                self.ret[secteur] = 0
-
-                self.moy_toc[secteur][poste] = []
-                self.moy_pause[secteur][poste] = []
-                self.moy_ret[secteur][poste] = []
-
-                self.max_toc[secteur][poste] = []
-                self.max_ret[secteur][poste] = []
-                self.non_termine[secteur][poste] = []
-                self.non_termine_temp[secteur] = 0
+                self.moy_toc[secteur][poste] = simulation.base.StatistiqueEnLigne()
+                self.moy_pause[secteur][poste] = simulation.base.StatistiqueEnLigne()
+                self.moy_ret[secteur][poste] = simulation.base.StatistiqueEnLigne()
+                self.non_termine[secteur][poste] = simulation.base.StatistiqueEnLigne()
 
     def reset(self):
         for secteur in self.secteurs:
-            for poste in range(secteur.num_quart_max()):
-                self.toc[secteur] = 0
-                self.pause[secteur] = 0
-                self.ret[secteur] = 0
-                self.non_termine_temp[secteur] = 0
+            self.toc[secteur] = 0
+            self.pause[secteur] = 0
+            self.ret[secteur] = 0
+            self.non_termine_temp[secteur] = 0
 
     def update(self, dt):
         for pont in self.ponts:
@@ -96,33 +101,29 @@ class StatistiquePoste(ecs.System):
         return temps
 
     def compile_statistics(self):
+        """ Ajoute le quart qui se termine aux statistiques de chaque (secteur, poste) et 
+        affiche le sommaire. Le coût est en O(secteurs), plus le parcours des kanbans du quart. """
         self.temps_necessaire = 0
-        non_termine = []
-        for secteur in self.secteurs:
-            self.temps_necessaire = self.get_temps_necessaire_for_completion(secteur)
-            for kanban in secteur.get_kanbans_for_current_quart():
-                if not kanban.is_completed():
-                    non_termine.append(kanban)
-
         for secteur in self.secteurs:
+            self.temps_necessaire += self.get_temps_necessaire_for_completion(secteur)
             poste = secteur.num_quart
-            self.moy_toc[secteur][poste].append(self.toc[secteur])
-            self.moy_ret[secteur][poste].append(self.ret[secteur])
-            self.moy_pause[secteur][poste].append(self.pause[secteur])
+            self.moy_toc[secteur][poste].add(self.toc[secteur])
+            self.moy_ret[secteur][poste].add(self.ret[secteur])
+            self.moy_pause[secteur][poste].add(self.pause[secteur])
 
         for secteur in self.secteurs:
             poste = secteur.num_quart
             print("num quart:", poste)
 
-            moy = statistics.mean(self.moy_toc[secteur][poste])
+            moy = self.moy_toc[secteur][poste].moyenne()
             print("tache:\t", end='')
             print("{0}%".format(int(moy / 43200 * 100)), simulation.base.Moment.seconds_to_hhmmss(int(moy)))
 
-            moy2 = statistics.mean(self.moy_ret[secteur][poste])
+            moy2 = self.moy_ret[secteur][poste].moyenne()
             print("bris:\t", end='')
             print("{0}%".format(int(moy2 / 43200 * 100)), simulation.base.Moment.seconds_to_hhmmss(int(moy2)))
 
-            moy3 = statistics.mean(self.moy_pause[secteur][poste])
+            moy3 = self.moy_pause[secteur][poste].moyenne()
             print("pause:\t", end='')
             print("{0}%".format(int(moy3 / 43200 * 100)), simulation.base.Moment.seconds_to_hhmmss(int(moy3)))
 
@@ -132,21 +133,45 @@ class StatistiquePoste(ecs.System):
 
             print("----")
 
-        for kb in non_termine:
-            for secteur in self.secteurs:
-                kanbans = secteur.get_kanbans_for_current_quart()
-                if kb in kanbans:
+        for secteur in self.secteurs:
+            for kb in secteur.get_kanbans_for_current_quart():
+                if not kb.is_completed():
                     self.non_termine_temp[secteur] += kb.temps_necessaire
                     print(secteur.nom, kb.operation.name, "[{0}/{1}]".format(kb.cuve_courante, kb.cuve_max),
                           simulation.base.Moment.seconds_to_hhmmss(kb.temps_necessaire))
-
-        for secteur in self.secteurs:
-            poste = secteur.num_quart
-            self.non_termine[secteur][poste].append(self.non_termine_temp[secteur] // 60)
+            self.non_termine[secteur][secteur.num_quart].add(self.non_termine_temp[secteur] // 60)
 
         print("Temps total nécessaire pour terminer les tâches restantes:",
               simulation.base.Moment.seconds_to_hhmmss(self.temps_necessaire))
 
-        print(self.non_termine)
-
         return self.moy_toc, self.moy_ret, self.moy_pause, self.non_termine
+
+    def fin_quart(self):
+        """ Ferme le quart: compile les statistiques puis remet les compteurs à zéro. À abonner
+        au quart du moment (``mom.chaque_quart(stat.fin_quart)``) avant les secteurs, pour que
+        les statistiques soient attribuées au poste qui se termine. """
+        self.compile_statistics()
+        self.reset()
+
+    def tableau(self):
+        """ Exporte les statistiques sous forme de table: une ligne :class:`LigneStatistique` 
+        par (secteur, poste, indicateur). Les temps de tâche, bris et pause sont en secondes 
+        et le temps non terminé en minutes. """
+        stats = {"toc": self.moy_toc, "ret": self.moy_ret, "pause": self.moy_pause,
+                 "non_termine": self.non_termine}
+        lignes = []
+        for secteur in self.secteurs:
+            for poste in range(secteur.num_quart_max()):
+                for indicateur in StatistiquePoste.INDICATEURS:
+                    s = stats[indicateur][secteur][poste]
+                    lignes.append(LigneStatistique(secteur.nom, poste, indicateur, s.n, s.moyenne(),
+                                                   s.ecart_type(), s.min, s.max,
+                                                   s.quantile(0.5), s.quantile(0.9)))
+        return lignes
+
+    def dump(self, nom='statistique_poste.csv'):
+        """ Dump la table des statistiques dans le fichier csv ``nom`` avec ; comme séparateur. """
+        with open(nom, 'w', newline='') as fp:
+            z = csv.writer(fp, delimiter=';')
+            z.writerow(LigneStatistique._fields)
+            z.writerows(self.tableau())
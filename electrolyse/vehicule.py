@@ -278,6 +278,7 @@ class RenderVehiculeEa(ecs.System):
         with self.canvas.after:
             for entity, vehicule in self.entity_manager.pairs_for_type(VehiculeEa):
                 box = vehicule.mobile.noeud.box
-                Rectangle(pos=box.pos, size=box.size)
+                pos = vehicule.mobile.position()
+                Rectangle(pos=pos, size=box.size)
                 Color(0,0,0,1)
-                Line(rectangle=box.pos+(12,12))
\ No newline at end of file
+                Line(rectangle=tuple(pos)+(12,12))
\ No newline at end of file
@@ -92,6 +92,7 @@ class Machine(ecs.Component):
         Au niveau de la tâche finale, tous les accumulateurs en entrée sont débités selon qin et 
         le matériel est mis à la sortie selon qout. 
     """
+    tracked = ("x", "xout", "actif") # variables d'etat a suivre, voir ecs.Tracked.enable
 
     def __init__(self, n, nom, tcycle, qin, qout):
         """:param n: :class:`cyme.simulation.graphe.Noeud` noeud auquel est associé la machine
@@ -194,6 +195,7 @@ class Machine(ecs.Component):
 
 class Accumulateur(ecs.Component):
     infini = 999999  # pour wmax sans limite
+    tracked = ("_w", "_wmax") # niveau a suivre, voir ecs.Tracked.enable
 
     def __init__(self, a, w, wmax):
         self.arete = a
@@ -263,6 +265,7 @@ class Transit(Accumulateur):
     def add(self, k=1):
         if not self.full(k):
             for _ in range(k): self._fifo.append(0)
+            if self.tracking: ecs.Tracked.touch(self)
             return True
         else:
             return False
@@ -270,6 +273,7 @@ class Transit(Accumulateur):
     def rm(self, k=1):
         if not self.empty(k):
             for _ in range(k): self._fifo.pop(0)
+            if self.tracking: ecs.Tracked.touch(self)
             return True
         else:
             return False
@@ -286,6 +290,7 @@ class Transit(Accumulateur):
                 self._fifo[idx:idx] = l
             else:
                 self._fifo += l
+            if self.tracking: ecs.Tracked.touch(self)
             return True
         else:
             return False
@@ -312,6 +317,7 @@ class Transit(Accumulateur):
             else:
                 x = [t] * k
                 self._fifo[i:i] = x
+            if self.tracking: ecs.Tracked.touch(self)
             return True
         else:
             return False
@@ -327,6 +333,7 @@ class Transit(Accumulateur):
                     break
             if i - k >= 0:
                 del self._fifo[i - k:i]
+                if self.tracking: ecs.Tracked.touch(self)
                 return True
         else:
             return False
@@ -335,7 +342,9 @@ class Transit(Accumulateur):
         print(self._fifo)
 
     def update(self):
-        self._fifo = [z + 1 for z in self._fifo]
+        if self._fifo:
+            self._fifo = [z + 1 for z in self._fifo]
+            if self.tracking: ecs.Tracked.touch(self) # l'age des items a change
 
 
 class RenderMachine(ecs.System):
@@ -350,23 +359,35 @@ class RenderMachine(ecs.System):
         pass
 
     def update(self, dt):
+        vue = simulation.graphe.Vue.get_instance()
+        detail = vue is None or vue.detail()
         with self.canvas:
             for entity, m in self.entity_manager.pairs_for_type(Machine):
+                b = self.entity_manager.component_for_entity(entity, simulation.graphe.Box)
+                if detail:
+                    if not float(m.x).is_integer():
+                        s = str(round(m.x,3))
+                    else:
+                        s = "{0}/{1}".format(m.x, m.xout)
+                    texte = m.nom + '\n' + s
+                    etendue = simulation.graphe.Vue.etendue_texte(texte, 14)
+                else:
+                    etendue = (8, 8)
+                if vue is not None and not vue.intersecte(b.ptxt, etendue):
+                    continue
                 # Couleur du texte rgba
                 if m.actif:
                     Color(0, 1, 0)
                 else:
                     Color(1, 1, 0)
-                if not float(m.x).is_integer():
-                    s = str(round(m.x,3))
-                else:
-                    s = "{0}/{1}".format(m.x, m.xout)
-                my_label = CoreLabel(text=m.nom + '\n' + s, font_size=14)
+                if not detail: # un simple indicateur de couleur, pas de texte
+                    Rectangle(size=etendue, pos=b.ptxt)
+                    continue
+                my_label = CoreLabel(text=texte, font_size=14)
                 # the label is usually not drawn until needed, so force it to draw.
                 my_label.refresh()
                 # Now access the texture of the label and use it wherever
                 x_texture = my_label.texture
-                b = self.entity_manager.component_for_entity(entity, simulation.graphe.Box)
                 Rectangle(size=x_texture.size, pos=b.ptxt, texture=x_texture)
 
 class RenderAiguillageY(ecs.System):
@@ -381,23 +402,35 @@ class RenderAiguillageY(ecs.System):
         pass
 
     def update(self, dt):
+        vue = simulation.graphe.Vue.get_instance()
+        detail = vue is None or vue.detail()
         with self.canvas:
             for entity, m in self.entity_manager.pairs_for_type(AiguillageY):
+                b = self.entity_manager.component_for_entity(entity, simulation.graphe.Box)
+                if detail:
+                    if not float(m.x).is_integer():
+                        s = str(round(m.x,3))
+                    else:
+                        s = "{0}/{1}".format(m.x, m.xout)
+                    texte = m.nom + '\n' + s
+                    etendue = simulation.graphe.Vue.etendue_texte(texte, 14)
+                else:
+                    etendue = (8, 8)
+                if vue is not None and not vue.intersecte(b.ptxt, etendue):
+                    continue
                 # Couleur du texte rgba
                 if m.actif:
                     Color(0, 1, 0)
                 else:
                     Color(1, 1, 0)
-                if not float(m.x).is_integer():
-                    s = str(round(m.x,3))
-                else:
-                    s = "{0}/{1}".format(m.x, m.xout)
-                my_label = CoreLabel(text=m.nom + '\n' + s, font_size=14)
+                if not detail: # un simple indicateur de couleur, pas de texte
+                    Rectangle(size=etendue, pos=b.ptxt)
+                    continue
+                my_label = CoreLabel(text=texte, font_size=14)
                 # the label is usually not drawn until needed, so force it to draw.
                 my_label.refresh()
                 # Now access the texture of the label and use it wherever
                 x_texture = my_label.texture
-                b = self.entity_manager.component_for_entity(entity, simulation.graphe.Box)
                 Rectangle(size=x_texture.size, pos=b.ptxt, texture=x_texture)
 
 
@@ -414,8 +447,25 @@ class RenderAccumulateur(ecs.System):
         pass
 
     def update(self, dt):
+        vue = simulation.graphe.Vue.get_instance()
+        detail = vue is None or vue.detail()
         with self.canvas:
             for entity, a in self.entity_manager.pairs_for_type(Accumulateur):
+                li = self.entity_manager.component_for_entity(entity, simulation.graphe.Ligne)
+                if detail:
+                    if not float(a.get()).is_integer():
+                        s = str(round(a.get(),3))
+                        if a.getmax() != Accumulateur.infini:
+                            s += "/" + str(round(a.getmax(),3))
+                    else:
+                        s = str(a.get())
+                        if a.getmax() != Accumulateur.infini:
+                            s += "/" + str(a.getmax())
+                    etendue = simulation.graphe.Vue.etendue_texte(s, 14)
+                else:
+                    etendue = (8, 8)
+                if vue is not None and not vue.intersecte(li.ptxt, etendue):
+                    continue
                 # Couleur du texte rgba
                 if a.full():
                     Color(0.7, 0, 0)  # rouge c'est plein
@@ -425,21 +475,15 @@ class RenderAccumulateur(ecs.System):
                     Color(1, 1, 0)  # jaune c'est partiellement dispo
                 else:
                     Color(0, 1, 0)  # vert tout est dispo
-                if not float(a.get()).is_integer():
-                    s = str(round(a.get(),3))
-                    if a.getmax() != Accumulateur.infini:
-                        s += "/" + str(round(a.getmax(),3))
-                else:
-                    s = str(a.get())
-                    if a.getmax() != Accumulateur.infini:
-                        s += "/" + str(a.getmax())
+                if not detail: # un simple indicateur de couleur, pas de texte
+                    Rectangle(size=etendue, pos=li.ptxt)
+                    continue
 
                 my_label = CoreLabel(text=s, font_size=14)
                 # the label is usually not drawn until needed, so force it to draw.
                 my_label.refresh()
                 # Now access the texture of the label and use it wherever
                 x_texture = my_label.texture
-                li = self.entity_manager.component_for_entity(entity, simulation.graphe.Ligne)
                 Rectangle(size=x_texture.size, pos=li.ptxt, texture=x_texture)
 
 
@@ -455,8 +499,20 @@ class RenderTransit(ecs.System):
         pass
 
     def update(self, dt):
+        vue = simulation.graphe.Vue.get_instance()
+        detail = vue is None or vue.detail()
         with self.canvas:
             for entity, a in self.entity_manager.pairs_for_type(Transit):
+                li = self.entity_manager.component_for_entity(entity, simulation.graphe.Ligne)
+                if detail:
+                    s = str(a.get())
+                    if a.getmax() != Transit.infini:
+                        s += "/" + str(a.getmax())
+                    etendue = simulation.graphe.Vue.etendue_texte(s, 14)
+                else:
+                    etendue = (8, 8)
+                if vue is not None and not vue.intersecte(li.ptxt, etendue):
+                    continue
                 # Couleur du texte rgba
                 if a.full():
                     Color(0.7, 0, 0)  # rouge c'est plein
@@ -466,15 +522,14 @@ class RenderTransit(ecs.System):
                     Color(1, 1, 0)  # jaune c'est partiellement dispo
                 else:
                     Color(0, 1, 0)  # vert tout est dispo
-                s = str(a.get())
-                if a.getmax() != Transit.infini:
-                    s += "/" + str(a.getmax())
+                if not detail: # un simple indicateur de couleur, pas de texte
+                    Rectangle(size=etendue, pos=li.ptxt)
+                    continue
                 my_label = CoreLabel(text=s, font_size=14)
                 # the label is usually not drawn until needed, so force it to draw.
                 my_label.refresh()
                 # Now access the texture of the label and use it wherever
                 x_texture = my_label.texture
-                li = self.entity_manager.component_for_entity(entity, simulation.graphe.Ligne)
                 Rectangle(size=x_texture.size, pos=li.ptxt, texture=x_texture)
 
 
@@ -3,6 +3,8 @@ Behavior tree des mobiles.
 --------------------------
 """
 
+import bisect
+import math
 import random
 
 from .. import bt
@@ -50,7 +52,7 @@ class jumpToDest(bt.Task):
 
         if self.distance_parcourue <= 0.0:
             position_cible = self.mobile.ndest.box.pos
-            self.distance_cible = simulation.simulation.base.Vecteur2D.distsqrt(self.mobile.noeud.box.pos, position_cible) + self.distance_restante
+            self.distance_cible = simulation.base.Vecteur2D.distsqrt(self.mobile.noeud.box.pos, position_cible) + self.distance_restante
             self.distance_restante = 0.0
 
         self.distance_parcourue += self.mobile.vit
@@ -70,10 +72,10 @@ class jumpToDest(bt.Task):
             return bt.Task.RUNNING
 
     def UpdatePath(self):
-        if self.current_target is not self.mobile.target:
+        if self.current_target is not self.mobile.target or self.mobile.cheminIncomplet():
             if self.mobile.target is not None:
                 self.current_target = self.mobile.target
-                path = simulation.pathfinder.aStar.trouverChemin(self.mobile.npos, self.current_target, self.mobile.masque)
+                path = self.mobile.trouverChemin(self.current_target)
                 if path:
                     self.mobile.path = path
                     self.mobile.ndest = self.mobile.path.pop()
@@ -117,10 +119,10 @@ class timedJumpToDest(bt.Task):
             return bt.Task.RUNNING
 
     def UpdatePath(self):
-        if self.mobile.target != self.current_target:
+        if self.mobile.target != self.current_target or self.mobile.cheminIncomplet():
             if self.mobile.target is not None:
                 self.current_target = self.mobile.target
-                path = simulation.pathfinder.aStar.trouverChemin(self.mobile.npos, self.current_target, self.mobile.masque)
+                path = self.mobile.trouverChemin(self.current_target)
                 if path:
                     self.depart = True
                     self.mobile.path = path
@@ -136,6 +138,7 @@ class moveToDest(bt.Task):
         super().__init__()
         self.mobile = mobile
         self.current_target = None
+        self.en_route = False # deplacement delegue a mobile.cinematique
 
     def run(self):
         """
@@ -143,11 +146,14 @@ class moveToDest(bt.Task):
         """
         self.UpdatePath()
 
+        if self.mobile.cinematique is not None:
+            return self.runCinematique()
+
         if self.mobile.ndest is None:
             return bt.Task.ECHEC
 
         position_cible = self.mobile.ndest.box.pos
-        cible = simulation.simulation.base.Vecteur2D.sub(position_cible, self.mobile.noeud.box.pos)
+        cible = simulation.base.Vecteur2D.sub(position_cible, self.mobile.noeud.box.pos)
         distance = simulation.base.Vecteur2D.distsqrt(self.mobile.noeud.box.pos, position_cible)
         direction = cible[0]/(distance+0.00000001), cible[1]/(distance+0.00000001)
 
@@ -166,10 +172,155 @@ class moveToDest(bt.Task):
             else:
                 return bt.Task.SUCCES
 
+    def runCinematique(self):
+        """ Le déplacement est fait par le système ``CinematiqueMobile``; on attend l'arrivée. """
+        if self.mobile.cinematique.actif(self.mobile):
+            return bt.Task.RUNNING
+        if self.en_route:
+            self.en_route = False
+            return bt.Task.SUCCES
+        return bt.Task.ECHEC
+
     def UpdatePath(self):
-        if self.current_target is not self.mobile.target:
+        if self.current_target is not self.mobile.target or self.mobile.cheminIncomplet():
             self.current_target = self.mobile.target
-            path = simulation.pathfinder.aStar.trouverChemin(self.mobile.npos, self.current_target, self.mobile.masque)
+            path = self.mobile.trouverChemin(self.current_target)
             if path:
                 self.mobile.path = path
-                self.mobile.ndest = self.mobile.path.pop()
\ No newline at end of file
+                self.mobile.ndest = self.mobile.path.pop()
+                if self.mobile.cinematique is not None:
+                    self.mobile.cinematique.activer(self.mobile)
+                    self.en_route = True
+
+class TrajetAnalytique:
+    """ Trajet d'un mobile le long d'un chemin avec un profil de vitesse trapézoïdal: accélération
+    ``acceleration`` jusqu'à la vitesse ``vit``, puis décélération jusqu'à l'arrêt au dernier noeud
+    (vitesse constante si ``acceleration`` <= 0). Comme pour ``jumpToDest``, les distances sont
+    celles des ``Box.pos`` et les vitesses sont par seconde. La durée et les temps d'arrivée à
+    chaque noeud sont calculés une seule fois; les positions intermédiaires sont interpolées
+    sur demande. """
+
+    def __init__(self, depart, noeuds, vit, acceleration, t0):
+        """
+        :param depart: position (x,y) de départ
+        :param noeuds: noeuds à visiter, dans l'ordre chronologique
+        :param float vit: vitesse de croisière
+        :param float acceleration: accélération (et décélération) en m/sec2
+        :param int t0: temps du départ
+        """
+        self.noeuds = noeuds
+        self.points = [depart] + [n.box.pos for n in noeuds]
+        self.cumul = [0.0] # distance cumulee a chaque point
+        for a, b in zip(self.points, self.points[1:]):
+            self.cumul.append(self.cumul[-1] + simulation.base.Vecteur2D.distsqrt(a, b))
+        self.vit = vit
+        self.acceleration = acceleration
+        self.t0 = t0
+        d = self.cumul[-1]
+        if acceleration <= 0:
+            self.ta = 0.0 # temps d'acceleration
+            self.duree = d / vit
+        elif d >= vit * vit / acceleration: # on atteint la vitesse de croisiere
+            self.ta = vit / acceleration
+            self.duree = d / vit + self.ta
+        else:
+            self.ta = math.sqrt(d / acceleration)
+            self.duree = 2 * self.ta
+        self.arrivee = t0 + math.ceil(self.duree) # premier tick ou le mobile est arrive
+        # temps ou chaque noeud est atteint, et indice du prochain noeud a atteindre
+        self.arrivees = [t0 + self.temps(c) for c in self.cumul[1:]]
+        self.prochain = 0
+
+    def distance(self, t):
+        """ Distance parcourue au temps t. """
+        s = min(max(t - self.t0, 0.0), self.duree)
+        a = self.acceleration
+        if a <= 0:
+            return self.vit * s
+        if s <= self.ta:
+            return 0.5 * a * s * s
+        if s <= self.duree - self.ta:
+            return 0.5 * a * self.ta * self.ta + a * self.ta * (s - self.ta)
+        r = self.duree - s
+        return self.cumul[-1] - 0.5 * a * r * r
+
+    def temps(self, d):
+        """ Durée depuis le départ pour parcourir la distance d (inverse de :meth:`distance`). """
+        a = self.acceleration
+        if a <= 0:
+            return d / self.vit if self.vit > 0 else 0.0
+        da = 0.5 * a * self.ta * self.ta # distance parcourue en acceleration
+        if d <= da:
+            return math.sqrt(2 * d / a)
+        if d <= self.cumul[-1] - da:
+            return self.ta + (d - da) / (a * self.ta)
+        return self.duree - math.sqrt(max(2 * (self.cumul[-1] - d) / a, 0.0))
+
+    def atteints(self, t):
+        """ Noeuds atteints depuis l'appel précédent, jusqu'au temps t inclus. """
+        i = self.prochain
+        while self.prochain < len(self.noeuds) and self.arrivees[self.prochain] <= t:
+            self.prochain += 1
+        return self.noeuds[i:self.prochain]
+
+    def position(self, t):
+        """ Position interpolée au temps t et dernier noeud atteint (None si aucun).
+
+        :return: couple (position (x,y), noeud)
+        """
+        d = self.distance(t)
+        i = bisect.bisect_right(self.cumul, d) # point suivant
+        if i >= len(self.points):
+            return self.points[-1], self.noeuds[-1]
+        a, b = self.points[i-1], self.points[i]
+        u = (d - self.cumul[i-1]) / (self.cumul[i] - self.cumul[i-1])
+        pos = (a[0] + u * (b[0] - a[0]), a[1] + u * (b[1] - a[1]))
+        return pos, (self.noeuds[i-2] if i >= 2 else None)
+
+
+class analyticToDest(bt.Task):
+    """ Calcule une seule fois le temps de parcours du chemin (voir :class:`TrajetAnalytique`),
+        puis suit les temps d'arrivée précalculés: comme pour ``jumpToDest``, ``npos`` et la
+        position de la box passent d'un noeud au suivant quand le mobile l'atteint. On évite
+        ainsi l'arithmétique vectorielle à chaque seconde. Le rendering interpole la position
+        avec ``Mobile.position`` sans modifier l'état de la simulation. """
+    def __init__(self, mobile):
+        super().__init__()
+        self.mobile = mobile
+        self.current_target = None
+
+    def run(self):
+        """
+        :return: ``bt.Task.SUCCES`` à l'arrivée sinon ``bt.Task.RUNNING``
+        """
+        self.UpdatePath()
+        trajet = self.mobile.trajet
+        if trajet is None:
+            return bt.Task.SUCCES
+        t = simulation.base.Moment.get_instance().t
+        for n in trajet.atteints(t):
+            self.mobile.npos = n
+            self.mobile.noeud.box.pos = n.box.pos
+        if t < trajet.arrivee:
+            return bt.Task.RUNNING
+        self.mobile.npos = trajet.noeuds[-1]
+        self.mobile.noeud.box.pos = self.mobile.npos.box.pos
+        self.mobile.ndest = None
+        self.mobile.trajet = None
+        return bt.Task.SUCCES
+
+    def UpdatePath(self):
+        if self.current_target is not self.mobile.target or self.mobile.cheminIncomplet():
+            if self.mobile.target is not None:
+                self.current_target = self.mobile.target
+                self.mobile.rafraichir() # on repart de la position courante
+                path = self.mobile.trouverChemin(self.current_target)
+                if path:
+                    noeuds = [n for n in reversed(path) if n is not self.mobile.npos]
+                    if noeuds:
+                        self.mobile.path = []
+                        self.mobile.ndest = noeuds[-1]
+                        mom = simulation.base.Moment.get_instance()
+                        # le tick courant compte deja comme une seconde de deplacement (comme jumpToDest)
+                        self.mobile.trajet = TrajetAnalytique(self.mobile.noeud.box.pos, noeuds, self.mobile.vit,
+                                                              self.mobile.acceleration, mom.t - mom.dt)
@@ -3,6 +3,11 @@ Composants reliés aux noeuds mobiles.
 -------------------------------------
 """
 
+import math
+import random
+import time
+from array import array
+
 from kivy.graphics.context_instructions import Color, PushMatrix, Rotate, PopMatrix, Translate
 from kivy.graphics.vertex_instructions import Rectangle, Line
 
@@ -24,14 +29,17 @@ class Mobile(ecs.Component):
     ``Mobile``. Par exemple lorsque qu'un pont transbordeur transporte un autre pont.
     On implémente plusieurs variantes de ``move``, dont le saut du centre d'un noeud à un autre,
     sans égard aux collisons. Le temps avant que le saut soit effectif dépend de la distance (d)
-    et de la vitesse du mobile (vit): durée = int(d/vit). Afin d'avoir un mouvement plus précis,
+    et de la vitesse du mobile (vit): durée = int(d/vit). Le type ``ANALYTIQUE`` calcule plutôt
+    le temps de parcours du chemin complet et dort jusqu'à l'arrivée. Afin d'avoir un mouvement plus précis,
     une variante tiens compte de l'évolution de la position du mobile dans les noeuds via ``prel``.
     La position relative (0.5,0.5) est le centre, alors que (0.0,0.0) est le coin inférieur gauche
     et (1.0,1.0) le coin supérieur droit."""
 
-    TIMED_JUMP, JUMP, MOVE = range(3)
+    TIMED_JUMP, JUMP, MOVE, ANALYTIQUE = range(4)
+
+    recherches = {} # type de mobile -> recherche de chemin (ex: pathfinder.Bidirectionnel()), defaut aStar
 
-    def __init__(self, n, p, npos, nom, type=3, vit=5.0, accl=3.0):
+    def __init__(self, n, p, npos, nom, type=3, vit=5.0, accl=3.0, acceleration=0.0):
         """:param n: on garde un handle vers le composant noeud frère
         :type n: :class:`Noeud`
         :param p: on garde un handle vers le composant physique frère
@@ -39,6 +47,9 @@ class Mobile(ecs.Component):
         :param npos: on garde un handle vers le noeud où est positionné le mobile
         :type npos: :class:`Noeud`
         :param str nom: nom du mobile
+        :param float accl: secondes de plus au premier saut d'un chemin (type ``TIMED_JUMP``)
+        :param float acceleration: accélération en m/sec2 du profil de vitesse (type ``ANALYTIQUE``),
+            0 pour une vitesse constante
         """
         self.noeud=n # handle sur le noeud
         self.phys=p # handle sur la physique
@@ -50,12 +61,17 @@ class Mobile(ecs.Component):
         self.isMoving=False
         self.nom=nom # nom du mobile
         self.vit=vit # vitesse en m/sec dans la direction de deplacement (ex: 1.0 pour un pont), si type JUMP ou MOVE. Temps en sec pour se déplacer d'un noeud si type TIMED_JUMP
-        self.accl=accl
+        self.accl=accl # secondes de plus au depart, si type TIMED_JUMP
+        self.acceleration=acceleration # m/sec2, si type ANALYTIQUE
         self.prel=(0.5,0.5) # position relative dans le noeud hote (couple float), defaut est le centre (0.5,0.5)
         self.bb=simulation.base.Blackboard() # un blackboard (memoire)
         self.root = None
 
         self.masque = 0xffffffff
+        self.planificateur = None # simulation.pathfinder.CooperatifAStar partage (TIMED_JUMP seulement), sinon recherche seule
+        self.type = type
+        self.trajet = None # bt_mobile.TrajetAnalytique en cours (type ANALYTIQUE)
+        self.cinematique = None # systeme CinematiqueMobile qui deplace le mobile (type MOVE), sinon le bt
 
         self.setup_behavior(type) # on construit l'IA
 
@@ -69,14 +85,248 @@ class Mobile(ecs.Component):
             movement = bt_mobile.moveToDest(self)
         elif type == Mobile.TIMED_JUMP:
             movement = bt_mobile.timedJumpToDest(self)
+        elif type == Mobile.ANALYTIQUE:
+            movement = bt_mobile.analyticToDest(self)
         #self.root.add_child(bt_mobile.isNDestBloque(self))
         self.root.add_child(movement)
 
+    def trouverChemin(self, target):
+        """Chemin de ``npos`` vers ``target`` (format ``aStar``), via le planificateur coopératif
+        s'il y en a un, sinon via la recherche choisie pour le type de mobile dans
+        ``Mobile.recherches`` (``aStar`` par défaut)."""
+        if self.planificateur is not None:
+            return self.planificateur.trouverChemin(self, self.npos, target, self.masque)
+        recherche = Mobile.recherches.get(self.type, simulation.pathfinder.aStar)
+        return recherche.trouverChemin(self.npos, target, self.masque)
+
+    def dureeSaut(self, premier=False):
+        """Durée (secondes) d'un saut vers le prochain noeud du chemin, ou d'une attente sur
+        place, telle que faite par ``timedJumpToDest``: le premier saut d'un chemin prend
+        ``vit+accl`` secondes en comptant le tick de la planification, les suivants ``vit``
+        secondes plus le tick de reprise. Utilisée par le planificateur coopératif pour
+        réserver chaque saut avec sa vraie durée.
+
+        :raises ValueError: si le mobile n'est pas ``TIMED_JUMP``, car la durée d'un saut
+            ``JUMP``, ``MOVE`` ou ``ANALYTIQUE`` dépend de la distance et de l'accélération,
+            ou si ``vit+accl<1`` (le premier saut se ferait dans le tick de la planification)
+        """
+        if self.type != Mobile.TIMED_JUMP:
+            raise ValueError("Mobile {0}: le planificateur coopératif demande un mobile TIMED_JUMP".format(self.nom))
+        if self.vit + self.accl < 1:
+            raise ValueError("Mobile {0}: un saut doit durer au moins une seconde (vit+accl>=1)".format(self.nom))
+        return math.floor(self.vit + self.accl) if premier else math.floor(self.vit) + 1
+
+    def cheminIncomplet(self):
+        """Vrai si le chemin planifié est consommé sans avoir atteint la cible. Ceci arrive avec
+        le planificateur coopératif, qui ne planifie que sur une fenêtre de temps."""
+        return (self.planificateur is not None and self.target is not None and self.ndest is None
+                and not self.path and self.npos is not self.target)
+
+    def position(self, t=None):
+        """Position (x,y) du mobile au temps t (défaut: maintenant), interpolée sur le trajet
+        analytique en cours, sinon ``noeud.box.pos``. Ne modifie rien, donc le rendering
+        peut l'appeler sans changer la simulation."""
+        if self.trajet is None:
+            return self.noeud.box.pos
+        t = simulation.base.Moment.get_instance().t if t is None else t
+        return self.trajet.position(t)[0]
+
+    def rafraichir(self, t=None):
+        """Avec un trajet analytique en cours, met à jour ``noeud.box.pos`` et ``npos`` par
+        interpolation au temps t (défaut: maintenant), par exemple pour replanifier à partir
+        de la position courante. Réservé à la simulation; le rendering utilise :meth:`position`.
+        Sans trajet, ne fait rien."""
+        if self.trajet is not None:
+            t = simulation.base.Moment.get_instance().t if t is None else t
+            pos, n = self.trajet.position(t)
+            self.noeud.box.pos = pos
+            if n is not None:
+                self.npos = n
+
     def update(self):
         """Update du bt."""
         self.root.run()
 
 
+class CinematiqueMobile(ecs.System):
+    """Avance en un seul pas par tick tous les mobiles ``MOVE`` en déplacement, plutôt que de
+    faire l'arithmétique de ``Vecteur2D`` dans la feuille du bt de chacun. L'état est gardé
+    dans des tableaux contigus (``array``), un indice par mobile actif: position, destination,
+    direction unitaire et longueur restante du segment en cours, et vitesse. La direction est
+    calculée une fois par segment, donc un tick ne fait qu'une multiplication-addition par axe,
+    et seule la ``Box`` des mobiles qui ont bougé est écrite. À l'arrivée à un point de passage,
+    on passe au prochain noeud du chemin; le bt (``moveToDest``) ne fait que planifier le chemin
+    et voir si le mobile est arrivé. :class:`BancCinematique` compare avec ``moveToDest``.
+
+    Exemple d'utilisation:
+
+    .. code-block:: python
+
+        cinematique = mobile.CinematiqueMobile()
+        system_manager.add_system(cinematique)
+        for entity, pont in entity_manager.pairs_for_type(Pont):
+            pont.mobile.cinematique = cinematique
+    """
+    def __init__(self):
+        super().__init__()
+        self.mobiles = [] # indice -> mobile actif
+        self.indices = {} # mobile -> indice
+        self.x, self.y = array('d'), array('d') # positions
+        self.cx, self.cy = array('d'), array('d') # destinations (ndest)
+        self.ux, self.uy = array('d'), array('d') # directions unitaires du segment
+        self.reste = array('d') # longueurs restantes du segment
+        self.vit = array('d') # vitesses
+        self.colonnes = (self.x, self.y, self.cx, self.cy, self.ux, self.uy, self.reste, self.vit)
+
+    def segment(self, i):
+        """Direction et longueur du segment de la position du mobile d'indice i vers ``ndest``."""
+        ex = self.cx[i] - self.x[i]
+        ey = self.cy[i] - self.y[i]
+        d = math.sqrt(ex*ex + ey*ey)
+        self.reste[i] = d
+        self.ux[i], self.uy[i] = (ex/d, ey/d) if d > 0.0 else (0.0, 0.0)
+
+    def activer(self, mobile):
+        """Déplace le mobile de ``noeud.box.pos`` vers ``ndest`` (il reste actif jusqu'à la fin
+        de son chemin). On appelle aussi cette méthode lorsque le chemin d'un mobile actif change."""
+        i = self.indices.get(mobile)
+        if i is None:
+            i = len(self.mobiles)
+            self.indices[mobile] = i
+            self.mobiles.append(mobile)
+            for a in self.colonnes:
+                a.append(0.0)
+        self.x[i], self.y[i] = mobile.noeud.box.pos
+        self.cx[i], self.cy[i] = mobile.ndest.box.pos
+        self.vit[i] = mobile.vit
+        self.segment(i)
+
+    def desactiver(self, mobile):
+        """Retire le mobile des mobiles actifs (le dernier prend sa place)."""
+        i = self.indices.pop(mobile)
+        j = len(self.mobiles) - 1
+        if i != j:
+            m = self.mobiles[j]
+            self.mobiles[i] = m
+            self.indices[m] = i
+            for a in self.colonnes:
+                a[i] = a[j]
+        self.mobiles.pop()
+        for a in self.colonnes:
+            a.pop()
+
+    def actif(self, mobile):
+        return mobile in self.indices
+
+    def arrivee(self, i):
+        """Le mobile d'indice i est arrivé à ``ndest``: on passe au prochain point de passage."""
+        mobile = self.mobiles[i]
+        mobile.npos = mobile.ndest
+        mobile.ndest = mobile.path.pop() if mobile.path else None
+        if mobile.ndest is None:
+            self.desactiver(mobile)
+        else:
+            self.cx[i], self.cy[i] = mobile.ndest.box.pos
+            self.segment(i)
+
+    def init(self):
+        pass
+
+    def reset(self):
+        for mobile in list(self.mobiles):
+            self.desactiver(mobile)
+
+    def update(self, dt):
+        x, y, ux, uy, reste, vit = self.x, self.y, self.ux, self.uy, self.reste, self.vit
+        bougent, arrivees = [], []
+        for i in range(len(self.mobiles)):
+            pas = vit[i] * dt
+            r = reste[i]
+            if pas < r:
+                if pas <= 0.0: # immobile, la box reste intacte
+                    continue
+                x[i] += ux[i] * pas
+                y[i] += uy[i] * pas
+                reste[i] = r - pas
+            else:
+                x[i] = self.cx[i]
+                y[i] = self.cy[i]
+                reste[i] = 0.0
+                arrivees.append(i)
+            bougent.append(i)
+        mobiles = self.mobiles
+        for i in bougent:
+            mobiles[i].noeud.box.pos = (x[i], y[i])
+        for i in reversed(arrivees): # en ordre decroissant, desactiver ne deplace pas un indice a traiter
+            self.arrivee(i)
+
+
+class BancCinematique:
+    """ Banc d'essai de :class:`CinematiqueMobile` contre le déplacement dans la feuille
+    ``moveToDest`` de chaque mobile. Reproductible (grille, nombre de mobiles, ticks et graine
+    en paramètres):
+
+    .. code-block:: python
+
+        mobile.BancCinematique.comparer(nmobiles=300, ticks=300, nx=40, ny=40, seed=1)
+    """
+
+    @staticmethod
+    def mobiles(noeuds, nmobiles, seed=1, vit=2.0):
+        """ nmobiles mobiles ``MOVE`` placés et dirigés au hasard (graine ``seed``) sur les
+        noeuds d'un graphe, chacun au centre (``prel`` (0.5,0.5)) de son noeud hôte. """
+        rng = random.Random(seed)
+        mobiles = []
+        for k in range(nmobiles):
+            npos = rng.choice(noeuds)
+            (x, y), (dx, dy) = npos.box.pos, npos.box.size
+            box = simulation.graphe.Box((x + dx*0.5, y + dy*0.5), npos.box.size)
+            n = simulation.graphe.Noeud(None)
+            n.box = box
+            m = Mobile(n, simulation.graphe.Phys(n), npos, "m{0}".format(k), type=Mobile.MOVE, vit=vit)
+            m.target = rng.choice(noeuds)
+            mobiles.append(m)
+        return mobiles
+
+    @staticmethod
+    def comparer(nmobiles=300, ticks=300, nx=40, ny=40, seed=1):
+        """ Chronomètre ``ticks`` ticks des mêmes mobiles déplacés par leur bt, puis par
+        :class:`CinematiqueMobile`, et compte les écritures de ``Box.pos``. Le premier tick,
+        qui planifie les chemins (A*), n'est pas chronométré.
+
+        :return: dictionnaire variante -> (secondes, écritures)
+        """
+        em, noeuds = simulation.pathfinder.Banc.grille(nx, ny, seed=seed)
+        resultats = {}
+        for nom in ("moveToDest", "CinematiqueMobile"):
+            mobiles = BancCinematique.mobiles(noeuds, nmobiles, seed)
+            cinematique = CinematiqueMobile() if nom == "CinematiqueMobile" else None
+            for m in mobiles:
+                m.cinematique = cinematique
+            ecritures = [0]
+            marquer = simulation.graphe.Box.marquer
+            def compter(box):
+                ecritures[0] += 1
+                marquer(box)
+            simulation.graphe.Box.marquer = compter
+            try:
+                for m in mobiles: # planification des chemins, commune aux deux variantes
+                    m.update()
+                ecritures[0] = 0
+                debut = time.perf_counter()
+                for t in range(ticks):
+                    for m in mobiles:
+                        m.update()
+                    if cinematique is not None:
+                        cinematique.update(1.0)
+                duree = time.perf_counter() - debut
+            finally:
+                simulation.graphe.Box.marquer = marquer
+            resultats[nom] = (duree, ecritures[0])
+            print("{0:>18} {1:>8.3f} s  box.pos: {2:>8}".format(nom, *resultats[nom]))
+        return resultats
+
+
 class RenderChemin(ecs.System):
     def __init__(self, canvas):
         super().__init__()
@@ -1,3 +1,3 @@
 """ Utilitaires de base pour la simulation. """
 
-from . import base, builder, expert, graphe, horaire, pathfinder, stochastique, kanban
+from . import base, builder, expert, graphe, horaire, pathfinder, stochastique, kanban, kpi, partition
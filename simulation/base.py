@@ -5,6 +5,7 @@ Utilitaires de base pour la simulation.
 import csv
 import math
 import datetime
+import heapq
 from collections import OrderedDict, defaultdict, namedtuple
 
 
@@ -105,6 +106,125 @@ class Monitor:
             z.writerows(Monitor._datadex)
 
 
+class QuantileP2:
+    """ Estimation en ligne d'un quantile via l'algorithme P² de Jain et Chlamtac (1985).
+        La mémoire est constante (5 marqueurs), peu importe le nombre d'observations.
+
+        Exemple d'utilisation:
+
+    .. code-block:: python
+
+        q = base.QuantileP2(0.9)
+        for x in range(1000):
+            q.add(x)
+        print(q.get())
+
+    """
+
+    def __init__(self, p):
+        """:param float p: quantile visé dans ]0,1[, exemple: 0.5 pour la médiane."""
+        self.p = p
+        self.q = [] # hauteurs des marqueurs (les 5 premieres observations au depart)
+        self.n = [0, 1, 2, 3, 4] # positions des marqueurs
+        self.np = [0, 2*p, 4*p, 2+2*p, 4] # positions desirees des marqueurs
+        self.dn = [0, p/2, p, (1+p)/2, 1] # increments des positions desirees
+
+    def add(self, x):
+        """ Ajoute une observation. """
+        q = self.q
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        n = self.n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k+1]: k += 1
+        for i in range(k+1, 5): n[i] += 1
+        for i in range(5): self.np[i] += self.dn[i]
+        for i in range(1, 4): # ajustement des marqueurs centraux
+            d = self.np[i] - n[i]
+            if (d >= 1 and n[i+1]-n[i] > 1) or (d <= -1 and n[i-1]-n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = q[i] + d/(n[i+1]-n[i-1]) * ((n[i]-n[i-1]+d)*(q[i+1]-q[i])/(n[i+1]-n[i]) +
+                                                 (n[i+1]-n[i]-d)*(q[i]-q[i-1])/(n[i]-n[i-1]))
+                if not q[i-1] < qp < q[i+1]: # parabolique hors borne, on fait du lineaire
+                    qp = q[i] + d*(q[i+d]-q[i])/(n[i+d]-n[i])
+                q[i] = qp
+                n[i] += d
+
+    def get(self):
+        """ Retourne l'estimation du quantile (exacte sous 5 observations, None si aucune). """
+        if not self.q:
+            return None
+        if len(self.q) < 5:
+            return self.q[min(len(self.q)-1, int(self.p*len(self.q)))]
+        return self.q[2]
+
+
+class StatistiqueEnLigne:
+    """ Accumulateur de statistiques en ligne: nombre, moyenne et variance (algorithme de Welford),
+        min, max et quantiles (via :class:`QuantileP2`). Chaque ajout est en O(1) et la mémoire
+        ne croît pas avec le nombre d'observations.
+
+        Exemple d'utilisation:
+
+    .. code-block:: python
+
+        s = base.StatistiqueEnLigne()
+        for x in (3, 5, 4):
+            s.add(x)
+        print(s.moyenne(), s.ecart_type(), s.min, s.max, s.quantile(0.5))
+
+    """
+
+    def __init__(self, quantiles=(0.5, 0.9)):
+        """:param quantiles: les quantiles à estimer (tuple de float dans ]0,1[)."""
+        self.n = 0 # nb d'observations
+        self._moy = 0.0 # moyenne courante
+        self._m2 = 0.0 # somme des carres des ecarts a la moyenne
+        self.min = None
+        self.max = None
+        self.quantiles = OrderedDict((p, QuantileP2(p)) for p in quantiles)
+
+    def add(self, x):
+        """ Ajoute une observation. """
+        self.n += 1
+        delta = x - self._moy
+        self._moy += delta / self.n
+        self._m2 += delta * (x - self._moy)
+        if self.min is None or x < self.min: self.min = x
+        if self.max is None or x > self.max: self.max = x
+        for q in self.quantiles.values():
+            q.add(x)
+
+    def moyenne(self):
+        """ Moyenne des observations (0 si aucune). """
+        return self._moy
+
+    def variance(self):
+        """ Variance échantillonnale (0 si moins de 2 observations). """
+        return self._m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    def ecart_type(self):
+        """ Écart-type échantillonnal. """
+        return math.sqrt(self.variance())
+
+    def quantile(self, p):
+        """ Estimation du quantile p, qui doit faire partie des quantiles de l'accumulateur. """
+        return self.quantiles[p].get()
+
+    def __repr__(self):
+        return "n={0} moy={1:.3f} et={2:.3f} min={3} max={4}".format(
+            self.n, self._moy, self.ecart_type(), self.min, self.max)
+
+
 class Debug:
     """ Permet de print un message concernant un obj lorsque le
         flag `is_debug` existe dans l'objet cible.
@@ -387,8 +507,29 @@ class TripleManager:
 
 
 class Moment:
-    """Gestionnaire de temps en système 24 heures."""
+    """Gestionnaire de temps en système 24 heures.
+
+    En plus des ticks, le moment tient un calendrier d'abonnements: plutôt que de tester
+    ``t % periode`` ou ``tickM`` à chaque seconde, un composant enregistre une fonction sans
+    argument à appeler à un temps absolu ou périodiquement. Les abonnements sont dans un tas
+    trié par temps d'échéance et seuls ceux qui sont dus sont déclenchés à l'update. À temps
+    égal, ils sont déclenchés dans l'ordre d'enregistrement.
+
+    Exemple d'utilisation:
+
+    .. code-block:: python
+
+        mom = base.Moment(7*3600)
+        mom.chaque_quart(stat.fin_quart)  # enregistre avant les secteurs, donc declenche avant
+        for secteur in secteurs:
+            mom.chaque_quart(secteur.incr_num_quart)
+        a = mom.chaque_minute(compteur.incr)
+        mom.planifier(3*86400, modele.fin_campagne)
+        mom.annuler(a)
+
+    """
     instance = None
+    QUART = 43200 # duree d'un quart en secondes
 
     def __init__(self, t0):
         """Cree une instance du gestionnaire de temps. A priori, il doit être unique.
@@ -401,6 +542,8 @@ class Moment:
         self.tnow = t0  # t now (somme de t0 et t) module 24h
         self.trel = 0 # t module 12h (temps relatif au quart en cours)
         self.ticks_reset()  # reset des ticks
+        self.calendrier = []  # tas des abonnements [echeance, sequence, periode, fct]
+        self.sequence = 0  # compteur d'enregistrement pour departager les echeances egales
 
         self.nbHeureQuart = 12
         self.set_instance()
@@ -424,6 +567,62 @@ class Moment:
         self.trel = self.t % 43200
         self.ticks_reset()
         self.ticks_set()
+        if self.calendrier and self.calendrier[0][0] <= self.t:
+            self.declencher()
+
+    def planifier(self, t, fct, periode=None):
+        """Abonne ``fct`` au temps absolu ``t`` (en secondes de simulation, comme ``self.t``).
+        Un temps déjà passé est déclenché au prochain update.
+
+        :param int t: temps d'échéance
+        :param fct: fonction sans argument
+        :param int periode: si donnée, l'abonnement se répète à chaque ``periode`` secondes
+        :return: l'abonnement, pour :meth:`annuler`
+        """
+        abonnement = [t, self.sequence, periode, fct]
+        self.sequence += 1
+        heapq.heappush(self.calendrier, abonnement)
+        return abonnement
+
+    def chaque(self, periode, fct, decalage=0):
+        """Abonne ``fct`` à chaque temps ``t`` tel que ``t % periode == decalage``, à partir
+        du prochain après le temps courant.
+
+        :return: l'abonnement, pour :meth:`annuler`
+        """
+        decalage %= periode
+        t = decalage + ((self.t - decalage) // periode + 1) * periode
+        return self.planifier(t, fct, periode)
+
+    def chaque_minute(self, fct):
+        """Abonne ``fct`` à chaque minute (l'équivalent de ``tickM``)."""
+        return self.chaque(60, fct)
+
+    def chaque_quart(self, fct, decalage=0):
+        """Abonne ``fct`` à chaque quart, ``decalage`` secondes après le début du quart
+        (l'équivalent de ``tickQ`` avec ``decalage=0``)."""
+        return self.chaque(Moment.QUART, fct, decalage)
+
+    @staticmethod
+    def annuler(abonnement):
+        """Annule un abonnement. Il est retiré du tas à son échéance."""
+        abonnement[3] = None
+
+    def declencher(self):
+        """Déclenche les abonnements dus, c'est-à-dire d'échéance <= ``self.t``. Un abonnement
+        périodique est remis dans le tas à sa prochaine échéance; si ``dt`` couvre plusieurs
+        périodes, il est déclenché une fois par échéance. """
+        calendrier = self.calendrier
+        while calendrier and calendrier[0][0] <= self.t:
+            abonnement = calendrier[0]
+            fct = abonnement[3]
+            if fct is None or abonnement[2] is None:
+                heapq.heappop(calendrier)
+            else:
+                abonnement[0] += abonnement[2]
+                heapq.heapreplace(calendrier, abonnement)
+            if fct is not None:
+                fct()
 
     def ticks_reset(self):
         """Reset des ticks."""
@@ -441,10 +640,13 @@ class Moment:
             * tickH: activation à chaque heure
             * tickJ: activation à chaque jour
         """
-        self.tickQ = self.t % 43200 == 0
+        # les periodes sont imbriquees: hors des minutes, un seul modulo
         self.tickM = self.t % 60 == 0
-        self.tickH = self.t % 3600 == 0
-        self.tickJ = self.t % 86400 == 0
+        if self.tickM:
+            self.tickH = self.t % 3600 == 0
+            if self.tickH:
+                self.tickQ = self.t % 43200 == 0
+                self.tickJ = self.tickQ and self.t % 86400 == 0
 
     def nbj(self):
         """ Nb de jours depuis le debut de la simulation. """
@@ -5,9 +5,16 @@ Composants et systèmes reliés au graphe du modèle.
 
 from kivy.graphics.context_instructions import Color, PushMatrix, Rotate, PopMatrix, Translate
 from kivy.graphics.vertex_instructions import Rectangle, Line
+from kivy.graphics.instructions import InstructionGroup
+import math
+from array import array
+import threading
+import weakref
+from collections import defaultdict
 from pprint import pprint
 
 from .. import ecs
+from . import base
 
 class Ligne(ecs.Component):
     """Une ligne simple entre 2 points en pixels. Une ``Ligne`` est associée aux ``Arete``
@@ -41,8 +48,14 @@ class RenderLigne(ecs.System):
         pass
 
     def update(self, dt):
+        vue = Vue.get_instance()
         with self.canvas:
             for entity, li in self.entity_manager.pairs_for_type(Ligne):
+                if vue is not None:
+                    x0, x1 = min(li.ends[0], li.ends[2]), max(li.ends[0], li.ends[2])
+                    y0, y1 = min(li.ends[1], li.ends[3]), max(li.ends[1], li.ends[3])
+                    if not vue.intersecte((x0, y0), (x1-x0, y1-y0)):
+                        continue
                 Color(*self.couleurs[li.sorte])
                 Line(points=li.ends, width=li.width)
 
@@ -51,19 +64,72 @@ class Box(ecs.Component):
     """``Box`` sert deux fonctions: définir la structure du modèle qu'on load via
     un fichier csv et pour le rendering des ``Noeud``. On peut limiter la
     visibilité via un flag). La couleur et la texture sont reconfiguration et 
-    servent essentiellement au rendering lors d'une simulation. """
+    servent essentiellement au rendering lors d'une simulation. Si un index spatial
+    (:class:`GrilleSpatiale`) est installé dans ``Box.index``, chaque ``Box`` y est ajoutée
+    à la création et déplacée lorsque ``pos`` change. Les setters de ``pos``, ``color``,
+    ``contour_color`` et ``alpha`` ajoutent la box aux ensembles de boxes modifiées obtenus
+    avec :meth:`suivre`, ce qui permet aux systèmes de rendering de ne mettre à jour que les
+    instructions des boxes modifiées. Ils la marquent aussi pour ``changed_since`` si le suivi
+    est activé (``ecs.Tracked.enable(Box)``). """
+    index = None # GrilleSpatiale optionnelle
+    suivis = weakref.WeakValueDictionary() # id -> ensemble de boxes modifiees d'un abonne
+    verrou = threading.Lock() # les systemes d'un update parallele marquent depuis leur thread
+
+    class Modifiees(set):
+        """Ensemble de boxes modifiées d'un abonné (un ``set`` ordinaire, mais qui accepte
+        les références faibles de ``Box.suivis``)."""
+        pass
+
+    @staticmethod
+    def suivre():
+        """Retourne un nouvel ensemble, auquel sera ajoutée toute box modifiée. L'abonné
+        (typiquement un système de rendering) le vide après chaque frame et en est le seul
+        propriétaire: ``Box.suivis`` ne garde qu'une référence faible, l'abonnement prend donc
+        fin avec l'ensemble, ou explicitement avec :meth:`oublier`."""
+        sales = Box.Modifiees()
+        with Box.verrou:
+            Box.suivis[id(sales)] = sales
+        return sales
+
+    @staticmethod
+    def oublier(sales):
+        """Désabonne l'ensemble obtenu avec :meth:`suivre`."""
+        with Box.verrou:
+            Box.suivis.pop(id(sales), None)
+
+    @staticmethod
+    def prendre(sales):
+        """Vide l'ensemble obtenu avec :meth:`suivre` et retourne les boxes qu'il contenait.
+        Les boxes peuvent être marquées depuis les threads d'un update parallèle, l'abonné
+        doit donc passer par ici plutôt que d'itérer l'ensemble."""
+        with Box.verrou:
+            boxes = list(sales)
+            sales.clear()
+        return boxes
+
+    def marquer(self):
+        """Marque la box comme modifiée pour tous les abonnés (et pour ``changed_since``)."""
+        if Box.suivis:
+            with Box.verrou:
+                for sales in Box.suivis.values():
+                    sales.add(self)
+        if self.tracking:
+            ecs.Tracked.touch(self)
+
     def __init__(self, pos, size):
         """:param pos: couple formé des coordonnées du coins inférieurs gauche.
         :param size: couple formé des dimensions dx et dy.
         """
-        self.pos=pos
         self.size=size
+        self._pos=pos
+        if Box.index is not None:
+            Box.index.inserer(self)
         self.cent=(self.pos[0]+self.size[0]//2, self.pos[1]+self.size[1]//2)
         self.ptxt=(self.pos[0]+4, self.pos[1]+4)
         self.visible=True
         self.avecTexture=True
         self.sorte=1 # sorte de box (voir Res)
-        self.alpha = 1
+        self._alpha = 1
         self._color = (1,1,1)
         self._contour_color = (0,0,0)
         self.custom_draw = False
@@ -71,13 +137,27 @@ class Box(ecs.Component):
     def m(self, value):
         print(value)
 
+    @property
+    def pos(self):
+        return self._pos
+
+    @pos.setter
+    def pos(self, value):
+        if value != self._pos:
+            self._pos = value
+            if Box.index is not None:
+                Box.index.deplacer(self)
+            self.marquer()
+
     @property
     def color(self):
         return self._color
 
     @color.setter
     def color(self, value):
-        self._color = value
+        if value != self._color:
+            self._color = value
+            self.marquer()
         #self.m(value)
 
     @property
@@ -86,9 +166,245 @@ class Box(ecs.Component):
 
     @contour_color.setter
     def contour_color(self, value):
-        self._contour_color = value
+        if value != self._contour_color:
+            self._contour_color = value
+            self.marquer()
         #self.m(value)
 
+    @property
+    def alpha(self):
+        return self._alpha
+
+    @alpha.setter
+    def alpha(self, value):
+        if value != self._alpha:
+            self._alpha = value
+            self.marquer()
+
+class GrilleSpatiale:
+    """ Index spatial des ``Box`` par grille uniforme. Chaque ``Box`` est inscrite dans les
+    cellules de ``pas`` pixels qu'elle recouvre, ce qui évite un balayage complet de
+    ``pairs_for_type(Box)`` pour le culling du rendering (:meth:`rectangle`), le hit-testing
+    (:meth:`point`, :meth:`noeuds`) et les requêtes de proximité (:meth:`proches`).
+
+    Une box dont l'entité a été retirée du entity manager (ou dont la ``Box`` a été retirée
+    de l'entité) n'est plus retournée par les requêtes: elle est retirée de l'index lorsqu'une
+    requête la rencontre. Une box pas encore ajoutée à une entité est indexée normalement.
+    Les requêtes retournent les boxes dans leur ordre d'insertion (conservé par
+    :meth:`deplacer`), ce qui garde l'ordre de dessin stable d'un frame à l'autre.
+
+    Exemple d'utilisation, après le chargement du modèle:
+
+    .. code-block:: python
+
+        index = simulation.graphe.GrilleSpatiale(pas=64)
+        index.construire(entity_manager)
+        simulation.graphe.Box.index = index # maintenu sur creation et changement de pos
+    """
+
+    def __init__(self, pas=64):
+        """:param pas: taille en pixels des cellules de la grille"""
+        self.pas = pas
+        self.cellules = defaultdict(set) # (i,j) -> boxes
+        self.etendues = {} # box -> (i0, j0, i1, j1) cellules recouvertes
+        self.rangs = {} # box -> rang d'insertion
+        self.prochain = 0
+        self.entity_manager = None
+
+    def construire(self, entity_manager):
+        """ Indexe toutes les ``Box`` du entity manager, qui sert ensuite à reconnaître les
+        boxes retirées. """
+        self.entity_manager = entity_manager
+        for entity, box in entity_manager.pairs_for_type(Box):
+            self.inserer(box)
+
+    def vivante(self, box):
+        """ Faux si la box a été retirée du entity manager. """
+        entity = getattr(box, 'entity', None) # assigne par le entity manager a l'ajout
+        if entity is None or self.entity_manager is None:
+            return True
+        return self.entity_manager.database.get(Box, {}).get(entity) is box
+
+    def _etendue(self, pos, size):
+        pas = self.pas
+        return (int(pos[0] // pas), int(pos[1] // pas),
+                int((pos[0] + max(size[0], 0)) // pas), int((pos[1] + max(size[1], 0)) // pas))
+
+    def inserer(self, box):
+        """ Ajoute la box à l'index (ou la déplace si elle y est déjà). """
+        if box in self.etendues:
+            self.deplacer(box)
+            return
+        self.rangs[box] = self.prochain
+        self.prochain += 1
+        self._inscrire(box)
+
+    def _inscrire(self, box):
+        e = self._etendue(box.pos, box.size)
+        self.etendues[box] = e
+        for i in range(e[0], e[2]+1):
+            for j in range(e[1], e[3]+1):
+                self.cellules[(i, j)].add(box)
+
+    def retirer(self, box):
+        """ Retire la box de l'index. """
+        self.rangs.pop(box, None)
+        self._desinscrire(box)
+
+    def _desinscrire(self, box):
+        e = self.etendues.pop(box, None)
+        if e is None:
+            return
+        for i in range(e[0], e[2]+1):
+            for j in range(e[1], e[3]+1):
+                cellule = self.cellules[(i, j)]
+                cellule.discard(box)
+                if not cellule:
+                    del self.cellules[(i, j)]
+
+    def deplacer(self, box):
+        """ Met à jour les cellules de la box après un changement de ``pos``. """
+        e = self.etendues.get(box)
+        if e is None or e == self._etendue(box.pos, box.size):
+            return
+        self._desinscrire(box)
+        self._inscrire(box)
+
+    def _candidats(self, x0, y0, x1, y1):
+        pas = self.pas
+        candidats = set()
+        for i in range(int(x0 // pas), int(x1 // pas)+1):
+            for j in range(int(y0 // pas), int(y1 // pas)+1):
+                cellule = self.cellules.get((i, j))
+                if cellule:
+                    candidats |= cellule
+        mortes = [b for b in candidats if not self.vivante(b)]
+        for b in mortes:
+            self.retirer(b)
+            candidats.discard(b)
+        return sorted(candidats, key=self.rangs.__getitem__)
+
+    def rectangle(self, pos, size):
+        """ Boxes qui intersectent le rectangle (ex: le viewport). """
+        x0, y0 = pos
+        x1, y1 = x0 + size[0], y0 + size[1]
+        return [b for b in self._candidats(x0, y0, x1, y1)
+                if b.pos[0] <= x1 and b.pos[0] + b.size[0] >= x0 and b.pos[1] <= y1 and b.pos[1] + b.size[1] >= y0]
+
+    def point(self, x, y):
+        """ Boxes qui contiennent le point (x,y). """
+        return [b for b in self._candidats(x, y, x, y)
+                if b.pos[0] <= x <= b.pos[0] + b.size[0] and b.pos[1] <= y <= b.pos[1] + b.size[1]]
+
+    def proches(self, pos, rayon):
+        """ Boxes à une distance d'au plus ``rayon`` du point pos. """
+        x, y = pos
+        proches = []
+        for b in self._candidats(x - rayon, y - rayon, x + rayon, y + rayon):
+            dx = max(b.pos[0] - x, 0, x - b.pos[0] - b.size[0])
+            dy = max(b.pos[1] - y, 0, y - b.pos[1] - b.size[1])
+            if dx*dx + dy*dy <= rayon*rayon:
+                proches.append(b)
+        return proches
+
+    def entite(self, box):
+        """ Entité de la box, None si la box n'a pas (ou plus) d'entité dans le entity
+        manager. """
+        entity = getattr(box, 'entity', None)
+        return entity if entity is not None and self.vivante(box) else None
+
+    def noeuds(self, x, y):
+        """ ``Noeud`` dont la box contient le point (x,y). """
+        noeuds = []
+        for box in self.point(x, y):
+            entity = self.entite(box)
+            if entity is not None:
+                try:
+                    noeuds.append(self.entity_manager.component_for_entity(entity, Noeud))
+                except ecs.exceptions.NonexistentComponentTypeForEntity:
+                    pass
+        return noeuds
+
+
+class Vue:
+    """ Viewport (caméra) partagé par les systèmes de rendering. ``pos`` et ``size`` donnent le
+    rectangle visible en pixels du modèle. Les systèmes de rendering ne dessinent que ce qui
+    intersecte la vue (culling via ``Box.index`` si installé, sinon par test de chaque box).
+    Lorsque le ``zoom`` est sous ``seuil_lod``, les systèmes passent à un niveau de détail
+    réduit (ex: un rectangle par secteur plutôt qu'une cuve à la fois, pas de texte).
+    Sans vue (``Vue.instance`` à None), on dessine tout comme avant.
+    """
+    instance = None
+
+    def __init__(self, pos=(0, 0), size=(1100, 700), zoom=1.0, seuil_lod=0.5):
+        """
+        :param pos: coin inférieur gauche du rectangle visible
+        :param size: dimensions du rectangle visible
+        :param float zoom: facteur d'agrandissement courant
+        :param float seuil_lod: zoom sous lequel le niveau de détail est réduit
+        """
+        self.pos = pos
+        self.size = size
+        self.zoom = zoom
+        self.seuil_lod = seuil_lod
+        self.set_instance()
+
+    def set_instance(self):
+        if Vue.instance is None:
+            Vue.instance = self
+
+    @staticmethod
+    def get_instance():
+        return Vue.instance
+
+    def cadrer(self, pos, size, zoom=None):
+        """ Déplace la vue (et change le zoom si donné). """
+        self.pos = pos
+        self.size = size
+        if zoom is not None:
+            self.zoom = zoom
+
+    def detail(self):
+        """ Vrai si on dessine au niveau de détail complet. """
+        return self.zoom >= self.seuil_lod
+
+    def intersecte(self, pos, size):
+        """ Vrai si le rectangle (pos, size) est au moins en partie visible. """
+        return (pos[0] <= self.pos[0] + self.size[0] and pos[0] + size[0] >= self.pos[0] and
+                pos[1] <= self.pos[1] + self.size[1] and pos[1] + size[1] >= self.pos[1])
+
+    def visible(self, box):
+        return self.intersecte(box.pos, box.size)
+
+    @staticmethod
+    def etendue_texte(texte, font_size):
+        """ Étendue (largeur, hauteur) d'une étiquette ``CoreLabel`` du texte, sans créer sa
+        texture, pour tester sa visibilité avec :meth:`intersecte`. C'est un majorant (un cadratin
+        par caractère, 1.5 corps par ligne), donc une étiquette en partie visible n'est jamais
+        écartée. """
+        lignes = texte.split('\n')
+        return (font_size * max(len(ligne) for ligne in lignes), 1.5 * font_size * len(lignes))
+
+    def pairs_visibles(self, entity_manager, component_type):
+        """ Itère les triplets (entity, composant, box) des entités visibles qui ont un
+        ``component_type`` et une ``Box``. Avec ``Box.index``, seules les boxes de la vue
+        sont parcourues. """
+        index = Box.index
+        if index is None:
+            boxes = entity_manager.database.get(Box, {})
+            for entity, c in entity_manager.pairs_for_type(component_type):
+                box = boxes.get(entity)
+                if box is not None and self.visible(box):
+                    yield entity, c, box
+        else:
+            composants = entity_manager.database.get(component_type, {})
+            for box in index.rectangle(self.pos, self.size):
+                entity = index.entite(box)
+                c = composants.get(entity) if entity is not None else None
+                if c is not None:
+                    yield entity, c, box
+
+
 class PprintBox(ecs.System):
     def __init__(self):
         super().__init__()
@@ -101,19 +417,112 @@ class PprintBox(ecs.System):
 
     def update(self, dt):
         for entity, box in self.entity_manager.pairs_for_type(Box):
-            print("component box de: ", entity.name())
+            print("component box de: ", entity.name(),
+                  sorted(t.__name__ for t in self.entity_manager.component_types_for_entity(entity)))
             pprint(vars(box))
 
 
+class InstructionsRetenues:
+    """ Instructions de rendering en mode retenu d'un système. Elles sont dans un
+    ``InstructionGroup`` qui appartient au système et qu'on ajoute au canvas: si le canvas est
+    vidé (``canvas.clear()``), le groupe est rajouté et reconstruit au frame suivant. Avec une
+    ``Vue``, le groupe ne contient que les boxes visibles et il est reconstruit lorsque la vue
+    se déplace; le niveau de détail réduit (``Vue.detail``) n'est pas utilisé en mode retenu.
+    Entre deux reconstructions, seules les instructions des boxes modifiées (``Box.suivre``)
+    sont mises à jour. Lorsque l'entity manager ajoute ou retire des composants du type
+    dessiné (``EntityManager.version``), les instructions des boxes dont l'entité n'a plus
+    ce composant sont retirées du groupe.
+    """
+    def __init__(self, canvas, creer, maj):
+        """
+        :param canvas: canvas kivy où ajouter le groupe
+        :param creer: fct(box) qui retourne la liste des instructions de la box, ou None si
+            la box n'est pas dessinée par ce système
+        :param maj: fct(box, instructions) qui met à jour les instructions d'une box modifiée
+        """
+        self.canvas = canvas
+        self.creer = creer
+        self.maj = maj
+        self.groupe = InstructionGroup()
+        self.instructions = {} # box -> instructions
+        self.sales = Box.suivre()
+        self.cadre = None
+        self.construit = False
+        self.version = None # EntityManager.version du type dessine au dernier update
+
+    def update(self, candidates, entity_manager=None, component_type=None):
+        """ :param candidates: fct(vue) qui retourne les boxes à dessiner lors d'une
+            reconstruction (vue peut être None)
+        :param entity_manager: si donné, on retire les instructions des entités qui n'ont
+            plus de ``component_type`` (``Box`` par défaut)
+        """
+        if entity_manager is not None:
+            self.elaguer(entity_manager, Box if component_type is None else component_type)
+        vue = Vue.get_instance()
+        cadre = None if vue is None else (tuple(vue.pos), tuple(vue.size))
+        if self.canvas.indexof(self.groupe) < 0:
+            self.canvas.add(self.groupe)
+            self.construit = False
+        sales = Box.prendre(self.sales)
+        if not self.construit or cadre != self.cadre:
+            self.groupe.clear()
+            self.instructions = {}
+            for box in candidates(vue):
+                self.ajouter(box)
+            self.cadre = cadre
+            self.construit = True
+        else:
+            for box in sales:
+                instructions = self.instructions.get(box)
+                if instructions is not None:
+                    self.maj(box, instructions)
+                elif vue is None or vue.visible(box):
+                    self.ajouter(box) # entrée dans la vue
+
+    def elaguer(self, entity_manager, component_type):
+        """ Retire du groupe les instructions des boxes dont l'entité n'a plus de
+        ``component_type``, si l'entity manager a ajouté ou retiré de ces composants. """
+        version = entity_manager.version(component_type)
+        if version == self.version:
+            return
+        self.version = version
+        composants = entity_manager.database.get(component_type, {})
+        for box in [box for box in self.instructions if getattr(box, "entity", None) not in composants]:
+            for instruction in self.instructions.pop(box):
+                self.groupe.remove(instruction)
+
+    def ajouter(self, box):
+        instructions = self.creer(box)
+        if instructions is not None:
+            for instruction in instructions:
+                self.groupe.add(instruction)
+            self.instructions[box] = instructions
+
+    def oublier(self):
+        """ Retire le groupe du canvas et désabonne le système des boxes modifiées. """
+        if self.canvas.indexof(self.groupe) >= 0:
+            self.canvas.remove(self.groupe)
+        Box.oublier(self.sales)
+        self.instructions = {}
+        self.construit = False
+
+
 class RenderBox(ecs.System):
     """Systeme pour le rendering des box."""
-    def __init__(self, canvas,couleurs,textures):
+    def __init__(self, canvas,couleurs,textures,retenu=False):
+        """:param bool retenu: si vrai, les instructions sont créées une seule fois dans un groupe
+            propre au système, puis on ne met à jour que celles des boxes modifiées (voir
+            :class:`InstructionsRetenues`).
+        """
         super().__init__()
         self.canvas=canvas
         self.couleurs=couleurs
         self.textures=textures
         self.box = []
+        self.membres = set() # boxes de self.box, pour le mode retenu
         self.custom_draw = []
+        self.retenu = InstructionsRetenues(canvas, self.creer, self.maj) if retenu else None
+        self.version = None # EntityManager.version(Box) vue par init ou update
 
     def init(self):
         for entity, box in self.entity_manager.pairs_for_type(Box):
@@ -122,16 +531,42 @@ class RenderBox(ecs.System):
             else:
                 box.color = self.couleurs[box.sorte]
                 self.box.append(box)
+                self.membres.add(box)
+        self.version = self.entity_manager.version(Box)
 
     def reset(self):
         pass
 
     def update(self, dt):
+        em = self.entity_manager
+        if em.version(Box) != self.version: # des boxes ont ete retirees (ou ajoutees)
+            self.version = em.version(Box)
+            boxes = em.database.get(Box, {})
+            self.box = [box for box in self.box if boxes.get(getattr(box, "entity", None)) is box]
+            self.membres = set(self.box)
+        if self.retenu is not None:
+            self.retenu.update(lambda vue: (box for box in self.box if vue is None or vue.visible(box)), em)
+            return
+        vue = Vue.get_instance()
         with self.canvas:
             for box in self.box:
+                if vue is not None and not vue.visible(box):
+                    continue
                 Color(box.color[0],box.color[1],box.color[2],box.alpha)
                 Rectangle(source=self.textures[box.sorte], pos=box.pos, size=box.size)
 
+    def creer(self, box):
+        if box not in self.membres:
+            return None
+        return (Color(box.color[0],box.color[1],box.color[2],box.alpha),
+                Rectangle(source=self.textures[box.sorte], pos=box.pos, size=box.size))
+
+    def maj(self, box, instructions):
+        couleur, rectangle = instructions
+        couleur.rgba = (box.color[0],box.color[1],box.color[2],box.alpha)
+        rectangle.pos = box.pos
+        rectangle.size = box.size
+
 
 class Noeud(ecs.Component):
     """L'un des deux éléments structurels du graphe, l'autre est ``Arete``. 
@@ -199,6 +634,236 @@ class Noeud(ecs.Component):
         else:
             return "noeud:{0}".format(self.entity._guid)
 
+
+class GraphIndex(object):
+    """Index compact du graphe construit à partir des composants ``Noeud`` et ``Arete`` de
+    l'entity manager. Chaque ``Noeud`` reçoit un id entier (``ids``, et ``noeuds`` pour le
+    chemin inverse), les coordonnées ``Box.pos`` sont dans les tableaux ``x`` et ``y`` et
+    l'adjacence est en format CSR (compressed sparse row): les voisins de l'id i sont
+    ``cible[debut[i]:debut[i+1]]``. On garde trois adjacences: aval (``oua``), amont (``ina``)
+    et non orientée (aval puis amont, comme ``Noeud.calculerVoisins``). Les parcours (BFS,
+    k sauts, distances) travaillent par frontière sur ces tableaux plutôt que par pointeurs.
+    Si le graphe change, il faut rappeler ``construire``.
+
+    Exemple d'utilisation:
+
+    .. code-block:: python
+
+        gi = simulation.graphe.GraphIndex(entity_manager)
+        proches = gi.k_sauts(noeud, 3)
+        cuves = gi.suivants(noeud, 5) # les 5 prochains noeuds en aval
+    """
+    def __init__(self, entity_manager):
+        """:param entity_manager: entity manager avec les composants ``Noeud`` et ``Arete``
+        :type entity_manager: :class:`ecs.managers.EntityManager`
+        """
+        self.entity_manager = entity_manager
+        self.construire()
+
+    def construire(self):
+        """(Re)construit la numérotation, les coordonnées et les adjacences CSR."""
+        self.noeuds = [n for e, n in self.entity_manager.pairs_for_type(Noeud)]
+        self.ids = {n: i for i, n in enumerate(self.noeuds)} # noeud -> id entier
+        self.x = array('d', (n.box.pos[0] if n.box is not None else 0.0 for n in self.noeuds))
+        self.y = array('d', (n.box.pos[1] if n.box is not None else 0.0 for n in self.noeuds))
+        self.aval = self._csr(lambda n: [a.to for a in n.oua])
+        self.amont = self._csr(lambda n: [a.fr for a in n.ina])
+        self.adjacence_complete = self._csr(lambda n: [a.to for a in n.oua] + [a.fr for a in n.ina])
+        self._listes = {} # id(debut) -> (debut, tuples des voisins) d'une adjacence CSR
+
+    def _csr(self, voisins):
+        """Construit le couple (debut, cible) CSR selon la fonction ``voisins`` d'un noeud."""
+        debut = array('l', [0])
+        cible = array('l')
+        ids = self.ids
+        for n in self.noeuds:
+            cible.extend(ids[v] for v in voisins(n) if v in ids)
+            debut.append(len(cible))
+        return debut, cible
+
+    def __len__(self):
+        return len(self.noeuds)
+
+    def id(self, noeud):
+        """Id entier du noeud."""
+        return self.ids[noeud]
+
+    def noeud(self, i):
+        """``Noeud`` de l'id entier i."""
+        return self.noeuds[i]
+
+    def bfs(self, source, adjacence=None, kmax=-1):
+        """Parcours en largeur par frontières à partir de ``source`` (un ``Noeud`` ou une liste
+        de ``Noeud``). Les voisins viennent de :meth:`listes`, ce qui évite de découper le CSR
+        à chaque noeud visité.
+
+        :param adjacence: couple CSR (debut, cible), par défaut l'adjacence non orientée
+        :param int kmax: nombre maximal de sauts (-1 pour aucune limite)
+        :return: ``array`` du nombre de sauts depuis la source pour chaque id (-1 si non atteint)
+        """
+        voisins = self.listes(adjacence if adjacence is not None else self.adjacence_complete)
+        sources = source if isinstance(source, (list, tuple)) else [source]
+        dist = [-1] * len(self.noeuds)
+        frontiere = [self.ids[n] for n in sources]
+        for i in frontiere: dist[i] = 0
+        k = 0
+        while frontiere and k != kmax:
+            k += 1
+            prochaine = []
+            ajouter = prochaine.append
+            for i in frontiere:
+                for j in voisins[i]:
+                    if dist[j] < 0:
+                        dist[j] = k
+                        ajouter(j)
+            frontiere = prochaine
+        return array('l', dist)
+
+    def listes(self, adjacence):
+        """Tuples des voisins (ids) de chaque id pour l'adjacence CSR (debut, cible), calculés
+        au premier usage de cette adjacence et gardés jusqu'au prochain ``construire``."""
+        debut, cible = adjacence
+        try:
+            gardee, voisins = self._listes[id(debut)]
+            if gardee is debut:
+                return voisins
+        except KeyError:
+            pass
+        voisins = [tuple(cible[debut[i]:debut[i+1]]) for i in range(len(debut)-1)]
+        self._listes[id(debut)] = (debut, voisins)
+        return voisins
+
+    def atteignable(self, a, b, adjacence=None):
+        """Vrai si le noeud b est atteignable à partir du noeud a."""
+        return self.bfs(a, adjacence)[self.ids[b]] >= 0
+
+    def k_sauts(self, noeud, k, adjacence=None):
+        """Liste des ``Noeud`` à au plus k sauts de ``noeud`` (incluant celui-ci)."""
+        dist = self.bfs(noeud, adjacence, k)
+        return [self.noeuds[i] for i, d in enumerate(dist) if d >= 0]
+
+    def suivants(self, noeud, n, sens_aval=True):
+        """Les n prochains ``Noeud`` en suivant la première arête aval (ou amont), comme
+        ``Noeud.next``. La liste est plus courte si on atteint une extrémité."""
+        debut, cible = self.aval if sens_aval else self.amont
+        i = self.ids[noeud]
+        chemin = []
+        for _ in range(n):
+            if debut[i] == debut[i+1]:
+                break
+            i = cible[debut[i]]
+            chemin.append(self.noeuds[i])
+        return chemin
+
+    def matrice_sauts(self, noeuds=None, adjacence=None):
+        """Matrice des distances en nombre de sauts, à plat dans un ``array`` ligne par ligne:
+        une ligne par noeud source, indexée par id, donc la distance de la k-ième source à l'id
+        j est ``m[k*len(self)+j]``. Par défaut, tous les noeuds sont des sources."""
+        noeuds = self.noeuds if noeuds is None else noeuds
+        n = len(self.noeuds)
+        m = array('l', [0]) * (len(noeuds)*n)
+        for k, noeud in enumerate(noeuds):
+            m[k*n:(k+1)*n] = self.bfs(noeud, adjacence)
+        return m
+
+    def matrice_euclidienne(self, noeuds=None):
+        """Matrice des distances euclidiennes (selon ``Box.pos``) entre les noeuds donnés
+        (tous par défaut), à plat dans un ``array('d')`` ligne par ligne: la distance du k-ième
+        au l-ième noeud est ``m[k*len(noeuds)+l]``. Une ligne est calculée d'un coup avec
+        ``map`` sur les coordonnées des noeuds."""
+        ids = range(len(self.noeuds)) if noeuds is None else [self.ids[n] for n in noeuds]
+        xs = [self.x[i] for i in ids]
+        ys = [self.y[i] for i in ids]
+        n = len(xs)
+        m = array('d', [0.0]) * (n*n)
+        hypot = math.hypot
+        for k, (xi, yi) in enumerate(zip(xs, ys)):
+            m[k*n:(k+1)*n] = array('d', map(hypot, [xi-x for x in xs], [yi-y for y in ys]))
+        return m
+
+
+class SousGraphes(GraphIndex):
+    """Partition précalculée des ``Noeud`` selon leur coloris et adjacences filtrées par masque.
+    Plutôt que d'évaluer ``inSG``, ``inSSG``, ``inSSSG`` ou ``coloris & masque`` pour chaque
+    voisin à chaque recherche, on construit une fois (après la construction du graphe) les
+    ensembles de noeuds de chaque niveau de sous-graphe et, au premier usage d'un masque,
+    l'adjacence des voisins admissibles pour ce masque en format CSR (compressed sparse row).
+    C'est un :class:`GraphIndex`; si le graphe ou les coloris changent, il faut rappeler
+    ``construire``.
+
+    Exemple d'utilisation avec la recherche de chemin:
+
+    .. code-block:: python
+
+        sg = simulation.graphe.SousGraphes(entity_manager)
+        simulation.pathfinder.aStar.sous_graphes = sg
+        cuves = sg.noeuds_sg(0xFF000000)
+    """
+    def construire(self):
+        """(Re)construit l'index, les partitions par coloris et vide la cache des adjacences
+        par masque."""
+        super().construire()
+        self.sg = {} # coloris>>8 -> liste de noeuds
+        self.ssg = {} # coloris>>4 -> liste de noeuds
+        self.sssg = {} # coloris -> liste de noeuds
+        for n in self.noeuds:
+            self.sg.setdefault(n.coloris >> 8, []).append(n)
+            self.ssg.setdefault(n.coloris >> 4, []).append(n)
+            self.sssg.setdefault(n.coloris, []).append(n)
+        self._adjacences = {} # masque -> (debut, cible) en CSR
+        self._voisins = {} # masque -> dict noeud -> tuple des voisins admissibles
+
+    def noeuds_sg(self, col):
+        """Liste des noeuds du sous-graphe du coloris col (voir ``Noeud.inSG``)."""
+        return self.sg.get(col >> 8, [])
+
+    def noeuds_ssg(self, col):
+        """Liste des noeuds du sous-sous-graphe du coloris col (voir ``Noeud.inSSG``)."""
+        return self.ssg.get(col >> 4, [])
+
+    def noeuds_sssg(self, col):
+        """Liste des noeuds du sous-sous-sous-graphe du coloris col (voir ``Noeud.inSSSG``)."""
+        return self.sssg.get(col, [])
+
+    def noeuds_masque(self, masque):
+        """Liste des noeuds dont le coloris a des bits en commun avec le masque."""
+        return [n for col, ns in self.sssg.items() if col & masque > 0 for n in ns]
+
+    def adjacence(self, masque=0xFFFFFFFF):
+        """Adjacence CSR des voisins admissibles pour le masque: les voisins (ids) du noeud
+        d'id i sont ``cible[debut[i]:debut[i+1]]``. Les voisins sont ceux de
+        ``Noeud.calculerVoisins`` dont le coloris passe le masque.
+
+        :return: couple (debut, cible) de ``array`` d'entiers
+        """
+        try:
+            return self._adjacences[masque]
+        except KeyError:
+            pass
+        tout_debut, tout_cible = self.adjacence_complete
+        noeuds = self.noeuds
+        debut = array('l', [0])
+        cible = array('l')
+        for i in range(len(noeuds)):
+            cible.extend(j for j in tout_cible[tout_debut[i]:tout_debut[i+1]] if noeuds[j].coloris & masque > 0)
+            debut.append(len(cible))
+        self._adjacences[masque] = (debut, cible)
+        return debut, cible
+
+    def voisins(self, masque=0xFFFFFFFF):
+        """Dictionnaire noeud -> tuple des voisins admissibles pour le masque, dérivé de
+        l'adjacence CSR. C'est la forme utilisée par ``aStar``."""
+        try:
+            return self._voisins[masque]
+        except KeyError:
+            pass
+        debut, cible = self.adjacence(masque)
+        noeuds = self.noeuds
+        v = {n: tuple(noeuds[j] for j in cible[debut[i]:debut[i+1]]) for i, n in enumerate(noeuds)}
+        self._voisins[masque] = v
+        return v
+
+
 class RenderNoeud(ecs.System):
     """Systeme pour le rendering des noeuds via coloriage."""
     def __init__(self, canvas):
@@ -212,13 +877,21 @@ class RenderNoeud(ecs.System):
         pass
 
     def update(self, dt):
+        vue = Vue.get_instance()
+        if vue is None:
+            noeuds = self.entity_manager.pairs_for_type(Noeud)
+            detail = True
+        else:
+            noeuds = ((entity, noeud) for entity, noeud, box in vue.pairs_visibles(self.entity_manager, Noeud))
+            detail = vue.detail()
         with self.canvas:
-            for entity, noeud in self.entity_manager.pairs_for_type(Noeud):
+            for entity, noeud in noeuds:
                 Color((noeud.coloris >> 24 & 0xFF)/255.0, (noeud.coloris >> 16 & 0xFF)/255.0, 
                       (noeud.coloris >> 8 & 0xFF)/255.0, (noeud.coloris & 0xFF)/255.0)
                 Rectangle(pos=noeud.box.pos, size=noeud.box.size)
-                Color(0,0,0,1) # toujours un coutour noir
-                Line(rectangle=noeud.box.pos+noeud.box.size)
+                if detail:
+                    Color(0,0,0,1) # toujours un coutour noir
+                    Line(rectangle=noeud.box.pos+noeud.box.size)
 
 
 class Arete(ecs.Component):
@@ -240,7 +913,19 @@ class Arete(ecs.Component):
         self.entity=entity
         self.fr=fr
         self.to=to
-        self.barriere=False
+        self._barriere=False
+
+    @property
+    def barriere(self):
+        return self._barriere
+
+    @barriere.setter
+    def barriere(self, value):
+        """Un changement du flag est publié avec l'événement "barriere" (voir ``base.Publisher``),
+        par exemple pour invalider les caches de recherche de chemin."""
+        if value != self._barriere:
+            self._barriere = value
+            base.Publisher.get_instance().dispatch("barriere", self, value)
 
 
 class Phys(ecs.Component):
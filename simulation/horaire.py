@@ -2,6 +2,9 @@
 Composants reliés à l'horaire d'activité.
 -----------------------------------------
 """
+import math
+from collections import defaultdict, deque
+
 from .. import ecs
 from . import stochastique
 
@@ -25,20 +28,111 @@ class Horaire(ecs.Component):
         # les tags de changement (en secondes) d'etat de self.target.actif sur 24h
         self.tags=[60*(x[0]*1440+x[1]*60+x[2])-self.mom.t0 for x in mtags]
         self.nextTagIdx=0 # on suppose partir de mom.t0 et que self.tags[0]>mom.t0
+        self.compile=False # vrai si un CalendrierHoraire applique les tags
         if not self.tags:
             print("Attention! Horaire: Pas de tags")
 
     def update(self):
-        """ Update la var d'état ``actif`` dans le target selon la minute actuelle et les tags."""
+        """ Update la var d'état ``actif`` dans le target selon la minute actuelle et les tags.
+        Ne fait rien si l'horaire est compilé par un :class:`CalendrierHoraire`."""
+        if self.compile:
+            return
         if self.tags and (self.mom.t%self.periode)==self.tags[self.nextTagIdx]:
-            self.target.actif=not self.target.actif
-            self.nextTagIdx+=1
-            if self.nextTagIdx>=len(self.tags): self.nextTagIdx=0
+            self.basculer()
+
+    def basculer(self):
+        """ Change l'état ``actif`` du target et passe au tag suivant. """
+        self.target.actif=not self.target.actif
+        self.nextTagIdx+=1
+        if self.nextTagIdx>=len(self.tags): self.nextTagIdx=0
+
+
+class CalendrierHoraire(ecs.System):
+    """Système qui applique les horaires de tous les composants :class:`Horaire` du modèle.
+    Au lieu que chaque horaire compare ``mom.t % periode`` à son prochain tag à chaque update,
+    on regroupe les tags de tous les horaires par (période, temps dans la période) et chaque
+    groupe est abonné au calendrier du moment (:meth:`base.Moment.chaque`). C'est donc
+    l'update du moment qui déclenche les événements dus; le coût est en O(événements)
+    plutôt qu'en O(horaires x ticks), et l'update du système ne fait rien.
+
+    Les horaires compilés sont marqués (``Horaire.compile``) et leur update ne fait plus rien.
+    Un événement bascule l'état ``actif`` du target (voir :meth:`Horaire.basculer`), comme
+    l'update d'un horaire. À temps égal, les horaires sont basculés dans l'ordre de l'entity
+    manager. Un événement est appliqué dès que le temps atteint ou dépasse son échéance,
+    donc on peut avancer le moment avec ``dt>1``.
+    """
+
+    def __init__(self, mom):
+        """
+        :param mom: on garde un handle vers le moment
+        :type mom: :class:`sim.base.Moment`
+        """
+        super().__init__()
+        self.mom = mom
+        self.abonnements = [] # abonnements au calendrier du moment, un par groupe d'horaires
+        self.horaires = [] # horaires compiles
+
+    def compiler(self):
+        """ Regroupe les tags des horaires de l'entity manager et abonne chaque groupe au
+        calendrier du moment, à partir du prochain temps après le temps courant (les
+        abonnements précédents sont annulés). À rappeler si on ajoute ou retire des horaires
+        en cours de simulation.
+
+        :raises ValueError: si un tag n'est pas dans [0, période[ (relativement à ``mom.t0``),
+            car l'update d'un horaire ne le déclencherait jamais
+        """
+        for abonnement in self.abonnements:
+            self.mom.annuler(abonnement)
+        for horaire in self.horaires:
+            horaire.compile = False
+        groupes = defaultdict(list) # (periode, temps dans la periode) -> horaires
+        horaires = [horaire for entity, horaire in self.entity_manager.pairs_for_type(Horaire)]
+        for horaire in horaires:
+            for tag in horaire.tags:
+                if not 0 <= tag < horaire.periode:
+                    raise ValueError("Horaire: tag {0} sec (depuis mom.t0) hors de la période [0, {1}[".format(
+                        tag, horaire.periode))
+                groupes[(horaire.periode, tag)].append(horaire)
+        for horaire in horaires:
+            horaire.compile = True
+        self.horaires = horaires
+        self.abonnements = [self.mom.chaque(periode, CalendrierHoraire.basculeur(horaires), temps)
+                            for (periode, temps), horaires in sorted(groupes.items(), key=lambda g: g[0][1])]
+
+    @staticmethod
+    def basculeur(horaires):
+        """ Fonction d'abonnement qui bascule les horaires d'un groupe. """
+        def basculer():
+            for horaire in horaires:
+                horaire.basculer()
+        return basculer
+
+    def init(self):
+        self.compiler()
+
+    def reset(self):
+        self.compiler()
+
+    def update(self, dt):
+        pass # les evenements sont declenches par l'update du moment
 
 
 class HoraireSto(ecs.Component):
-    """Horaire de base se répétant a intervalle fixe."""
-    def __init__(self, mom, cible, mtags, periode, mtbf, mttr, mttrMin=-1, mttrAlpha=-1):
+    """Horaire de base se répétant a intervalle fixe, avec des bris aléatoires.
+
+    Plutôt que de faire un essai de Bernoulli à chaque minute, on échantillonne d'avance la 
+    ligne du temps des bris (voir :meth:`echantillonner`): les minutes de début sont tirées 
+    par leurs temps d'attente (loi géométrique, l'équivalent discret de l'exponentielle) et 
+    chaque bris reçoit sa durée de réparation. Le début du prochain bris est abonné au 
+    calendrier du moment (:meth:`base.Moment.planifier`), l'update n'a donc pas à surveiller 
+    la ligne du temps. Les bris pas encore commencés sont dans ``bris``: ceux des ``HORIZON`` 
+    secondes suivant la construction y sont déjà, on peut donc les consulter avant la simulation. 
+    Quand on retire l'horaire du modèle (ou entre deux réplications), il faut appeler 
+    :meth:`detacher` pour annuler l'abonnement.
+    """
+    HORIZON = 86400 # horizon (sec) echantillonne de plus quand la ligne du temps est epuisee
+
+    def __init__(self, mom, cible, mtags, periode, mtbf, mttr, mttrMin=-1, mttrAlpha=-1, flux=None):
         """Configure l'horaire. La var d'état clef est ``actif`` et est dans un composant target. 
         C'est le target qui est responsable de l'initialisation. Cette version de horaire peut 
         être mise-à-jour à la seconde ou à la minute, ça ne change rien car les tags sont en minutes. 
@@ -50,6 +144,10 @@ class HoraireSto(ecs.Component):
         Ainsi, avec mttrAlpha=0 la loi s'étire au maximum vers les grandes valeurs et avec mttrAlpha=1 
         la loi est centrée symétrique sur la moyenne.
 
+        Avec un nom de ``flux``, les bris et les durées de réparation sont tirés de deux flux 
+        nommés indépendants (voir :class:`stochastique.Flux`), sinon de flux nommés par défaut 
+        (voir :meth:`stochastique.Flux.pour`).
+
         :param mom: on garde un handle vers le moment
         :type mom: :class:`sim.base.Moment`
         :param cible: un composant target avec la var d'état ``actif``
@@ -59,6 +157,7 @@ class HoraireSto(ecs.Component):
         :param mttr: mean time to repair en minutes wallclock
         :param mttrMin: mttr min pour loi triangulaire
         :param mttrAlpha: facteur dans [0,1] pour le décentrement de la loi triangulaire (1=centré)
+        :param flux: nom (string) de base des flux de nombres aléatoires, None pour le flux global
         """
         self.mom=mom # instance de Moment
         self.target=cible # la target avec un horaire (doit avoir une var d'etat actif)
@@ -67,21 +166,63 @@ class HoraireSto(ecs.Component):
         self.tags=[60*(x[0]*1440+x[1]*60+x[2])-self.mom.t0 for x in mtags]
         self.nextTagIdx=0 # on suppose partir de mom.t0 et que self.tags[0]>mom.t0
         # partie stochastique
-        self.triggerFreq=stochastique.TriggerFrequence(1.0/mtbf)
+        fluxBris=flux+":bris" if flux is not None else None
+        fluxRepar=flux+":reparation" if flux is not None else None
+        self.triggerFreq=stochastique.TriggerFrequence(1.0/mtbf, fluxBris)
         self.mttr=stochastique.ConstantValue(mttr)
         if 0<mttrMin and mttrMin<mttr and 0<=mttrAlpha and mttrAlpha<=1:
             mttrMode=(int)(mttrMin+mttrAlpha*(mttr-mttrMin))
             mttrMax=3*mttr-mttrMin-mttrMode
             if mttr<mttrMax:
                 print("HoraireSto avec loi triangulaire (min,mode,moy,max)=",mttrMin,mttrMode,mttr,mttrMax)
-                self.mttr=stochastique.TriangularDistributionSample(mttrMin,mttrMax,mttrMode)
+                self.mttr=stochastique.TriangularDistributionSample(mttrMin,mttrMax,mttrMode,fluxRepar)
         self.actif_horaire=self.target.actif # set l'etat horaire selon le target
-        self.duree_arret=0 # en minute
+        self.duree_arret=0 # en minute, duree restante du bris en cours
         self.new_trigger=False
+        # ligne du temps des bris pas encore commences: (debut en sec, duree en min)
+        self.bris=deque()
+        self.minute=self.mom.t//60 # minute du dernier bris echantillonne
+        self.fin_bris=0 # fin (sec) du bris en cours
+        self.t_trigger=None # temps du debut du dernier bris
+        self.abonnement=None # abonnement au moment du debut du prochain bris
+        self.echantillonner(self.mom.t+HoraireSto.HORIZON)
+        if self.bris:
+            self.abonnement=self.mom.planifier(self.bris[0][0], self.commencer_bris)
+
+    def echantillonner(self, horizon):
+        """ Échantillonne la ligne du temps des bris jusqu'au temps ``horizon`` (en secondes, 
+        comme ``mom.t``), à la suite de ce qui l'est déjà. Les bris commencent à une minute 
+        pleine; un bris qui commence pendant un autre le remplace, avec sa propre durée. """
+        while self.minute*60<=horizon:
+            k=self.triggerFreq.attente()
+            if k is None: # jamais de bris
+                self.minute=math.inf
+                break
+            self.minute+=k
+            self.bris.append((self.minute*60, self.mttr.get()))
+
+    def commencer_bris(self):
+        """ Abonnement au moment: commence les bris dus, puis abonne le début du prochain
+        (en échantillonnant la suite de la ligne du temps au besoin). """
+        t=self.mom.t
+        while self.bris and self.bris[0][0]<=t:
+            debut,duree=self.bris.popleft()
+            self.fin_bris=debut+60*math.ceil(duree)
+            self.t_trigger=t
+        if not self.bris:
+            self.echantillonner(t+HoraireSto.HORIZON)
+        self.abonnement=self.mom.planifier(self.bris[0][0], self.commencer_bris) if self.bris else None
+
+    def detacher(self):
+        """ Annule l'abonnement au moment du début du prochain bris (l'horaire est retiré). """
+        if self.abonnement is not None:
+            self.mom.annuler(self.abonnement)
+            self.abonnement=None
 
     def update(self):
         """ Update la var d'état ``actif`` dans le target selon la minute actuelle et les tags."""
-        self.new_trigger=False
+        t=self.mom.t
+        self.new_trigger=self.t_trigger==t
         if self.nextTagIdx>=len(self.tags):
             pass # pas de tag, donc pas de changement d'etat
             #print("Erreur HoraireJour: Pas de tags")
@@ -89,19 +230,30 @@ class HoraireSto(ecs.Component):
             self.actif_horaire=not self.actif_horaire # etat de l'horaire
             self.nextTagIdx+=1
             if self.nextTagIdx>=len(self.tags): self.nextTagIdx=0
-        if self.mom.tickM: # tick a la minute
-            self.duree_arret-=1 
-            if self.triggerFreq.get(): 
-                self.new_trigger=True
-                #print("  *** trigger!",self.mom.getJHMS())
-                self.duree_arret=self.mttr.get()
-            #if self.duree_arret==1: print("  === fin trigger!",self.mom.getJHMS())
-        if self.duree_arret>0: self.target.actif=False
-        else: self.target.actif=self.actif_horaire
+        if t<self.fin_bris:
+            self.duree_arret=(self.fin_bris-t+59)//60
+            self.target.actif=False
+        else:
+            self.duree_arret=0
+            self.target.actif=self.actif_horaire
         
 
 class HoraireStoTAP(ecs.Component):
-    """Horaire stochastique special pour une TAP, avec répétition."""
+    """Horaire stochastique special pour une TAP, avec répétition.
+
+    Les tirages sont faits d'avance (voir :meth:`echantillonner`): les temps d'attente des 
+    triggers d'arrêts non-planifiés (loi géométrique en nombre d'updates, plutôt qu'un essai 
+    à chaque update, convertis en secondes avec ``mom.dt``), les durées des arrêts 
+    non-planifiés et celles des arrêts planifiés. 
+    Comme la pause d'entrepôt plein dépend de l'état du modèle, les temps absolus des arrêts 
+    ne sont connus qu'en simulation; l'update suit les tirages dans l'ordre et les retire une 
+    fois utilisés. Le prochain trigger est abonné au calendrier du moment. Si ``freq`` n'a pas 
+    de méthode ``attente``, on revient à un essai ``freq.get()`` à chaque update, avec la 
+    durée de l'arrêt tirée au trigger. Quand on retire l'horaire du modèle (ou entre deux 
+    réplications), il faut appeler :meth:`detacher` pour annuler l'abonnement.
+    """
+    HORIZON = 86400 # horizon (sec) echantillonne de plus quand les tirages sont epuises
+
     def __init__(self, mom, cible, mtags, periode, arretplan, freq=None, arretnonplan=None):
         """Configure l'horaire. La var d'état clef est ``actif`` et est dans un composant target. 
         On force l'initialisation a True. Les tags imposent les debuts des arrets planifies.
@@ -112,8 +264,12 @@ class HoraireStoTAP(ecs.Component):
         :param mtags: la liste de triplet (j,h,m) de changement d'état, j=0 est le jour actuel
         :param periode: un triplet (j,h,m) pour la periode de cycle chaque j jours, h heures et m min
         :param arretplan: est un objet avec la methode ``get`` pour obtenir la duree des arrets dans mtags (en secondes)
-        :param freq: est un objet qui trigger un arrets non-planifies
+        :param freq: est un objet qui trigger un arrets non-planifies, idéalement avec la methode 
+            ``attente`` (voir :class:`stochastique.TriggerFrequence`)
         :param arretnonplan: est un objet avec la methode ``get`` pour obtenir la duree des arrets non-planifies genere via freq (en secondes)
+
+        Pour les nombres aléatoires communs, on crée ``arretplan``, ``freq`` et ``arretnonplan`` 
+        chacun avec son propre nom de flux (voir :class:`stochastique.Flux`).
         """
         self.mom=mom # instance de Moment
         self.target=cible # la target avec un horaire (doit avoir une var d'etat actif)
@@ -127,23 +283,75 @@ class HoraireStoTAP(ecs.Component):
         self.target.actif=True # init a True
         self.duree=-1 # duree de l'arret en cours
         self.trigger=False # trigger d'un arret non-plan
+        self.prochain_trigger=None # temps du prochain trigger, None s'il reste a tirer
+        self.abonnement=None # abonnement au moment du prochain trigger
+        self.par_attente=freq is not None and hasattr(freq, "attente") # sinon, un essai par update
+        # tirages faits d'avance, retires a mesure qu'ils sont utilises
+        self.durees_plan=deque() # durees des arrets planifies (sec)
+        self.attentes=deque() # attentes (sec) des triggers d'arrets non-planifies
+        self.durees_nonplan=deque() # durees des arrets non-planifies (sec)
+        self.nb_plan=0 # nb de durees d'arrets planifies tirees depuis le depart
+        self.fin_attentes=self.mom.t # t_depart plus la somme des attentes tirees
+        self.horizon=-1 # horizon (sec) couvert par les tirages
+        self.t_depart=self.mom.t
+
+    def echantillonner(self, horizon):
+        """ Fait d'avance les tirages nécessaires jusqu'au temps ``horizon`` (en secondes, 
+        comme ``mom.t``), à la suite de ceux déjà faits: une durée par arrêt planifié d'ici 
+        ``horizon``, et des attentes de triggers (avec leurs durées d'arrêt) dont la somme 
+        dépasse ``horizon``, ce qui borne le nombre de triggers possibles. """
+        nplan=len(self.tags)*((horizon-self.t_depart)//self.periode+1)
+        while self.nb_plan<nplan:
+            self.durees_plan.append(self.arretplan.get())
+            self.nb_plan+=1
+        if self.par_attente:
+            while self.fin_attentes<=horizon:
+                k=self.freq.attente()
+                k=math.inf if k is None else k*self.mom.dt # en secondes, un essai par update
+                self.attentes.append(k)
+                self.durees_nonplan.append(self.arretnonplan.get())
+                self.fin_attentes+=k
+        self.horizon=horizon
+
+    def declencher(self):
+        """ Abonnement au moment: trigger d'un arrêt non-planifié. """
+        self.trigger=True
+        self.abonnement=None
+
+    def detacher(self):
+        """ Annule l'abonnement au moment du prochain trigger (l'horaire est retiré). """
+        if self.abonnement is not None:
+            self.mom.annuler(self.abonnement)
+            self.abonnement=None
 
     def update(self):
         """ Update la var d'état ``actif`` dans le target selon la minute actuelle et les tags."""
+        t=self.mom.t
+        if t>self.horizon:
+            self.echantillonner(t+HoraireStoTAP.HORIZON)
         if self.freq is not None and not self.trigger: 
-            self.trigger=self.freq.get() # test de trigger d'un arret nonplan, si on en a pas deja un
-        self.duree-=1 # decroit la duree d'un arret
+            if not self.par_attente:
+                self.trigger=self.freq.get() # test de trigger d'un arret nonplan
+            elif self.prochain_trigger is None: # l'update courant est le premier essai
+                self.prochain_trigger=t-self.mom.dt+self.attentes.popleft()
+                if self.prochain_trigger<=t:
+                    self.trigger=True
+                elif self.prochain_trigger<math.inf:
+                    self.abonnement=self.mom.planifier(self.prochain_trigger, self.declencher)
+        self.duree-=self.mom.dt # decroit la duree d'un arret (sec)
         if self.nextTagIdx>=len(self.tags):
             print("Erreur HoraireStoTAP: Pas de tags")
-        elif (self.mom.t%self.periode)==self.tags[self.nextTagIdx]: # debut d'un arret planifie
-            self.duree=self.arretplan.get() # duree stochastique de l'arret planifie
+        elif (t%self.periode)==self.tags[self.nextTagIdx]: # debut d'un arret planifie
+            self.duree=self.durees_plan.popleft() # duree stochastique de l'arret planifie
             #print("Arret planifie (sec):",self.duree)
             self.nextTagIdx+=1
             if self.nextTagIdx>=len(self.tags): self.nextTagIdx=0
         if self.duree<=0 and self.trigger: # si pas en arret, mais qu'on a un trigger d'arret nonplan
-            self.duree=self.arretnonplan.get() # duree de l'arret nonplan
+            # duree de l'arret nonplan
+            self.duree=self.durees_nonplan.popleft() if self.par_attente else self.arretnonplan.get()
             #print("  Arret non-planifie (sec):",self.duree)
             self.trigger=False # reset du trigger
+            self.prochain_trigger=None
         # cas special pour entrepot plein (on suppose qu'on a un handle sur l'entrepot)
         # le handle doit etre mis dans modele
         if self.duree<=0 and not self.entrepot.place4crue():
@@ -0,0 +1,223 @@
+"""
+Collecte déclarative d'indicateurs de performance (KPI).
+--------------------------------------------------------
+
+Plutôt que de calculer à la main l'occupation des accumulateurs, l'utilisation des
+machines ou le temps occupé des ponts dans chaque modèle, on enregistre des sondes
+sur des attributs de composants dans le système :class:`CollecteKPI`. À chaque
+échantillonnage (un abonnement au calendrier du :class:`base.Moment`), la valeur lue est
+pondérée par le temps écoulé. On obtient la moyenne pondérée, un histogramme et des percentiles
+par fenêtre (quart, jour) et par réplication. La mémoire est bornée: chaque fenêtre
+fermée est résumée dans un :class:`base.StatistiqueEnLigne`.
+
+Exemple d'utilisation:
+
+.. code-block:: python
+
+    kpi = simulation.kpi.CollecteKPI(mom, periode=60)
+    kpi.ajouter("occupation A1", accum, "get", bornes=range(0, 100, 10))
+    kpi.ajouter("pont M1 occupe", pont, "is_operation")
+    kpi.ajouter("machine M2 debit", machine, "x", mode=simulation.kpi.Sonde.TAUX)
+    system_manager.add_system(kpi)
+
+"""
+import csv
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+
+from .. import ecs
+from . import base
+
+
+class StatistiquePonderee:
+    """ Moyenne, min, max et histogramme d'observations pondérées (typiquement par le temps).
+    L'histogramme a des bornes fixes, donc la mémoire est constante. """
+
+    def __init__(self, bornes=()):
+        """:param bornes: bornes croissantes des classes de l'histogramme (peut être vide)."""
+        self.bornes = list(bornes)
+        self.poids = [0.0] * (len(self.bornes) + 1) # poids par classe de l'histogramme
+        self.total = 0.0 # somme des poids
+        self.somme = 0.0 # somme des valeurs ponderees
+        self.min = None
+        self.max = None
+
+    def add(self, x, poids=1.0):
+        """ Ajoute la valeur ``x`` avec le poids ``poids``. """
+        self.total += poids
+        self.somme += x * poids
+        self.poids[bisect_right(self.bornes, x)] += poids
+        if self.min is None or x < self.min: self.min = x
+        if self.max is None or x > self.max: self.max = x
+
+    def moyenne(self):
+        """ Moyenne pondérée (0 si aucun poids). """
+        return base.Math.safe_scalar_div(self.somme, self.total)
+
+    def percentile(self, p):
+        """ Estimation du percentile ``p`` (dans [0,1]) par interpolation linéaire dans la
+        classe de l'histogramme qui le contient. Les classes extrêmes sont bornées par le min
+        et le max observés. Retourne None s'il n'y a aucune observation. """
+        if self.total <= 0:
+            return None
+        cible = p * self.total
+        cumul = 0.0
+        for i, w in enumerate(self.poids):
+            if w > 0 and cumul + w >= cible:
+                bas = self.bornes[i-1] if i > 0 else self.min
+                haut = self.bornes[i] if i < len(self.bornes) else self.max
+                bas = max(bas, self.min)
+                haut = min(haut, self.max)
+                return bas + (haut - bas) * (cible - cumul) / w
+            cumul += w
+        return self.max
+
+
+class Sonde:
+    """ Une sonde sur l'attribut d'un composant. L'attribut est lu par son nom; si c'est une
+    méthode, on l'appelle sans argument. En mode ``NIVEAU``, on mesure la valeur elle-même
+    (ex: occupation, booléen occupé). En mode ``TAUX``, l'attribut est un compteur cumulatif
+    (ex: ``Machine.x``) et on mesure son accroissement par seconde entre deux échantillons. """
+
+    NIVEAU, TAUX = range(2)
+
+    def __init__(self, nom, cible, attribut, bornes=(), mode=NIVEAU):
+        """
+        :param str nom: nom du KPI
+        :param cible: composant (ou tout objet) observé
+        :param str attribut: nom de l'attribut ou de la méthode à lire
+        :param bornes: bornes de l'histogramme
+        :param mode: ``Sonde.NIVEAU`` ou ``Sonde.TAUX``
+        """
+        self.nom = nom
+        self.cible = cible
+        self.attribut = attribut
+        self.bornes = bornes
+        self.mode = mode
+        self.precedent = None # derniere valeur lue du compteur (mode TAUX)
+
+    def lire(self):
+        """ Retourne la valeur courante de l'attribut. """
+        v = getattr(self.cible, self.attribut)
+        return v() if callable(v) else v
+
+    def mesurer(self, dt):
+        """ Retourne la mesure à pondérer pour un intervalle de ``dt`` secondes, ou None si
+        on n'a pas encore de mesure (premier échantillon en mode ``TAUX``). """
+        v = self.lire()
+        if self.mode == Sonde.NIVEAU:
+            return float(v)
+        precedent, self.precedent = self.precedent, v
+        return None if precedent is None else (v - precedent) / dt
+
+
+LigneKPI = namedtuple('LigneKPI', 'kpi, fenetre, n, moyenne, ecart_type, min, max, courant, p50, p90')
+
+
+class CollecteKPI(ecs.System):
+    """ Système de collecte des KPI. On échantillonne toutes les sondes à chaque ``periode``
+    secondes de simulation, en pondérant chaque mesure par ``periode``. Pour chaque fenêtre
+    (par défaut le quart et le jour) et pour la réplication, on garde la statistique pondérée
+    de la fenêtre en cours et un résumé en ligne des moyennes des fenêtres fermées.
+    L'échantillonnage et la fermeture des fenêtres sont des abonnements au calendrier du
+    moment (:meth:`base.Moment.chaque`), donc ``update`` ne fait rien; les sondes sont lues
+    dans ``Moment.update``, c'est-à-dire avant les systèmes du tick. Sur ``reset``, toutes
+    les fenêtres en cours se ferment, dont la réplication, et les abonnements repartent du
+    temps courant. """
+
+    def __init__(self, mom, periode=60, fenetres=(("quart", 43200), ("jour", 86400))):
+        """
+        :param mom: on garde un handle vers le moment
+        :type mom: :class:`base.Moment`
+        :param int periode: période d'échantillonnage en secondes
+        :param fenetres: couples (nom, durée en secondes) des fenêtres d'agrégation
+        """
+        super().__init__()
+        self.mom = mom
+        self.periode = periode
+        self.fenetres = OrderedDict(fenetres)
+        self.fenetres["replication"] = None # fermee sur reset seulement
+        self.sondes = OrderedDict()
+        self.courant = {} # (kpi, fenetre) -> StatistiquePonderee de la fenetre en cours
+        self.historique = {} # (kpi, fenetre) -> StatistiqueEnLigne des fenetres fermees
+        self.abonnements = []
+        self.abonner()
+
+    def abonner(self):
+        """ (Ré)abonne l'échantillonnage, puis la fermeture de chaque fenêtre, au calendrier du
+        moment. À temps égal, l'échantillon est donc pris avant de fermer la fenêtre. """
+        for abonnement in self.abonnements:
+            self.mom.annuler(abonnement)
+        self.abonnements = [self.mom.chaque(self.periode, self.echantillonner)]
+        for fenetre, duree in self.fenetres.items():
+            if duree is not None:
+                self.abonnements.append(self.mom.chaque(duree, self.fermeture(fenetre)))
+
+    def fermeture(self, fenetre):
+        """ Fonction sans argument qui ferme ``fenetre``, pour le calendrier. """
+        return lambda: self.fermer(fenetre)
+
+    def ajouter(self, nom, cible, attribut, bornes=(), mode=Sonde.NIVEAU):
+        """ Enregistre une sonde (voir :class:`Sonde`) et retourne celle-ci. """
+        sonde = Sonde(nom, cible, attribut, bornes, mode)
+        self.sondes[nom] = sonde
+        for fenetre in self.fenetres:
+            self.courant[(nom, fenetre)] = StatistiquePonderee(bornes)
+            self.historique[(nom, fenetre)] = base.StatistiqueEnLigne()
+        return sonde
+
+    def retirer(self, nom):
+        """ Retire la sonde ``nom`` et ses statistiques. """
+        del self.sondes[nom]
+        for fenetre in self.fenetres:
+            del self.courant[(nom, fenetre)]
+            del self.historique[(nom, fenetre)]
+
+    def fermer(self, fenetre):
+        """ Ferme la fenêtre en cours de ``fenetre`` pour toutes les sondes. """
+        for nom, sonde in self.sondes.items():
+            cle = (nom, fenetre)
+            if self.courant[cle].total > 0:
+                self.historique[cle].add(self.courant[cle].moyenne())
+            self.courant[cle] = StatistiquePonderee(sonde.bornes)
+
+    def init(self):
+        pass
+
+    def reset(self):
+        for fenetre in self.fenetres:
+            self.fermer(fenetre)
+        for sonde in self.sondes.values():
+            sonde.precedent = None
+        self.abonner()
+
+    def echantillonner(self):
+        """ Mesure toutes les sondes et pondère chaque mesure par ``periode``. """
+        for nom, sonde in self.sondes.items():
+            x = sonde.mesurer(self.periode)
+            if x is not None:
+                for fenetre in self.fenetres:
+                    self.courant[(nom, fenetre)].add(x, self.periode)
+
+    def update(self, dt):
+        pass
+
+    def tableau(self):
+        """ Exporte les KPI: une ligne :class:`LigneKPI` par (kpi, fenêtre). Les colonnes
+        n, moyenne, ecart_type, min et max résument les moyennes des fenêtres fermées; les
+        colonnes courant, p50 et p90 portent sur la fenêtre en cours. """
+        lignes = []
+        for nom in self.sondes:
+            for fenetre in self.fenetres:
+                h = self.historique[(nom, fenetre)]
+                c = self.courant[(nom, fenetre)]
+                lignes.append(LigneKPI(nom, fenetre, h.n, h.moyenne(), h.ecart_type(), h.min, h.max,
+                                       c.moyenne(), c.percentile(0.5), c.percentile(0.9)))
+        return lignes
+
+    def dump(self, nom='kpi.csv'):
+        """ Dump la table des KPI dans le fichier csv ``nom`` avec ; comme séparateur. """
+        with open(nom, 'w', newline='') as fp:
+            z = csv.writer(fp, delimiter=';')
+            z.writerow(LigneKPI._fields)
+            z.writerows(self.tableau())
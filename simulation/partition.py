@@ -0,0 +1,216 @@
+"""
+Décomposition spatiale d'un modèle en processus.
+------------------------------------------------
+
+Un grand modèle couvre souvent plusieurs séries de cuves dont les secteurs n'interagissent
+que via les véhicules partagés et l'entrepôt. On découpe alors le modèle en domaines (par
+``Secteur`` ou par série), chacun simulé dans son propre processus avec son propre
+``EntityManager`` et ``SystemManager``. Les domaines n'échangent que l'état de la frontière:
+des valeurs nommées (ex: niveau d'un accumulateur partagé, demande d'un secteur) placées en
+mémoire partagée et synchronisées à tous les ``intervalle`` pas de temps. Entre deux
+synchronisations, un domaine voit donc l'état de la frontière tel qu'il était à la
+synchronisation précédente.
+
+Chaque valeur de frontière a un seul domaine propriétaire (celui qui l'exporte); les autres
+l'importent. Pour un accumulateur partagé, le domaine de l'entrepôt exporte le niveau et
+importe les demandes, que les autres domaines exportent.
+
+Limite: les entités ne migrent pas d'un domaine à l'autre. Un mobile (pont, véhicule) reste
+dans le domaine qui l'a créé; on découpe donc le modèle de façon à ce que les trajets ne
+traversent pas la frontière, et un échange entre domaines (ex: un véhicule partagé) est
+représenté par des valeurs de frontière (demandes, quantités livrées), pas par le mobile.
+
+Exemple d'utilisation:
+
+.. code-block:: python
+
+    def construire_serie(no):  # fonction de module (picklable), appelee dans le processus
+        em = ecs.EntityManager()
+        sm = ecs.SystemManager(em)
+        ...  # builder du modele de la serie
+        return simulation.partition.Domaine(em, sm,
+            exporte={"demande%d" % no: lambda: demande.get()},
+            importe={"entrepot": lambda v: setattr(entrepot, "niveau", v)},
+            resultat=lambda: stat.tableau())
+
+    partitions = [simulation.partition.Partition("serie%d" % i, construire_serie, (i,),
+                                                  exporte=("demande%d" % i,), importe=("entrepot",))
+                  for i in range(3)]
+    partitions.append(simulation.partition.Partition("entrepot", construire_entrepot, (),
+                      exporte=("entrepot",), importe=("demande0", "demande1", "demande2")))
+    resultats = simulation.partition.DecompositionDomaine(partitions, intervalle=60).executer(86400)
+
+"""
+import multiprocessing
+import queue
+import time
+
+from . import base
+
+
+class Domaine:
+    """ Modèle d'une partition, construit dans le processus qui le simule. """
+
+    def __init__(self, entity_manager, system_manager, exporte=None, importe=None, resultat=None,
+                 avancer=None):
+        """
+        :param entity_manager: entity manager du domaine
+        :param system_manager: system manager du domaine
+        :param exporte: dictionnaire nom -> fonction sans argument qui lit la valeur (float)
+        :param importe: dictionnaire nom -> fonction qui reçoit la valeur lue d'un autre domaine
+        :param resultat: fonction sans argument dont le retour (picklable) est renvoyé à la fin
+        :param avancer: fonction qui avance le domaine d'un pas de temps (défaut: update du
+            ``base.Moment`` puis du system manager avec dt=1)
+        """
+        self.entity_manager = entity_manager
+        self.system_manager = system_manager
+        self.exporte = exporte or {}
+        self.importe = importe or {}
+        self.resultat = resultat
+        self.avancer = avancer or self.avancer_defaut
+
+    def avancer_defaut(self):
+        base.Moment.get_instance().update()
+        self.system_manager.update(1)
+
+
+class Partition:
+    """ Description d'une partition: comment construire son ``Domaine`` et les valeurs de
+    frontière qu'elle exporte et importe. """
+
+    def __init__(self, nom, construire, args=(), exporte=(), importe=()):
+        """
+        :param str nom: nom de la partition
+        :param construire: fonction picklable (de module) qui retourne un :class:`Domaine`
+        :param args: arguments de ``construire``
+        :param exporte: noms des valeurs de frontière dont la partition est propriétaire
+        :param importe: noms des valeurs de frontière lues des autres partitions
+        """
+        self.nom = nom
+        self.construire = construire
+        self.args = tuple(args)
+        self.exporte = tuple(exporte)
+        self.importe = tuple(importe)
+
+
+def _executer_partition(partition, slots, tableau, barriere, duree, intervalle, sortie):
+    """ Boucle d'un processus: construit le domaine, puis avance par tranches de ``intervalle``
+    pas avec un échange de la frontière entre les tranches. """
+    try:
+        domaine = partition.construire(*partition.args)
+        t = 0
+        while t < duree:
+            # on publie la frontiere, puis on lit celle des autres une fois que tous ont publie
+            for nom in partition.exporte:
+                tableau[slots[nom]] = float(domaine.exporte[nom]())
+            barriere.wait()
+            for nom in partition.importe:
+                domaine.importe[nom](tableau[slots[nom]])
+            barriere.wait() # personne n'ecrit avant que tous aient lu
+            for _ in range(min(intervalle, duree - t)):
+                domaine.avancer()
+            t += intervalle
+        sortie.put((partition.nom, domaine.resultat() if domaine.resultat else None, None))
+    except Exception as e:
+        barriere.abort()
+        sortie.put((partition.nom, None, repr(e)))
+
+
+class DecompositionDomaine:
+    """ Simule les partitions en parallèle, une par processus, avec un échange de la frontière
+    en mémoire partagée à tous les ``intervalle`` pas de temps. Un processus qui meurt sans
+    rapporter (plantage, ``kill``) ou qui dépasse le délai fait échouer l'exécution: la
+    barrière est brisée pour libérer les autres, qui terminent en erreur. """
+
+    def __init__(self, partitions, intervalle=60, contexte=None, attente=1.0):
+        """
+        :param partitions: liste de :class:`Partition`
+        :param int intervalle: nombre de pas de temps entre deux synchronisations
+        :param contexte: contexte ``multiprocessing`` (défaut: celui de la plateforme)
+        :param float attente: secondes entre deux vérifications de l'état des processus
+        """
+        self.partitions = partitions
+        self.intervalle = intervalle
+        self.attente = attente
+        self.contexte = contexte or multiprocessing.get_context()
+        self.slots = {} # nom d'une valeur de frontiere -> indice dans la memoire partagee
+        proprietaires = {}
+        for p in partitions:
+            for nom in p.exporte:
+                if nom in proprietaires:
+                    raise ValueError("frontiere {0} exportee par {1} et {2}".format(nom, proprietaires[nom], p.nom))
+                proprietaires[nom] = p.nom
+                self.slots[nom] = len(self.slots)
+        for p in partitions:
+            for nom in p.importe:
+                if nom not in self.slots:
+                    raise ValueError("frontiere {0} importee par {1} sans proprietaire".format(nom, p.nom))
+
+    def executer(self, duree, delai=None):
+        """ Simule ``duree`` pas de temps dans chaque partition.
+
+        :param delai: secondes allouées à l'exécution, None pour aucune limite
+        :return: dictionnaire nom de partition -> résultat du domaine
+        :raises RuntimeError: si une partition a échoué, est morte ou a dépassé le délai
+        """
+        tableau = self.contexte.Array('d', max(len(self.slots), 1), lock=False)
+        barriere = self.contexte.Barrier(len(self.partitions))
+        sortie = self.contexte.Queue()
+        processus = {p.nom: self.contexte.Process(target=_executer_partition,
+                                                  args=(p, self.slots, tableau, barriere, duree, self.intervalle, sortie))
+                     for p in self.partitions}
+        for proc in processus.values():
+            proc.start()
+        fin = None if delai is None else time.monotonic() + delai
+        resultats, erreurs = {}, {}
+        try:
+            while len(resultats) + len(erreurs) < len(processus):
+                try:
+                    nom, resultat, erreur = sortie.get(timeout=self.attente)
+                except queue.Empty:
+                    self.verifier(processus, resultats, erreurs, barriere, sortie, fin)
+                    continue
+                if erreur is not None:
+                    erreurs[nom] = erreur
+                    barriere.abort()
+                else:
+                    resultats[nom] = resultat
+        finally:
+            for proc in processus.values():
+                proc.join(self.attente)
+                if proc.is_alive():
+                    proc.terminate()
+                    proc.join()
+        for nom, proc in processus.items():
+            if proc.exitcode != 0 and nom not in erreurs:
+                erreurs[nom] = "code de sortie {0}".format(proc.exitcode)
+        if erreurs:
+            raise RuntimeError("partitions en erreur: {0}".format(erreurs))
+        return resultats
+
+    def verifier(self, processus, resultats, erreurs, barriere, sortie, fin):
+        """ Appelé quand aucun rapport n'est arrivé pendant ``attente``: relève les processus
+        morts sans rapport et le dépassement du délai, et brise alors la barrière. """
+        en_cours = [nom for nom in processus if nom not in resultats and nom not in erreurs]
+        morts = [nom for nom in en_cours if processus[nom].exitcode is not None]
+        if morts and len(morts) == len(en_cours):
+            # les derniers rapports peuvent encore etre dans le tuyau
+            try:
+                while True:
+                    nom, resultat, erreur = sortie.get(timeout=self.attente)
+                    if erreur is not None:
+                        erreurs[nom] = erreur
+                    else:
+                        resultats[nom] = resultat
+            except queue.Empty:
+                pass
+        for nom in morts:
+            if nom not in resultats and nom not in erreurs and (
+                    processus[nom].exitcode != 0 or len(morts) == len(en_cours)):
+                erreurs[nom] = "mort sans rapport (code de sortie {0})".format(processus[nom].exitcode)
+                barriere.abort()
+        if fin is not None and time.monotonic() > fin:
+            for nom in en_cours:
+                if nom not in resultats and nom not in erreurs:
+                    erreurs[nom] = "délai dépassé"
+            barriere.abort()
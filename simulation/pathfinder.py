@@ -3,57 +3,150 @@ Algorithme de recherche d'un chemin dans un graphe.
 ---------------------------------------------------
 """
 import heapq
+import math
+import random
+from collections import defaultdict
+
+from .. import ecs
+from . import base
+from . import graphe
+
+class Metrique:
+    """ Métriques de coût d'arête. Chacune vient avec une heuristique admissible et consistante
+    (jamais plus grande que le coût réel restant), ce qui garantit un chemin optimal à A*:
+
+        * ``EUCLIDIENNE``: distance euclidienne entre les ``Box.pos``
+        * ``MANHATTAN``: distance |dx|+|dy|, pour les ponts qui se déplacent sur des rails
+          orthogonaux (le pont roulant et son chariot)
+        * ``PHYSIQUE``: distance en mètres; le pas en pixels est converti avec l'échelle
+          ``Phys.dim / Box.size`` moyenne des deux noeuds de l'arête. L'heuristique utilise
+          la plus petite échelle du graphe.
+    """
+    EUCLIDIENNE, MANHATTAN, PHYSIQUE = range(3)
+
+
+class TableDistances:
+    """ Table précalculée des positions et des coûts d'arête pour une :class:`Metrique`.
+    On l'installe dans ``aStar.distances`` après la construction du graphe:
+
+    .. code-block:: python
+
+        noeuds = [n for e, n in em.pairs_for_type(simulation.graphe.Noeud)]
+        phys = {p.noeud: p for e, p in em.pairs_for_type(simulation.graphe.Phys)}
+        simulation.pathfinder.aStar.distances = simulation.pathfinder.TableDistances(
+            noeuds, simulation.pathfinder.Metrique.PHYSIQUE, phys)
+    """
+
+    def __init__(self, noeuds, metrique=Metrique.EUCLIDIENNE, phys=None):
+        """
+        :param noeuds: les ``Noeud`` du graphe (avec leurs voisins calculés)
+        :param metrique: une constante de :class:`Metrique`
+        :param phys: dictionnaire noeud -> ``Phys`` (requis pour ``Metrique.PHYSIQUE``)
+        """
+        self.metrique = metrique
+        self.pos = {n: (float(n.box.pos[0]), float(n.box.pos[1])) for n in noeuds}
+        self.echelle = {} # noeud -> (sx, sy) metres par pixel
+        if metrique == Metrique.PHYSIQUE:
+            for n in noeuds:
+                p = phys.get(n)
+                if p is None or not n.box.size[0] or not n.box.size[1]:
+                    self.echelle[n] = (1.0, 1.0)
+                else:
+                    self.echelle[n] = (p.dim[0]/n.box.size[0], p.dim[1]/n.box.size[1])
+            self.kmin = min(min(sx, sy) for sx, sy in self.echelle.values()) if noeuds else 1.0
+        self.couts = {n: {v: self._cout(n, v) for v in n.voisins} for n in noeuds}
+
+    def _cout(self, a, b):
+        (xa, ya), (xb, yb) = self.pos[a], self.pos[b]
+        dx, dy = abs(xa - xb), abs(ya - yb)
+        if self.metrique == Metrique.MANHATTAN:
+            return dx + dy
+        if self.metrique == Metrique.PHYSIQUE:
+            (sxa, sya), (sxb, syb) = self.echelle[a], self.echelle[b]
+            dx *= (sxa + sxb) / 2
+            dy *= (sya + syb) / 2
+        return math.sqrt(dx*dx + dy*dy)
+
+    def cout(self, a, b):
+        """ Coût de l'arête a-b. """
+        try:
+            return self.couts[a][b]
+        except KeyError:
+            return self._cout(a, b)
+
+    def heuristique(self, n, goal):
+        """ Borne inférieure du coût de n à goal. """
+        (xa, ya), (xb, yb) = self.pos[n], self.pos[goal]
+        dx, dy = abs(xa - xb), abs(ya - yb)
+        if self.metrique == Metrique.MANHATTAN:
+            return dx + dy
+        h = math.sqrt(dx*dx + dy*dy)
+        return h * self.kmin if self.metrique == Metrique.PHYSIQUE else h
+
 
 class aStar:
+    sous_graphes = None # graphe.SousGraphes optionnel avec les voisins precalcules par masque
+    distances = None # TableDistances optionnelle, sinon distance euclidienne
+
     @staticmethod
-    def trouverChemin(start, goal, masque = 0xFFFFFFFF):
+    def trouverChemin(start, goal, masque = 0xFFFFFFFF, stats=None):
         if start in goal.voisins:
             return [goal]
         else:
-            return aStar.construireChemin(start, goal, masque)
+            return aStar.construireChemin(start, goal, masque, stats)
 
     @staticmethod
-    def construireChemin(start, goal, masque = 0xFFFFFFFF):
+    def construireChemin(start, goal, masque = 0xFFFFFFFF, stats=None):
         """ Algorithme pour trouver le chemin le plus cours entre 2 noeuds du graphe.
+        Le coût des arêtes et l'heuristique viennent de ``aStar.distances`` si elle est
+        définie, sinon on utilise la distance euclidienne. Le nombre de noeuds développés
+        par la recherche est ajouté à ``stats["expansions"]`` si un dictionnaire ``stats``
+        est donné (voir :class:`Banc`); le compteur est propre à l'appel.
         Références:
 
             * http://en.wikipedia.org/wiki/A*_search_algorithm
             * http://www.redblobgames.com/pathfinding/a-star/introduction.html
             * http://www.redblobgames.com/pathfinding/a-star/implementation.html
         """
-        openSet=set()
         closeSet=set()
         openHeap=[]
 
         came_from={}
         g_score={}
-        f_score={}
 
         came_from[start]=None
-        f_score[start]=0
         g_score[start]=0
 
-        openSet.add(start)
-        t=(0, start)
-        heapq.heappush(openHeap, t)
-        while openSet:
-            current=heapq.heappop(openHeap)[1]
+        adjacence=aStar.sous_graphes.voisins(masque) if aStar.sous_graphes is not None else None
+        table=aStar.distances
+        dist=table.cout if table is not None else aStar.dist
+        heuristic=table.heuristique if table is not None else aStar.heuristic
+
+        heapq.heappush(openHeap, (0, 0, start))
+        chemin=[]
+        while openHeap:
+            current=heapq.heappop(openHeap)[2]
+            if current in closeSet: # entree perimee du heap
+                continue
             if current==goal:
-                return aStar.construireCheminHelper(start, goal, came_from)
-            openSet.remove(current)
+                chemin=aStar.construireCheminHelper(start, goal, came_from)
+                break
             closeSet.add(current)
-            voisins=current.voisins
+            if adjacence is not None: # voisins deja filtres selon le masque
+                voisins=adjacence.get(current, ())
+            else:
+                voisins=[n for n in current.voisins if n.coloris & masque > 0]
             for n in voisins:
-                if n.coloris & masque > 0:
-                    if n not in closeSet:
-                        g_score[n]=g_score[current]+aStar.dist(current, n)
-                        f_score[n]=g_score[n]+aStar.heuristic(goal, n)
-                        if n not in openSet:
-                            openSet.add(n)
-                            t=(f_score[n], n)
-                            heapq.heappush(openHeap, t)
+                if n not in closeSet:
+                    g=g_score[current]+dist(current, n)
+                    if n not in g_score or g < g_score[n]:
+                        g_score[n]=g
                         came_from[n]=current
-        return []
+                        h=heuristic(n, goal)
+                        heapq.heappush(openHeap, (g+h, h, n)) # a f egal, le plus proche du but
+        if stats is not None:
+            stats["expansions"]=stats.get("expansions", 0)+len(closeSet)
+        return chemin
 
     @staticmethod
     def construireCheminHelper(start, goal, came_from):
@@ -68,10 +161,10 @@ class aStar:
 
     @staticmethod
     def dist(node, goal):
-        #distance eucledienne au carre
+        #distance euclidienne (le carre n'est pas additif le long d'un chemin)
         dx=node.box.pos[0]-goal.box.pos[0]
         dy=node.box.pos[1]-goal.box.pos[1]
-        return dx*dx+dy*dy
+        return math.sqrt(dx*dx+dy*dy)
 
     @staticmethod
     def heuristic(node, goal):
@@ -83,3 +176,687 @@ class aStar:
         #return 2*dist(node, goal)
         #elif goal.nature == Noeud.PASS:
         #return dist(node, goal)
+
+
+class Bidirectionnel:
+    """ Recherche bidirectionnelle (A* ou Dijkstra) pour les longs trajets, par exemple entre
+    l'entrepôt et un secteur éloigné. Une recherche part du départ, l'autre du but, et on
+    s'arrête lorsqu'elles se rencontrent et que la somme des clés des deux frontières dépasse
+    le meilleur chemin trouvé. En mode A*, on utilise les potentiels moyens
+    p(v) = (h(v, but) - h(départ, v)) / 2 (Ikeda et al. 1994), qui gardent la recherche
+    consistante dans les deux sens. Le graphe est vu comme non orienté (``Noeud.voisins``).
+
+    Le ``rayon`` borne le coût du chemin: dès que la borne inférieure du coût dépasse le
+    rayon, on abandonne et on retourne un chemin vide. Le coût et l'heuristique sont ceux
+    d'``aStar`` (``aStar.distances`` si défini). On choisit la recherche par type de
+    ``Mobile`` via ``Mobile.recherches``:
+
+    .. code-block:: python
+
+        mobile.Mobile.recherches[mobile.Mobile.MOVE] = simulation.pathfinder.Bidirectionnel()
+    """
+
+    def __init__(self, heuristique=True, rayon=math.inf):
+        """
+        :param bool heuristique: A* si vrai, sinon Dijkstra
+        :param float rayon: coût maximal d'un chemin accepté
+        """
+        self.heuristique = heuristique
+        self.rayon = rayon
+
+    def trouverChemin(self, start, goal, masque=0xFFFFFFFF, stats=None):
+        """ Même interface et même format de chemin qu'``aStar.trouverChemin``: le but en
+        premier et le départ à la fin, ou seulement ``[goal]`` si le départ est un voisin
+        du but. Comme pour ``aStar``, le nombre de noeuds développés est ajouté à
+        ``stats["expansions"]``. """
+        if start in goal.voisins:
+            return [goal]
+        return self.construireChemin(start, goal, masque, stats)
+
+    def construireChemin(self, start, goal, masque=0xFFFFFFFF, stats=None):
+        fermes = (set(), set())
+        try:
+            return self._chercher(start, goal, masque, fermes)
+        finally:
+            if stats is not None:
+                stats["expansions"] = stats.get("expansions", 0) + len(fermes[0]) + len(fermes[1])
+
+    def _chercher(self, start, goal, masque, fermes):
+        if start is goal:
+            return [goal]
+        if goal.coloris & masque == 0:
+            return []
+        adjacence = aStar.sous_graphes.voisins(masque) if aStar.sous_graphes is not None else None
+        table = aStar.distances
+        dist = table.cout if table is not None else aStar.dist
+        h = table.heuristique if table is not None else aStar.heuristic
+        if self.heuristique:
+            if h(start, goal) > self.rayon:
+                return []
+            potentiel = lambda v: (h(v, goal) - h(start, v)) / 2
+        else:
+            potentiel = lambda v: 0.0
+
+        g = ({start: 0.0}, {goal: 0.0}) # g[0]: depuis start, g[1]: depuis goal
+        came_from = ({start: None}, {goal: None})
+        heaps = ([(potentiel(start), start)], [(-potentiel(goal), goal)])
+        signe = (1, -1) # cle avant: g + p(v), cle arriere: g - p(v)
+        mu = math.inf # meilleur cout trouve
+        milieu = None
+        while heaps[0] and heaps[1]:
+            borne = heaps[0][0][0] + heaps[1][0][0]
+            if borne >= mu:
+                break
+            if borne > self.rayon: # borne inferieure du cout restant
+                return []
+            s = 0 if len(heaps[0]) <= len(heaps[1]) else 1 # on developpe la plus petite frontiere
+            current = heapq.heappop(heaps[s])[1]
+            if current in fermes[s]:
+                continue
+            fermes[s].add(current)
+            if s == 1: # en arriere, start est admissible meme hors du masque
+                voisins = [n for n in current.voisins if n is start or n.coloris & masque > 0]
+            elif adjacence is not None:
+                voisins = adjacence.get(current, ())
+            else:
+                voisins = [n for n in current.voisins if n.coloris & masque > 0]
+            gs, autre = g[s], g[1-s]
+            for n in voisins:
+                if n in fermes[s]:
+                    continue
+                gn = gs[current] + dist(current, n)
+                if n not in gs or gn < gs[n]:
+                    gs[n] = gn
+                    came_from[s][n] = current
+                    heapq.heappush(heaps[s], (gn + signe[s] * potentiel(n), n))
+                    if n in autre and gn + autre[n] < mu:
+                        mu = gn + autre[n]
+                        milieu = n
+        if milieu is None or mu > self.rayon:
+            return []
+        # chemin au format aStar: goal en premier, start a la fin
+        chemin = []
+        n = milieu
+        while n is not None:
+            chemin.append(n)
+            n = came_from[1][n]
+        chemin.reverse()
+        n = came_from[0][milieu]
+        while n is not None:
+            chemin.append(n)
+            n = came_from[0][n]
+        return chemin
+
+
+class Banc:
+    """ Banc d'essai des algorithmes de recherche de chemin. :meth:`comparer` est un
+    benchmark reproductible (taille de grille, graine et nombre de paires en paramètres)
+    des métriques d'``aStar``, y compris l'ancienne somme des distances au carré:
+
+    .. code-block:: python
+
+        simulation.pathfinder.Banc.comparer(nx=60, ny=60, trous=0.2, npaires=100, seed=1)
+    """
+
+    class Carree:
+        """ Ancienne métrique d'``aStar`` (coût et heuristique en distance au carré), gardée
+        comme référence pour :meth:`Banc.comparer`. """
+
+        @staticmethod
+        def cout(a, b):
+            dx = a.box.pos[0] - b.box.pos[0]
+            dy = a.box.pos[1] - b.box.pos[1]
+            return dx*dx + dy*dy
+
+        heuristique = cout
+
+    @staticmethod
+    def grille(nx, ny, pas=10, trous=0.0, seed=1):
+        """ Graphe de test: grille 4-connexe de nx par ny noeuds espacés de ``pas`` pixels,
+        dont une fraction ``trous`` des noeuds, tirée avec la graine ``seed``, est absente.
+
+        :return: couple (entity manager, liste des ``Noeud``)
+        """
+        rng = random.Random(seed)
+        em = ecs.EntityManager()
+        noeuds = {}
+        for i in range(nx):
+            for j in range(ny):
+                if rng.random() < trous:
+                    continue
+                e = em.create_entity()
+                box = graphe.Box((i*pas, j*pas), (pas, pas))
+                em.add_component(e, box)
+                n = graphe.Noeud(e)
+                n.box = box
+                em.add_component(e, n)
+                noeuds[(i, j)] = n
+        for (i, j), n in noeuds.items():
+            for v in (noeuds.get((i+1, j)), noeuds.get((i, j+1))):
+                if v is not None:
+                    arete = graphe.Arete(em.create_entity(), n, v)
+                    em.add_component(arete.entity, arete)
+                    n.oua.append(arete)
+                    v.ina.append(arete)
+        for n in noeuds.values():
+            n.calculerVoisins()
+        return em, list(noeuds.values())
+
+    @staticmethod
+    def paires(noeuds, n, seed=1):
+        """ n paires (start, goal) tirées avec la graine ``seed``. """
+        rng = random.Random(seed)
+        return [(rng.choice(noeuds), rng.choice(noeuds)) for _ in range(n)]
+
+    @staticmethod
+    def comparer(nx=60, ny=60, trous=0.2, npaires=100, seed=1):
+        """ Compare, sur :meth:`grille` et les mêmes :meth:`paires`, les noeuds développés et
+        la longueur euclidienne totale des chemins pour l'ancienne métrique au carré et pour
+        les métriques ``EUCLIDIENNE`` et ``MANHATTAN`` (``PHYSIQUE`` demande des ``Phys``).
+
+        :return: dictionnaire nom -> (noeuds développés, longueur totale)
+        """
+        em, noeuds = Banc.grille(nx, ny, trous=trous, seed=seed)
+        paires = Banc.paires(noeuds, npaires, seed)
+        metriques = [("carree (avant)", Banc.Carree),
+                     ("euclidienne", TableDistances(noeuds, Metrique.EUCLIDIENNE)),
+                     ("manhattan", TableDistances(noeuds, Metrique.MANHATTAN))]
+        ancienne = aStar.distances
+        resultats = {}
+        try:
+            for nom, table in metriques:
+                aStar.distances = table
+                stats = {"expansions": 0}
+                longueur = 0.0
+                for start, goal in paires:
+                    chemin = aStar.trouverChemin(start, goal, stats=stats)
+                    longueur += sum(aStar.dist(a, b) for a, b in zip(chemin, chemin[1:]))
+                resultats[nom] = (stats["expansions"], longueur)
+                print("{0:>16} expansions: {1:>8}  longueur: {2:>10.0f}".format(nom, *resultats[nom]))
+        finally:
+            aStar.distances = ancienne
+        return resultats
+
+    @staticmethod
+    def expansions(algo, paires, masque=0xFFFFFFFF):
+        """ Cherche le chemin de chaque paire (start, goal) avec ``algo`` (une classe ou un objet
+        avec ``trouverChemin(start, goal, masque, stats)``, qui compte ses noeuds développés
+        dans ``stats``).
+
+        :return: couple (noeuds développés, longueur totale des chemins en noeuds)
+
+        Les longueurs sont comparables entre ``aStar``, :class:`Bidirectionnel` et tout
+        algorithme qui retourne le même format de chemin (départ inclus).
+        """
+        stats = {"expansions": 0}
+        longueur = 0
+        for start, goal in paires:
+            longueur += len(algo.trouverChemin(start, goal, masque, stats))
+        return stats["expansions"], longueur
+
+
+class TableReservation:
+    """ Table de réservation espace-temps partagée par les mobiles d'un même rail. Un agent
+    réserve un noeud pour une seconde, ou le passage d'un noeud a vers un noeud b pendant une
+    seconde (pour empêcher deux agents de se croiser sur une arête). Un agent arrêté au bout
+    de son chemin occupe son noeud pour une durée indéterminée (un arrêt). Les réservations
+    passées sont retirées par :meth:`purger`. """
+
+    def __init__(self):
+        self.noeuds = {} # (noeud, t) -> agent
+        self.aretes = {} # (a, b, t) -> agent
+        self.arrets = {} # noeud -> (agent, t du debut de l'arret)
+        self.cles = defaultdict(list) # agent -> cles reservees dans noeuds et aretes
+        self.par_temps = defaultdict(list) # t -> cles reservees a ce temps, pour purger
+        self.tmax = 0 # plus grand temps reserve
+        self.tmin = 0 # temps avant lequel tout est purge
+
+    def libre(self, noeud, t, agent=None):
+        """ Vrai si le noeud n'est pas réservé au temps t par un autre agent. """
+        arret = self.arrets.get(noeud)
+        if arret is not None and arret[0] is not agent and t >= arret[1]:
+            return False
+        return self.noeuds.get((noeud, t), agent) is agent
+
+    def libre_depuis(self, noeud, t, agent=None):
+        """ Vrai si le noeud est libre à partir du temps t pour toujours, donc si l'agent
+        peut s'y arrêter. """
+        arret = self.arrets.get(noeud)
+        if arret is not None and arret[0] is not agent:
+            return False
+        return all(self.noeuds.get((noeud, k), agent) is agent for k in range(t, self.tmax+1))
+
+    def libre_arete(self, a, b, t, agent=None):
+        """ Vrai si aller de a vers b pendant la seconde t ne croise pas un autre agent. """
+        return self.aretes.get((b, a, t), agent) is agent
+
+    def _ajouter(self, table, cle, agent):
+        table[cle] = agent
+        self.cles[agent].append(cle)
+        self.par_temps[cle[-1]].append(cle)
+
+    def reserver(self, agent, chemin, t0, garde=None, temps=None):
+        """ Réserve le chemin chronologique pour l'agent, puis la dernière position pour
+        ``garde`` secondes de plus ou, si ``garde`` est None, pour une durée indéterminée
+        (arrêt). L'agent reste sur un noeud jusqu'à son arrivée au suivant et occupe l'arête
+        entre les deux pendant tout le saut.
+
+        :param chemin: noeuds visités, en commençant par la position au temps t0
+        :param t0: temps de départ
+        :param temps: temps d'arrivée à chaque noeud de ``chemin`` (défaut: t0, t0+1, ...)
+        """
+        if temps is None:
+            temps = range(t0, t0 + len(chemin))
+        for k, n in enumerate(chemin):
+            t = temps[k]
+            self._ajouter(self.noeuds, (n, t), agent)
+            if k > 0:
+                a, ta = chemin[k-1], temps[k-1]
+                for s in range(ta+1, t): # sur a jusqu'au saut
+                    self._ajouter(self.noeuds, (a, s), agent)
+                if n is not a:
+                    for s in range(ta, t):
+                        self._ajouter(self.aretes, (a, n, s), agent)
+        fin = temps[len(chemin)-1]
+        self.tmax = max(self.tmax, fin)
+        if garde is None:
+            self.arrets[chemin[-1]] = (agent, fin)
+        else:
+            for t in range(fin+1, fin+1+garde):
+                self._ajouter(self.noeuds, (chemin[-1], t), agent)
+            self.tmax = max(self.tmax, fin+garde)
+
+    def liberer(self, agent):
+        """ Retire toutes les réservations de l'agent. """
+        for noeud in [n for n, arret in self.arrets.items() if arret[0] is agent]:
+            del self.arrets[noeud]
+        for cle in self.cles.pop(agent, []):
+            table = self.noeuds if len(cle) == 2 else self.aretes
+            if table.get(cle) is agent:
+                del table[cle]
+
+    def purger(self, t):
+        """ Retire les réservations antérieures au temps t. Le coût est proportionnel au
+        nombre de réservations retirées. """
+        if t <= self.tmin:
+            return
+        if t - self.tmin > len(self.par_temps):
+            passes = [k for k in self.par_temps if k < t]
+        else:
+            passes = range(self.tmin, t)
+        for k in passes:
+            for cle in self.par_temps.pop(k, ()):
+                (self.noeuds if len(cle) == 2 else self.aretes).pop(cle, None)
+        for agent in list(self.cles):
+            cles = self.cles[agent]
+            if cles and cles[0][-1] < t: # les cles d'un agent sont presque triees par temps
+                self.cles[agent] = [c for c in cles if c[-1] >= t]
+        self.tmin = t
+
+
+class CooperatifAStar:
+    """ Recherche de chemin coopérative (windowed hierarchical cooperative A*, Silver 2005).
+    Les agents planifient à tour de rôle dans l'espace-temps (noeud, t) en évitant les
+    réservations des autres dans une :class:`TableReservation`, puis réservent leur propre
+    chemin. Un agent peut attendre sur place. La recherche est limitée à une fenêtre de
+    ``fenetre`` secondes; l'agent replanifie lorsqu'il a consommé son chemin partiel. On
+    n'accepte le but que si l'agent peut y rester (aucun autre agent n'y passe plus tard), et
+    l'agent l'occupe ensuite jusqu'à sa prochaine planification.
+    L'heuristique est la vraie distance en sauts jusqu'au but (sans les autres agents),
+    calculée une fois par but et par masque.
+
+    Le temps est en secondes de simulation. Chaque saut (ou attente) est réservé avec sa vraie
+    durée, donnée par ``agent.dureeSaut(premier)``: pour un mobile, c'est la durée d'un saut
+    ``TIMED_JUMP``, le seul type dont le rythme suit la table (voir
+    :meth:`mobile.mobile.Mobile.dureeSaut`). Un agent sans ``dureeSaut`` fait des sauts de
+    ``pas`` secondes. Les réservations passées sont purgées à chaque planification.
+
+    Les chemins retournés ont le format de ``aStar``: le prochain noeud à la fin de la liste,
+    sans le noeud de départ. Une attente se traduit par une répétition du noeud.
+
+    Exemple d'utilisation:
+
+    .. code-block:: python
+
+        planificateur = simulation.pathfinder.CooperatifAStar(fenetre=120)
+        for pont in ponts:
+            pont.mobile.planificateur = planificateur
+    """
+
+    def __init__(self, reservations=None, fenetre=32, garde=None, pas=1):
+        """
+        :param reservations: table partagée, une nouvelle par défaut
+        :type reservations: :class:`TableReservation`
+        :param int fenetre: profondeur de la fenêtre de recherche en secondes
+        :param garde: nb de secondes réservées sur place à la fin d'un chemin, None pour un
+            arrêt qui dure jusqu'à la prochaine planification de l'agent
+        :param int pas: durée d'un saut en secondes pour un agent sans ``dureeSaut``
+        """
+        self.reservations = reservations if reservations is not None else TableReservation()
+        self.fenetre = fenetre
+        self.garde = garde
+        self.pas = pas
+        self._distances = {} # (but, masque) -> dict noeud -> nb de sauts jusqu'au but
+
+    @staticmethod
+    def voisins(noeud, masque):
+        """ Voisins admissibles du noeud selon le masque. """
+        if aStar.sous_graphes is not None:
+            return aStar.sous_graphes.voisins(masque).get(noeud, ())
+        return [n for n in noeud.voisins if n.coloris & masque > 0]
+
+    def distances(self, goal, masque):
+        """ Nb de sauts de chaque noeud jusqu'au but (parcours en largeur à partir du but). """
+        try:
+            return self._distances[(goal, masque)]
+        except KeyError:
+            pass
+        dist = {goal: 0}
+        frontiere = [goal]
+        while frontiere:
+            prochaine = []
+            for n in frontiere:
+                for v in CooperatifAStar.voisins(n, masque):
+                    if v not in dist:
+                        dist[v] = dist[n] + 1
+                        prochaine.append(v)
+            frontiere = prochaine
+        self._distances[(goal, masque)] = dist
+        return dist
+
+    def oublier(self):
+        """ Vide la cache des heuristiques (à faire si le graphe change). """
+        self._distances = {}
+
+    def durees(self, agent):
+        """ Durées (secondes, au moins 1) du premier saut d'un chemin et des suivants. """
+        duree = getattr(agent, 'dureeSaut', None)
+        if duree is None:
+            return self.pas, self.pas
+        return max(1, duree(True)), max(1, duree(False))
+
+    def trouverChemin(self, agent, start, goal, masque=0xFFFFFFFF, t0=None):
+        """ Planifie et réserve le chemin de l'agent de start vers goal à partir du temps t0
+        (par défaut, le temps courant selon le ``Moment``).
+
+        :return: le chemin (format ``aStar``), vide si le but est inatteignable
+        """
+        if t0 is None:
+            t0 = base.Moment.get_instance().t
+        table = self.reservations
+        table.purger(t0)
+        table.liberer(agent)
+        h = self.distances(goal, masque)
+        if start not in h:
+            table.reserver(agent, [start], t0, self.garde)
+            return []
+        premier, suivant = self.durees(agent)
+        dh = min(premier, suivant) # heuristique admissible: nb de sauts x duree minimale
+        came_from = {(start, t0): None}
+        openHeap = [(h[start]*dh, h[start], 0, start, t0)]
+        closeSet = set()
+        no = 0 # departage les egalites sans comparer les noeuds
+        fin = None
+        while openHeap:
+            f, hn, k, current, t = heapq.heappop(openHeap)
+            if (current, t) in closeSet:
+                continue
+            closeSet.add((current, t))
+            if (current is goal and table.libre_depuis(goal, t, agent)) or t - t0 >= self.fenetre:
+                fin = (current, t)
+                break
+            d = premier if t == t0 else suivant
+            if not all(table.libre(current, s, agent) for s in range(t+1, t+d)):
+                continue # on ne peut pas rester sur current le temps du saut
+            for n in list(CooperatifAStar.voisins(current, masque)) + [current]:
+                if n not in h or (n, t+d) in closeSet:
+                    continue
+                if not table.libre(n, t+d, agent):
+                    continue
+                if n is not current and not all(table.libre_arete(current, n, s, agent)
+                                                for s in range(t, t+d)):
+                    continue
+                no += 1
+                came_from.setdefault((n, t+d), (current, t))
+                heapq.heappush(openHeap, (t+d-t0+h[n]*dh, h[n], no, n, t+d))
+        if fin is None: # bloque partout, on attend sur place
+            table.reserver(agent, [start], t0, self.garde)
+            return [start]
+        etats = []
+        etat = fin
+        while etat is not None:
+            etats.append(etat)
+            etat = came_from[etat]
+        etats.reverse()
+        table.reserver(agent, [e[0] for e in etats], t0, self.garde, [e[1] for e in etats])
+        chemin = [e[0] for e in reversed(etats)]
+        chemin.pop() # on retire le depart
+        return chemin
+
+
+class CheminHierarchique:
+    """ Recherche de chemin hiérarchique (HPA*, Botea et al. 2004). Le graphe est découpé en
+    grappes selon une clé par noeud: par défaut le sous-graphe (SG) du coloris, mais on peut
+    aussi utiliser le SSG ou le ``Secteur``. Les noeuds bordures ont un voisin dans une autre
+    grappe. On précalcule les distances bordure-à-bordure dans chaque grappe, ce qui forme un
+    petit graphe abstrait. Une requête relie le départ et le but aux bordures de leur grappe,
+    cherche dans le graphe abstrait, puis raffine chaque segment intra-grappe au besoin (avec
+    une cache). Les arêtes avec une ``barriere`` sont infranchissables (par défaut); lorsqu'un
+    flag ``barriere`` change, les grappes touchées sont recalculées à la requête suivante.
+    Le coût d'une arête est la distance euclidienne entre les ``Box.pos``. L'abonnement à
+    l'événement "barriere" du ``base.Publisher`` garde l'instance en vie: quand on n'en a plus
+    besoin (par exemple entre deux réplications), il faut appeler :meth:`detacher`.
+
+    Exemple d'utilisation pour les véhicules:
+
+    .. code-block:: python
+
+        sg = simulation.graphe.SousGraphes(entity_manager)
+        hpa = simulation.pathfinder.CheminHierarchique(sg.noeuds, cle=lambda n: n.coloris >> 4)
+        vehicule.mobile.planificateur = hpa
+        ...
+        hpa.detacher()
+    """
+
+    def __init__(self, noeuds, cle=None, masque=0xFFFFFFFF, barriere_bloque=True):
+        """
+        :param noeuds: les ``Noeud`` du graphe
+        :param cle: fonction noeud -> identifiant de grappe (défaut: ``coloris >> 8``)
+        :param masque: masque de coloris des noeuds admissibles
+        :param barriere_bloque: si vrai, les arêtes avec une barrière sont infranchissables
+        """
+        self.noeuds = list(noeuds)
+        self.cle = cle if cle is not None else (lambda n: n.coloris >> 8)
+        self.masque = masque
+        self.barriere_bloque = barriere_bloque
+        base.Publisher.get_instance().register("barriere", self, CheminHierarchique.notifier)
+        self.attache = True # abonne a l'evenement "barriere"
+        self.construire()
+
+    def detacher(self):
+        """ Désabonne l'instance de l'événement "barriere"; ses grappes ne suivent plus les
+        barrières. """
+        if self.attache:
+            base.Publisher.get_instance().unregister("barriere", self)
+            self.attache = False
+
+    def construire(self):
+        """ (Re)construit les grappes, les bordures et les distances intra-grappe. """
+        self.grappe = {n: self.cle(n) for n in self.noeuds} # noeud -> grappe
+        self.membres = defaultdict(set) # grappe -> noeuds
+        for n, c in self.grappe.items():
+            self.membres[c].add(n)
+        self.intra = {} # grappe -> dict bordure -> liste de (bordure, cout)
+        self.sales = set() # grappes a recalculer
+        self._raffinements = {} # (u, v) -> segment de u vers v dans leur grappe
+        self._bordures()
+        for c in self.membres:
+            self._intra(c)
+
+    @staticmethod
+    def cout(a, b):
+        """ Distance euclidienne entre deux noeuds. """
+        dx = a.box.pos[0] - b.box.pos[0]
+        dy = a.box.pos[1] - b.box.pos[1]
+        return math.sqrt(dx*dx + dy*dy)
+
+    def aretes(self, n):
+        """ Voisins franchissables de n avec le coût de l'arête. """
+        for a in n.oua:
+            if not (a.barriere and self.barriere_bloque) and a.to.coloris & self.masque > 0 and a.to in self.grappe:
+                yield a.to, CheminHierarchique.cout(n, a.to)
+        for a in n.ina:
+            if not (a.barriere and self.barriere_bloque) and a.fr.coloris & self.masque > 0 and a.fr in self.grappe:
+                yield a.fr, CheminHierarchique.cout(n, a.fr)
+
+    def _bordures(self):
+        """ Calcule les bordures de chaque grappe et les arêtes inter-grappes. """
+        self.inter = defaultdict(list) # bordure -> liste de (voisin d'une autre grappe, cout)
+        self.bordures = defaultdict(set) # grappe -> bordures
+        for n in self.noeuds:
+            for v, c in self.aretes(n):
+                if self.grappe[v] != self.grappe[n]:
+                    self.inter[n].append((v, c))
+                    self.bordures[self.grappe[n]].add(n)
+
+    def _dijkstra(self, source, c, cibles=()):
+        """ Dijkstra à partir de source, limité à la grappe c. On arrête lorsque toutes les
+        cibles sont atteintes (ou la grappe épuisée).
+
+        :return: couple (dist, came_from) de dictionnaires
+        """
+        membres = self.membres[c]
+        restantes = set(cibles)
+        restantes.discard(source)
+        dist = {source: 0.0}
+        came_from = {source: None}
+        heap = [(0.0, 0, source)]
+        no = 0
+        fermes = set()
+        while heap and restantes:
+            d, k, n = heapq.heappop(heap)
+            if n in fermes:
+                continue
+            fermes.add(n)
+            restantes.discard(n)
+            for v, cv in self.aretes(n):
+                if v in membres and v not in fermes and d + cv < dist.get(v, math.inf):
+                    dist[v] = d + cv
+                    came_from[v] = n
+                    no += 1
+                    heapq.heappush(heap, (d + cv, no, v))
+        return dist, came_from
+
+    def _intra(self, c):
+        """ Distances entre les bordures de la grappe c. """
+        bordures = self.bordures[c]
+        liens = {}
+        for b in bordures:
+            dist, came_from = self._dijkstra(b, c, bordures)
+            liens[b] = [(b2, dist[b2]) for b2 in bordures if b2 is not b and b2 in dist]
+        self.intra[c] = liens
+
+    def notifier(self, arete, valeur):
+        """ Callback de l'événement "barriere": marque les grappes de l'arête à recalculer. """
+        for n in (arete.fr, arete.to):
+            if n in self.grappe:
+                self.sales.add(self.grappe[n])
+
+    def _valider(self):
+        """ Recalcule les bordures et les grappes marquées ou dont les bordures ont changé. """
+        if not self.sales:
+            return
+        anciennes = {c: set(b) for c, b in self.bordures.items()}
+        self._bordures()
+        for c in self.membres:
+            if c in self.sales or self.bordures.get(c, set()) != anciennes.get(c, set()):
+                self._intra(c)
+        self.sales = set()
+        self._raffinements = {}
+
+    @staticmethod
+    def _remonter(came_from, n):
+        chemin = []
+        while n is not None:
+            chemin.append(n)
+            n = came_from[n]
+        chemin.reverse()
+        return chemin
+
+    def _raffiner(self, u, v):
+        """ Segment de u vers v dans leur grappe (avec cache). """
+        try:
+            return self._raffinements[(u, v)]
+        except KeyError:
+            pass
+        dist, came_from = self._dijkstra(u, self.grappe[u], (v,))
+        segment = CheminHierarchique._remonter(came_from, v)
+        self._raffinements[(u, v)] = segment
+        return segment
+
+    def chercher(self, start, goal):
+        """ Chemin chronologique de start à goal (inclus), vide si inatteignable. """
+        self._valider()
+        if start is goal:
+            return [start]
+        cs, cg = self.grappe[start], self.grappe[goal]
+        if cs == cg:
+            dist, came_from = self._dijkstra(start, cs, (goal,))
+            if goal in dist: # peut-etre pas optimal si un detour par une autre grappe est plus court
+                return CheminHierarchique._remonter(came_from, goal)
+        ds, came_s = self._dijkstra(start, cs, self.bordures[cs])
+        dg, came_g = self._dijkstra(goal, cg, self.bordures[cg])
+        sorties = {b: dg[b] for b in self.bordures[cg] if b in dg}
+        # A* sur le graphe abstrait, avec start et goal inseres
+        g_score = {start: 0.0}
+        came_from = {start: None}
+        heap = [(CheminHierarchique.cout(start, goal), 0, start)]
+        no = 0
+        fermes = set()
+        while heap:
+            f, k, n = heapq.heappop(heap)
+            if n is goal:
+                break
+            if n in fermes:
+                continue
+            fermes.add(n)
+            if n is start:
+                voisins = [(b, ds[b]) for b in self.bordures[cs] if b in ds] + self.inter.get(n, [])
+            else:
+                voisins = self.intra[self.grappe[n]].get(n, []) + self.inter.get(n, [])
+                if n in sorties:
+                    voisins = voisins + [(goal, sorties[n])]
+            for v, cv in voisins:
+                g = g_score[n] + cv
+                if v not in fermes and g < g_score.get(v, math.inf):
+                    g_score[v] = g
+                    came_from[v] = n
+                    no += 1
+                    heapq.heappush(heap, (g + CheminHierarchique.cout(v, goal), no, v))
+        if goal not in came_from:
+            return []
+        abstrait = CheminHierarchique._remonter(came_from, goal)
+        # raffinement des segments
+        chemin = [start]
+        for u, v in zip(abstrait, abstrait[1:]):
+            if self.grappe[u] != self.grappe[v]:
+                segment = [u, v]
+            elif u is start:
+                segment = CheminHierarchique._remonter(came_s, v)
+            elif v is goal:
+                segment = list(reversed(CheminHierarchique._remonter(came_g, u)))
+            else:
+                segment = self._raffiner(u, v)
+            chemin.extend(segment[1:])
+        return chemin
+
+    def trouverChemin(self, agent, start, goal, masque=None):
+        """ Interface de planificateur d'un ``Mobile``: chemin au même format qu'``aStar``
+        (le but en premier et le départ à la fin, ou ``[goal]`` si le départ est un voisin
+        du but), pour que le mobile fasse les mêmes pas qu'avec ``aStar``. Le masque est
+        celui donné à la construction. """
+        if start in goal.voisins:
+            return [goal]
+        chemin = self.chercher(start, goal)
+        chemin.reverse()
+        return chemin
@@ -3,7 +3,7 @@ Composants reliés au stochastique.
 ----------------------------------
 """
 
-import random, math
+import random, math, heapq
 from bisect import bisect
 from collections import defaultdict
 from abc import ABCMeta, abstractmethod
@@ -12,6 +12,128 @@ from .. import ecs
 from . import base
 from . import kanban
 
+class FluxAleatoire(random.Random):
+    """ Générateur d'un flux nommé. Les entiers (``randrange``, ``randint``, ``choice``, etc.) 
+    sont tirés d'un seul uniforme de ``random()`` plutôt que de ``getrandbits``, pour que 
+    chaque tirage consomme le flux de la même façon que dans la variante antithétique. """
+
+    def _randbelow(self, n):
+        return int(random.Random.random(self) * n) # u dans [0,1), donc dans [0,n)
+
+
+class FluxAntithetique(FluxAleatoire):
+    """ Générateur dont les uniformes sont 1-u plutôt que u, et les entiers tirés dans [0,n) 
+    sont n-1-k plutôt que k. Les lois qui passent par ``random()`` (triangulaire, uniforme, 
+    trigger, etc.) et celles qui tirent des entiers (fréquences, non-paramétriques) donnent 
+    alors la variable antithétique. Comme pour ``random.random``, l'uniforme reste dans [0,1): 
+    u=0 donne 0 plutôt que 1. """
+
+    def random(self):
+        return (1.0 - super().random()) % 1.0
+
+    def _randbelow(self, n):
+        return n - 1 - int(random.Random.random(self) * n)
+
+
+class Flux:
+    """ Registre de flux (streams) de nombres aléatoires nommés. Chaque source stochastique 
+    tire de son propre flux, semé de façon indépendante à partir d'une racine et du nom du flux. 
+    Deux scénarios avec la même racine restent ainsi synchronisés sur les bris, même si l'un 
+    des deux fait plus de tirages dans d'autres sources (nombres aléatoires communs). Une source 
+    construite sans nom de flux reçoit un flux nommé d'après sa classe et son rang de création 
+    (voir :meth:`pour`), de sorte qu'un modèle construit dans le même ordre retrouve les mêmes 
+    flux. Avec ``antithetique=True``, tous les flux nommés produisent la réplication antithétique 
+    de celle obtenue avec la même racine (voir :class:`FluxAntithetique`); le flux global 
+    (``random``) n'est pas concerné. Toutes les méthodes sont statiques.
+
+    Exemple d'utilisation pour une paire antithétique:
+
+    .. code-block:: python
+
+        stochastique.Flux.configurer(1234)
+        # ... construction et simulation du modele ...
+        stochastique.Flux.configurer(1234, antithetique=True)
+        # ... construction et simulation du modele ...
+
+    """
+
+    racine = 0 # racine commune de tous les flux
+    antithetique = False # True pour la replication antithetique
+    _flux = {} # les flux deja crees selon leur nom
+    _rangs = defaultdict(int) # classe de source -> nb de flux par defaut crees
+
+    @staticmethod
+    def configurer(racine, antithetique=False):
+        """ Fixe la racine et le mode antithétique. Les flux déjà créés sont semés à nouveau 
+        (les sources déjà construites les gardent) et les rangs de création des flux par défaut 
+        repartent à zéro.
+
+        :param racine: racine commune (int ou str) des flux
+        :param antithetique: si vrai, les flux donnent les variables antithétiques
+        """
+        Flux.racine = racine
+        Flux.antithetique = antithetique
+        Flux._rangs = defaultdict(int)
+        for nom, rng in Flux._flux.items():
+            rng.__class__ = FluxAntithetique if antithetique else FluxAleatoire
+            rng.seed(Flux.graine(nom))
+
+    @staticmethod
+    def graine(nom):
+        return "{0}:{1}".format(Flux.racine, nom)
+
+    @staticmethod
+    def pour(source, nom=None):
+        """ Retourne le flux d'une source stochastique: le flux ``nom`` s'il est donné, sinon 
+        le flux ``"<classe>:<rang>"`` où rang est le nombre de sources de la même classe 
+        construites sans nom depuis le dernier :meth:`configurer`.
+
+        :param source: la source (instance) qui tire du flux
+        :param nom: nom du flux, ou un générateur
+        """
+        if nom is None:
+            classe = type(source).__name__
+            nom = "{0}:{1}".format(classe, Flux._rangs[classe])
+            Flux._rangs[classe] += 1
+        return Flux.get(nom)
+
+    @staticmethod
+    def get(nom):
+        """ Retourne le flux ``nom``, créé au besoin. Un flux est un ``random.Random``.
+        Si ``nom`` est déjà un générateur (ou le module ``random``), on le retourne tel quel
+        et si ``nom`` est None, on retourne le module ``random`` (flux global).
+
+        :param nom: nom du flux (une string)
+        """
+        if nom is None:
+            return random
+        if not isinstance(nom, str):
+            return nom
+        try:
+            return Flux._flux[nom]
+        except KeyError:
+            graine = Flux.graine(nom)
+            rng = FluxAntithetique(graine) if Flux.antithetique else FluxAleatoire(graine)
+            Flux._flux[nom] = rng
+            return rng
+
+    @staticmethod
+    def test(n=100000):
+        """ Vérifie que les uniformes des deux variantes restent dans [0,1), y compris 
+        l'uniforme nul d'un flux antithétique, et que ``EventStochastique.attente`` les accepte. """
+        class Nul(random.Random):
+            def random(self):
+                return 0.0
+        class AntithetiqueNul(FluxAntithetique, Nul):
+            pass
+        for rng in (FluxAleatoire("test"), FluxAntithetique("test"), AntithetiqueNul()):
+            for _ in range(n):
+                u = rng.random()
+                assert 0.0 <= u < 1.0, (type(rng).__name__, u)
+                assert EventStochastique.attente(0.001, rng) >= 1
+        print("Test des flux: uniformes dans [0,1) et attentes valides sur", n, "tirages")
+
+
 class Echantillonnage(metaclass=ABCMeta):
 
     @abstractmethod
@@ -42,29 +164,37 @@ class ConstantValue(Echantillonnage):
 
 class TriggerFrequence(Echantillonnage):
 
-    def __init__(self, freq):
+    def __init__(self, freq, flux=None):
         self.freq=freq
+        self.rng=Flux.pour(self, flux) # flux de nombres aleatoires
 
     def get(self):
-        return random.random()<=self.freq
+        return self.rng.random()<=self.freq
+
+    def attente(self):
+        """ Nombre d'essais (appels à ``get``) jusqu'au prochain succès, au moins 1, tiré en 
+        une seule fois selon la loi géométrique. Retourne None si ``freq<=0``. """
+        return EventStochastique.attente(self.freq, self.rng)
     
 
 class TriangularDistributionSample(Echantillonnage):
 
-    def __init__(self, low, high, mode):
+    def __init__(self, low, high, mode, flux=None):
         self.low = low
         self.high = high
         self.mode = mode
+        self.rng = Flux.pour(self, flux) # flux de nombres aleatoires
 
     def get(self):
-        return random.triangular(self.low, self.high, self.mode)
+        return self.rng.triangular(self.low, self.high, self.mode)
 
 
 class FrequencyDistributionSample(Echantillonnage):
 
-    def __init__(self, x, f):
+    def __init__(self, x, f, flux=None):
         self.x = x # tableau des valeurs
         self.f = f # tableau des frequences 
+        self.rng = Flux.pour(self, flux) # flux de nombres aleatoires
         self.m = len(x) # nb de valeurs differentes dans x
         self.fc = [0]*self.m # tableau des frequences cumules
         if self.m != len(f): print("Erreur FrequencyDistributionSample init: tableaux de tailles differentes.")
@@ -74,7 +204,7 @@ class FrequencyDistributionSample(Echantillonnage):
           self.fc[i]=self.n
 
     def get(self):
-        v = random.randint(1, self.n)
+        v = self.rng.randint(1, self.n)
         for i in range(self.m):
             if v<=self.fc[i]: break
         return self.x[i]
@@ -82,19 +212,21 @@ class FrequencyDistributionSample(Echantillonnage):
 
 class NonParametricNaiveSample(Echantillonnage):
 
-    def __init__(self, x):
+    def __init__(self, x, flux=None):
         self.x = x # tableau des valeurs
         self.n = len(x) # nb de valeurs dans x
+        self.rng = Flux.pour(self, flux) # flux de nombres aleatoires
 
     def get(self):
-        return self.x[random.randrange(self.n)]
+        return self.x[self.rng.randrange(self.n)]
 
 
 class NonParametricKDESample(Echantillonnage):
 
-    def __init__(self, x):
+    def __init__(self, x, flux=None):
         self.x = x # tableau des valeurs
         self.n = len(x) # nb de valeurs dans x
+        self.rng = Flux.pour(self, flux) # flux de nombres aleatoires
         self.m = 0
         self.s = 0
         self.h=0.0
@@ -106,11 +238,11 @@ class NonParametricKDESample(Echantillonnage):
             print("n,m,s,h=",self.n,self.m,self.s,self.h)
 
     def get(self): 
-        v = self.x[random.randrange(self.n)]
+        v = self.x[self.rng.randrange(self.n)]
         w = 0.0
         for i in range(10): # on essai 10x, sinon on prends 0
-            u=random.random()
-            w=random.uniform(-1.0,1.0)
+            u=self.rng.random()
+            w=self.rng.uniform(-1.0,1.0)
             if u<=(1.0-w*w):
                 break
         # on limite la bandwidth a 50% de variation max de la valeur
@@ -121,58 +253,111 @@ class NonParametricKDESample(Echantillonnage):
 
 class Stochastique(ecs.Component):
 
-    def __init__(self, cible):
+    def __init__(self, cible, flux=None):
         self.trigger_events = {}
         self.trigger = False
         self.cible = cible
+        self.rng = Flux.pour(self, flux) # flux de nombres aleatoires des events
+        self.echeancier = None # handle sur le systeme EventStochastique qui planifie les events
 
     def add_event(self, name, p, te, pe):
         self.trigger_events[name] = (p, list(zip(te,pe)))
+        if self.echeancier is not None:
+            self.echeancier.planifier(self, name)
 
     def remove_event(self, name):
-        del self.trigger_events[name]
+        del self.trigger_events[name] # l'entree dans l'echeancier devient perimee
 
 
 class EventStochastique(ecs.System):
-
-    def __init__(self, seed = -1):
+    """ Déclenche les events des composants ``Stochastique``. Plutôt que de faire un essai de 
+    Bernoulli par event à chaque seconde, on tire le temps d'attente du prochain déclenchement 
+    selon une loi géométrique de paramètre p et on garde ces temps dans un tas (heap). 
+    Le coût d'un update se limite donc à consulter le sommet du tas. Par absence de mémoire 
+    de la loi géométrique, le comportement statistique est le même que celui des essais 
+    à chaque seconde. Les composants ajoutés ou retirés de l'entity manager sont pris en 
+    compte à l'update suivant; les entrées du tas d'un composant retiré sont ignorées. """
+
+    def __init__(self, seed=-1):
+        """:param seed: si différent de -1, racine des flux nommés (voir :meth:`Flux.configurer`) 
+            et du flux global ``random``
+        """
         super().__init__()
-        if seed == -1:
-            seed=random.randint(0, 1999999717)
-        print("Racine:",seed)
-        random.seed(seed)
+        if seed != -1:
+            Flux.configurer(seed, Flux.antithetique)
+            random.seed(seed)
+        self.t = 0 # temps (secondes) depuis le debut, somme des dt
+        self.heap = [] # tas de (t declenchement, no, composant, nom event, event)
+        self.no = 0 # compteur pour departager les egalites dans le tas
+        self.connus = set() # composants Stochastique planifies par ce systeme
+        self.version = -1 # version des composants Stochastique lors du dernier scan
 
     def reset(self):
         pass
 
     def init(self):
-        pass
+        self.scan()
+
+    def scan(self):
+        """ Planifie les events des composants ``Stochastique`` ajoutés depuis le dernier scan 
+        et oublie ceux qui ont été retirés. """
+        presents = {sto for entity, sto in self.entity_manager.pairs_for_type(Stochastique)}
+        for sto in self.connus - presents:
+            sto.echeancier = None # ses entrees dans le tas deviennent perimees
+        for sto in presents - self.connus:
+            sto.echeancier = self
+            for name, event in list(sto.trigger_events.items()):
+                # nouvelle identite de l'event: les entrees deja dans le tas deviennent perimees
+                sto.trigger_events[name] = (event[0], event[1])
+                self.planifier(sto, name)
+        self.connus = presents
+        self.version = self.entity_manager.version(Stochastique)
+
+    @staticmethod
+    def attente(p, rng=random):
+        """ Tire le nombre de secondes avant le prochain succès d'essais de Bernoulli de 
+        probabilité p (loi géométrique, au moins 1). Retourne None si p<=0. """
+        if p <= 0:
+            return None
+        if p >= 1:
+            return 1
+        u = 1.0 - rng.random() # u dans ]0,1]
+        return 1 + int(math.log(u) / math.log(1.0 - p))
+
+    def planifier(self, sto, name):
+        """ Insère dans le tas le prochain déclenchement de l'event ``name`` de ``sto``. """
+        event = sto.trigger_events[name]
+        k = EventStochastique.attente(event[0], sto.rng)
+        if k is not None:
+            self.no += 1
+            heapq.heappush(self.heap, (self.t + k, self.no, sto, name, event))
 
     def update(self, dt):
-
-        for entity, sto in self.entity_manager.pairs_for_type(Stochastique):
-            for event in sto.trigger_events.values():
+        self.t += dt
+        if self.entity_manager.version(Stochastique) != self.version:
+            self.scan()
+        declenches = set() # au plus un event par composant par update
+        while self.heap and self.heap[0][0] <= self.t:
+            t, no, sto, name, event = heapq.heappop(self.heap)
+            if sto.echeancier is not self or sto.trigger_events.get(name) is not event:
+                continue # composant retire, event retire ou remplace: entree perimee
+            if sto not in declenches:
+                declenches.add(sto)
                 p, choices = event
-                u = random.random()
-                if u <= p:
-                    #sto.trigger = True
-                #if sto.cible.actif and sto.cible.utilisable and sto.trigger:
-                    #sto.trigger = False
-                    choice = self.weighted_choice(choices)
-                    sto.cible.temps_event = choice.get()
-                    bris = kanban.DelayedKanban("BRIS")
-                    bris.duree = choice.get() * 60 #Events en minute alors on multiplie par 60 pour avoir les secondes
-                    sto.cible.bris.append(bris)
-                    break
-
-    def weighted_choice(self, choices):
+                choice = self.weighted_choice(choices, sto.rng)
+                sto.cible.temps_event = choice.get()
+                bris = kanban.DelayedKanban("BRIS")
+                bris.duree = choice.get() * 60 #Events en minute alors on multiplie par 60 pour avoir les secondes
+                sto.cible.bris.append(bris)
+            self.planifier(sto, name)
+
+    def weighted_choice(self, choices, rng=random):
         weights, values = zip(*choices)
         total = 0
         cumulative_weights = []
         for w in weights:
             total += w
             cumulative_weights.append(total)
-        x = random.random() * total
+        x = rng.random() * total
         i = bisect(cumulative_weights, x)
         return values[i]
-